@@ -4,78 +4,137 @@
 AI错误分析系统 - API服务
 """
 
-from flask import Flask, jsonify, request, Response
+from flask import Flask, jsonify, request, Response, has_request_context, send_file
 from flask_cors import CORS
 import configparser
-import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error, pooling
+from mysql.connector.errors import PoolError
 import os
 import sys
 import json
+import socket
 import subprocess
 import time
 import glob
-from datetime import datetime
+import gzip
+import hashlib
+import re
+from datetime import datetime, date
+from decimal import Decimal
+from threading import Lock
+
+try:
+    import fcntl  # Windows没有：waitress单进程运行，进程内的分析锁已经足够
+except ImportError:
+    fcntl = None
+
+try:
+    import orjson  # 可选依赖：安装后自动启用更快的序列化后端
+except ImportError:
+    orjson = None
+
+try:
+    import brotli  # 可选依赖：客户端支持时优先使用brotli压缩
+except ImportError:
+    brotli = None
 
 # 添加项目根目录到Python路径
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_ROOT)
+sys.path.append(os.path.join(PROJECT_ROOT, 'src', 'AIProcess'))
+
+from AI_process import get_config as get_analysis_config
+from dataExport import DATASETS, EXPORT_FORMATS, export_dataset, get_export_config
+from markCode import generate_mark_code
+from runJournal import JournalTail, journal_path
+from runMetrics import format_prometheus, get_metrics_config, load_run_metrics, metrics
+from schemaMigration import SchemaOutdatedError, ensure_table, is_current
+from stratifiedSample import estimate_shares, get_sampling_config
+from taskSchedule import CANCEL_REASONS, cancel_path, cancel_requested, clear_cancel, request_cancel
 
 app = Flask(__name__)
-CORS(app)  # 允许跨域请求
+CORS(app, expose_headers=['ETag', 'Last-Modified'])  # 允许跨域请求，并允许前端读取缓存相关响应头
 
 # 配置JSON返回中文不转义
 app.config['JSON_AS_ASCII'] = False
 
+def _json_default(obj):
+    """处理标准JSON不支持的类型（datetime/date/Decimal）"""
+    if isinstance(obj, datetime):
+        return obj.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(obj, date):
+        return obj.strftime('%Y-%m-%d')
+    if isinstance(obj, Decimal):
+        return int(obj) if obj == obj.to_integral_value() else float(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
 class DateTimeEncoder(json.JSONEncoder):
     """自定义JSON编码器，处理datetime类型"""
     def default(self, obj):
-        if isinstance(obj, datetime):
-            return obj.strftime('%Y-%m-%d %H:%M:%S')
-        return super().default(obj)
-
-def safe_json_serialize(data):
-    """安全的JSON序列化，处理datetime等特殊类型"""
-    return json.dumps(data, cls=DateTimeEncoder, ensure_ascii=False, indent=2)
-    """自定义JSON编码器，保持原始转义字符"""
-    def encode(self, obj):
-        # 使用默认编码，但不转换转义字符
-        result = super().encode(obj)
-        return result
-    
-    def iterencode(self, obj, _one_shot=False):
-        """重写iterencode方法以保持原始字符串格式"""
-        if isinstance(obj, str):
-            # 对于字符串，我们需要特殊处理以保持原始转义字符
-            yield json.dumps(obj, ensure_ascii=False)
-        elif isinstance(obj, dict):
-            yield '{'
-            first = True
-            for key, value in obj.items():
-                if not first:
-                    yield ', '
-                first = False
-                yield json.dumps(key, ensure_ascii=False)
-                yield ': '
-                yield from self.iterencode(value, _one_shot)
-            yield '}'
-        elif isinstance(obj, list):
-            yield '['
-            first = True
-            for item in obj:
-                if not first:
-                    yield ', '
-                first = False
-                yield from self.iterencode(item, _one_shot)
-            yield ']'
-        else:
-            yield json.dumps(obj, ensure_ascii=False)
+        try:
+            return _json_default(obj)
+        except TypeError:
+            return super().default(obj)
+
+def _dumps_stdlib(data, pretty):
+    return json.dumps(data, cls=DateTimeEncoder, ensure_ascii=False,
+                      indent=2 if pretty else None,
+                      separators=None if pretty else (',', ':'))
+
+def _dumps_orjson(data, pretty):
+    # OPT_PASSTHROUGH_DATETIME 让datetime走_json_default，保持 '%Y-%m-%d %H:%M:%S' 格式不变
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+    if pretty:
+        option |= orjson.OPT_INDENT_2
+    return orjson.dumps(data, default=_json_default, option=option)
+
+# 可用的序列化后端，可通过config.ini [Server] json_backend 选择
+JSON_BACKENDS = {
+    'json': _dumps_stdlib,
+}
+if orjson is not None:
+    JSON_BACKENDS['orjson'] = _dumps_orjson
+
+def get_json_backend():
+    """根据配置选择序列化后端，auto时优先使用orjson"""
+    backend = db_manager.config.get('Server', 'json_backend', fallback='auto').strip().lower()
+    if backend == 'auto':
+        backend = 'orjson' if 'orjson' in JSON_BACKENDS else 'json'
+    if backend not in JSON_BACKENDS:
+        print(f"序列化后端 {backend} 不可用，回退到标准库json")
+        backend = 'json'
+    return JSON_BACKENDS[backend]
+
+def want_pretty_json():
+    """是否格式化输出：请求参数 ?pretty=1 优先，否则读取配置（默认紧凑输出）"""
+    if has_request_context() and 'pretty' in request.args:
+        return request.args.get('pretty', '1').lower() not in ('0', 'false', 'no')
+    return db_manager.config.getboolean('Server', 'json_pretty', fallback=False)
+
+def safe_json_serialize(data, pretty=None):
+    """安全的JSON序列化，处理datetime等特殊类型，返回UTF-8字节串"""
+    if pretty is None:
+        pretty = want_pretty_json()
+    with metrics.timer('serialization'):
+        result = _json_backend(data, pretty)
+    return result.encode('utf-8') if isinstance(result, str) else result
+
+def json_response(data, status=200):
+    """构建JSON响应"""
+    return Response(
+        safe_json_serialize(data),
+        mimetype='application/json; charset=utf-8',
+        status=status
+    )
 
 class DatabaseManager:
-    """数据库管理类"""
+    """数据库管理类（每个进程一个连接池，多线程/多进程部署时线程安全）"""
     
     def __init__(self):
         self.config = self._load_config()
-        self.connection = None
+        self.pool = None
+        self._pool_pid = None
+        self._pool_lock = Lock()
     
     def _load_config(self):
         """加载配置文件"""
@@ -84,48 +143,95 @@ class DatabaseManager:
         config.read(config_path, encoding='utf-8')
         return config
     
-    def connect(self):
-        """连接数据库"""
+    def _get_pool(self):
+        """获取当前进程的连接池，fork出的worker进程会重新创建自己的连接池"""
+        pid = os.getpid()
+        if self.pool is not None and self._pool_pid == pid:
+            return self.pool
+        
+        with self._pool_lock:
+            if self.pool is None or self._pool_pid != pid:
+                pool_size = self.config.getint('Server', 'db_pool_size', fallback=8)
+                self.pool = pooling.MySQLConnectionPool(
+                    pool_name=f"api_pool_{pid}",
+                    pool_size=min(max(pool_size, 1), 32),  # mysql-connector连接池上限为32
+                    host=self.config.get('Database', 'host'),
+                    port=self.config.getint('Database', 'port'),
+                    user=self.config.get('Database', 'user'),
+                    password=self.config.get('Database', 'password'),
+                    database=self.config.get('Database', 'database'),
+                    charset='utf8mb4',
+                    autocommit=True,  # 启用自动提交
+                    use_unicode=True
+                )
+                self._pool_pid = pid
+        return self.pool
+    
+    def get_connection(self):
+        """从连接池取出一个连接，用完后调用close()归还"""
         try:
-            self.connection = mysql.connector.connect(
-                host=self.config.get('Database', 'host'),
-                port=self.config.getint('Database', 'port'),
-                user=self.config.get('Database', 'user'),
-                password=self.config.get('Database', 'password'),
-                database=self.config.get('Database', 'database'),
-                charset='utf8mb4',
-                autocommit=True,  # 启用自动提交
-                use_unicode=True
-            )
+            pool = self._get_pool()
+            # 连接池耗尽时get_connection会立即抛出PoolError，这里短暂等待其他线程归还连接
+            for _ in range(50):
+                try:
+                    connection = pool.get_connection()
+                    break
+                except PoolError:
+                    time.sleep(0.1)
+            else:
+                connection = pool.get_connection()
             
-            # 设置事务隔离级别
-            cursor = self.connection.cursor()
+            # 设置事务隔离级别（归还连接池时会重置会话，因此每次取出时设置）
+            cursor = connection.cursor()
             cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL READ COMMITTED")
             cursor.close()
             
-            return True
+            return connection
         except Error as e:
             print(f"数据库连接失败: {e}")
+            return None
+    
+    def connect(self):
+        """检查数据库是否可连接"""
+        connection = self.get_connection()
+        if connection is None:
             return False
+        connection.close()
+        return True
     
-    def disconnect(self):
-        """断开数据库连接"""
-        if self.connection and self.connection.is_connected():
-            self.connection.close()
+    def ensure_table(self, kind, table_name):
+        """
+        检查表是否存在并保证表结构为最新版本（见schemaMigration）
+        每个进程只在第一次遇到该表时访问数据库，之后直接返回
+        """
+        if is_current(kind, table_name):
+            return True
+        connection = self.get_connection()
+        if connection is None:
+            return False
+        try:
+            return ensure_table(connection, kind, table_name, create=False)
+        except Error as e:
+            print(f"检查表结构失败: {e}")
+            return False
+        finally:
+            connection.close()
     
     def execute_query(self, query, params=None, max_retries=3):
         """执行查询，带重试机制"""
         for attempt in range(max_retries):
+            connection = None
             try:
-                if not self.connection or not self.connection.is_connected():
-                    if not self.connect():
-                        print("数据库连接失败")
-                        return None
+                connection = self.get_connection()
+                if connection is None:
+                    print("数据库连接失败")
+                    return None
                 
-                cursor = self.connection.cursor(dictionary=True)
-                cursor.execute(query, params or ())
-                result = cursor.fetchall()
-                cursor.close()
+                with metrics.timer('db_query'):
+                    cursor = connection.cursor(dictionary=True)
+                    cursor.execute(query, params or ())
+                    result = cursor.fetchall()
+                    cursor.close()
                 return result
                 
             except Error as e:
@@ -134,8 +240,6 @@ class DatabaseManager:
                 # 如果是表定义变更错误(1412)，重试
                 if error_code == 1412 and attempt < max_retries - 1:
                     print(f"表定义已变更，正在重试 (尝试 {attempt + 1}/{max_retries})")
-                    # 断开并重新连接
-                    self.disconnect()
                     time.sleep(0.1)  # 短暂等待
                     continue
                 
@@ -147,6 +251,13 @@ class DatabaseManager:
                 print(f"执行查询时发生未知错误: {e}")
                 print(f"查询语句: {query}")
                 return None
+            
+            finally:
+                if connection is not None:
+                    try:
+                        connection.close()  # 归还连接池
+                    except Exception:
+                        pass
         
         print(f"查询重试 {max_retries} 次后仍然失败")
         return None
@@ -154,6 +265,159 @@ class DatabaseManager:
 # 全局数据库管理器
 db_manager = DatabaseManager()
 
+# term_id / question_id 会拼接到表名、文件路径和子进程参数中，只接受ASCII数字
+_ID_PATTERN = re.compile(r'^[0-9]+$')
+
+# answer_hash 为十六进制摘要（md5 / sha1 / sha256）
+_HASH_PATTERN = re.compile(r'^[0-9a-fA-F]{32,64}$')
+
+def is_valid_id(value):
+    return value is not None and _ID_PATTERN.match(str(value)) is not None
+
+def validate_ids(term_id, question_id):
+    """
+    校验请求中的term_id和question_id，必须在访问数据库或文件之前调用
+    返回 (term_id, question_id, 错误响应)，ID转换为字符串，校验通过时错误响应为None
+    """
+    if not term_id or not question_id:
+        return term_id, question_id, json_response({
+            'success': False,
+            'message': '缺少必要参数: term_id 和 question_id',
+            'data': None
+        }, status=400)
+    term_id, question_id = str(term_id), str(question_id)
+    if not is_valid_id(term_id) or not is_valid_id(question_id):
+        return term_id, question_id, json_response({
+            'success': False,
+            'message': 'term_id 和 question_id 必须是有效的数字',
+            'data': None
+        }, status=400)
+    return term_id, question_id, None
+
+# 每个 (term_id, question_id) 一把锁，避免并发请求对同一题目重复执行分析
+_analysis_locks = {}
+_analysis_locks_guard = Lock()
+
+def get_analysis_lock(term_id, question_id):
+    with _analysis_locks_guard:
+        return _analysis_locks.setdefault((str(term_id), str(question_id)), Lock())
+
+# 每条结果一把锁，同时打开同一条结果时只调用一次LLM生成标记代码
+_mark_code_locks = {}
+_mark_code_locks_guard = Lock()
+
+def acquire_analysis_file_lock(term_id, question_id):
+    """
+    跨进程的分析锁：gunicorn多个worker时，进程内的分析锁挡不住其他worker同时分析同一题目（两次运行会共用运行日志和取消文件）
+    其他进程持有时等待其完成；返回打开的锁文件，关闭即释放；没有fcntl时返回None
+    """
+    if fcntl is None:
+        return None
+    lock_dir = os.path.join(PROJECT_ROOT, db_manager.config.get('Schedule', 'cancel_dir', fallback='data/cancel'))
+    os.makedirs(lock_dir, exist_ok=True)
+    # ID已由validate_ids检查，只包含数字
+    lock_file = open(os.path.join(lock_dir, f"analysis_{term_id}_{question_id}.lock"), 'a')
+    try:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print(f"其他进程正在分析同一题目，等待其完成 [term_id={term_id}, question_id={question_id}]")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+    except BaseException:
+        lock_file.close()
+        raise
+    return lock_file
+
+def get_mark_code_lock(term_id, question_id, answer_hash):
+    with _mark_code_locks_guard:
+        return _mark_code_locks.setdefault((str(term_id), str(question_id), answer_hash), Lock())
+
+# 启动时确定序列化后端
+_json_backend = get_json_backend()
+
+def _etag_matches(etag):
+    """检查请求头If-None-Match是否命中当前ETag（忽略弱校验前缀和压缩后缀）"""
+    if_none_match = request.headers.get('If-None-Match')
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    current = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        candidate = candidate.replace('-gzip"', '"').replace('-br"', '"')
+        if candidate == current:
+            return True
+    return False
+
+def _not_modified_since(last_modified):
+    """没有If-None-Match时，按If-Modified-Since判断是否未修改"""
+    if last_modified is None or 'If-None-Match' in request.headers:
+        return False
+    if_modified_since = request.if_modified_since
+    if if_modified_since is None:
+        return False
+    return last_modified.replace(microsecond=0) <= if_modified_since.replace(tzinfo=None)
+
+def _set_cache_headers(response, etag, last_modified=None):
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'no-cache'  # 允许缓存，但每次使用前需重新验证
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
+
+def not_modified_response(etag, last_modified=None):
+    """构建304响应"""
+    metrics.increment('http_cache_hit')
+    return _set_cache_headers(Response(status=304), etag, last_modified)
+
+def cached_json_response(data, etag=None, last_modified=None):
+    """构建带ETag的JSON响应，未提供etag时按响应内容计算哈希"""
+    body = safe_json_serialize(data)
+    if etag is None:
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+    if _etag_matches(etag) or _not_modified_since(last_modified):
+        return not_modified_response(etag, last_modified)
+    response = Response(body, mimetype='application/json; charset=utf-8')
+    return _set_cache_headers(response, etag, last_modified)
+
+@app.after_request
+def compress_response(response):
+    """对较大的JSON响应按Accept-Encoding进行brotli/gzip压缩"""
+    min_size = db_manager.config.getint('Server', 'compress_min_size', fallback=1024)
+    if (min_size < 0
+            or response.status_code != 200
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype != 'application/json'):
+        return response
+    
+    body = response.get_data()
+    if len(body) < min_size:
+        return response
+    
+    accept_encoding = request.headers.get('Accept-Encoding', '').lower()
+    level = db_manager.config.getint('Server', 'compress_level', fallback=6)
+    if brotli is not None and 'br' in accept_encoding:
+        encoding = 'br'
+        compressed = brotli.compress(body, quality=min(level, 11))
+    elif 'gzip' in accept_encoding:
+        encoding = 'gzip'
+        compressed = gzip.compress(body, compresslevel=min(max(level, 1), 9))
+    else:
+        return response
+    
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    # 压缩后的表示与原始内容不同，ETag加上编码后缀以区分
+    etag = response.headers.get('ETag')
+    if etag and etag.endswith('"'):
+        response.headers['ETag'] = f'{etag[:-1]}-{encoding}"'
+    return response
+
 @app.route('/domain/api/overview', methods=['GET'])
 def get_overview():
     """
@@ -209,25 +473,17 @@ def get_overview():
                 missing_tables.append(question_info_table)
             
             if missing_tables:
-                return Response(
-                    safe_json_serialize({
-                        'success': False,
-                        'message': f'数据表不存在: {", ".join(missing_tables)}',
-                        'data': []
-                    }),
-                    mimetype='application/json; charset=utf-8',
-                    status=404
-                )
+                return json_response({
+                    'success': False,
+                    'message': f'数据表不存在: {", ".join(missing_tables)}',
+                    'data': []
+                }, status=404)
             else:
-                return Response(
-                    safe_json_serialize({
-                        'success': False,
-                        'message': '数据库查询失败',
-                        'data': []
-                    }),
-                    mimetype='application/json; charset=utf-8',
-                    status=500
-                )
+                return json_response({
+                    'success': False,
+                    'message': '数据库查询失败',
+                    'data': []
+                }, status=500)
         
         # 构建数据框格式的返回数据
         data_frame = []
@@ -267,13 +523,8 @@ def get_overview():
             'data': data_frame
         }
         
-        # 使用安全序列化保持原始转义字符
-        json_str = safe_json_serialize(response_data)
-        
-        return Response(
-            json_str,
-            mimetype='application/json; charset=utf-8'
-        )
+        # 基于响应内容生成ETag，客户端数据未变化时返回304
+        return cached_json_response(response_data)
         
     except Exception as e:
         response_data = {
@@ -281,18 +532,91 @@ def get_overview():
             'message': f'服务器错误: {str(e)}',
             'data': []
         }
-        return Response(
-            json.dumps(response_data, ensure_ascii=False, indent=2),
-            mimetype='application/json; charset=utf-8',
-            status=500
-        )
+        return json_response(response_data, status=500)
+
+def get_clustering_version(term_id, question_id):
+    """
+    获取聚类结果的版本信息，用于生成ETag
+    只查询行数和max(updated_at)，无需读取完整结果即可判断结果是否变化；
+    updated_at在插入和每次修改行（重新分析、作答人数、标记代码）时更新
+    """
+    ai_table_name = f"ai_{term_id}"
+    records_table = db_manager.config.get('DataTable', 'records_table')
+    if not db_manager.ensure_table('ai', ai_table_name):
+        return None, None
+    
+    # 行数：删除结果后即使剩余行的updated_at都较早，结果也视为已变化
+    ai_version = db_manager.execute_query(
+        f"SELECT COUNT(*) AS row_count, MAX(updated_at) AS last_modified "
+        f"FROM {ai_table_name} WHERE question_id = %s",
+        (question_id,)
+    )
+    records_version = db_manager.execute_query(
+        f"SELECT COUNT(*) AS record_count FROM {records_table} WHERE term_id = %s AND question_id = %s",
+        (term_id, question_id)
+    )
+    if not ai_version or not records_version or not ai_version[0]['row_count']:
+        return None, None
+    
+    last_modified = ai_version[0]['last_modified']
+    version_key = (f"{term_id}:{question_id}:{ai_version[0]['row_count']}:"
+                   f"{last_modified}:{records_version[0]['record_count']}")
+    etag = 'W/"' + hashlib.sha1(version_key.encode('utf-8')).hexdigest() + '"'
+    return etag, last_modified
+
+@app.route('/domain/api/clustering', methods=['GET'])
+def get_clustering_cached():
+    """
+    查询已有的聚类分析结果（不触发分析）
+    支持ETag/Last-Modified条件请求，结果未变化时返回304
+    """
+    term_id, question_id, error = validate_ids(request.args.get('term_id'), request.args.get('question_id'))
+    if error is not None:
+        return error
+    
+    etag, last_modified = get_clustering_version(term_id, question_id)
+    if etag is None:
+        return json_response({
+            'success': False,
+            'message': '暂无分析结果，请先调用 POST /domain/api/clustering 执行分析',
+            'term_id': term_id,
+            'question_id': question_id
+        }, status=404)
+    
+    if _etag_matches(etag) or _not_modified_since(last_modified):
+        return not_modified_response(etag, last_modified)
+    
+    analysis_results = get_clustering_results(term_id, question_id)
+    if not (analysis_results and isinstance(analysis_results, dict) and 'detailed_data' in analysis_results):
+        return json_response({
+            'success': False,
+            'message': '暂无分析结果，请先调用 POST /domain/api/clustering 执行分析',
+            'term_id': term_id,
+            'question_id': question_id
+        }, status=404)
+    
+    detailed_data = analysis_results['detailed_data']
+    response_data = {
+        'success': True,
+        'message': '聚类分析完成（使用现有结果）',
+        'term_id': term_id,
+        'question_id': question_id,
+        'statistics': detailed_data['statistics'],
+        'ai_table_data': detailed_data['ai_table_data']
+    }
+    return cached_json_response(response_data, etag=etag, last_modified=last_modified)
 
 @app.route('/domain/api/clustering', methods=['POST'])
 def clustering_analysis():
     """
     聚类分析接口
     完整流程：先执行AI分析生成结果表，再统计返回聚类数据
+    可选参数:
+      sample: true 或样本量，只分析分层样本，categories_summary中返回各分类学生比例的估计值和置信区间
+      fill_remaining: 抽样分析后是否在后台继续分析剩余记录，默认读取 [Sampling] fill_remaining
     """
+    analysis_lock = None
+    analysis_file = None
     try:
         # 获取请求参数
         data = request.get_json()
@@ -302,48 +626,72 @@ def clustering_analysis():
                 'message': '请求参数不能为空',
                 'data': None
             }
-            return Response(
-                safe_json_serialize(response_data),
-                mimetype='application/json; charset=utf-8',
-                status=400
-            )
-        
-        term_id = data.get('term_id')
-        question_id = data.get('question_id')
+            return json_response(response_data, status=400)
         
-        if not term_id or not question_id:
-            response_data = {
-                'success': False,
-                'message': '缺少必要参数: term_id 和 question_id',
-                'data': None
-            }
-            return Response(
-                safe_json_serialize(response_data),
-                mimetype='application/json; charset=utf-8',
-                status=400
-            )
+        # 两个ID都会作为分析子进程的参数
+        term_id, question_id, error = validate_ids(data.get('term_id'), data.get('question_id'))
+        if error is not None:
+            return error
         
-        # 验证参数格式
-        try:
-            term_id = str(term_id)
-            question_id = str(question_id)
-        except:
-            response_data = {
-                'success': False,
-                'message': 'term_id 和 question_id 必须是有效的数字',
-                'data': None
-            }
-            return Response(
-                safe_json_serialize(response_data),
-                mimetype='application/json; charset=utf-8',
-                status=400
-            )
+        # 抽样分析：sample为true时使用 [Sampling] sample_size（0）
+        sample = data.get('sample')
+        sample_size = None
+        if sample is True:
+            sample_size = 0
+        elif sample not in (None, False):
+            try:
+                sample_size = int(sample)
+                if sample_size <= 0:
+                    raise ValueError
+            except (TypeError, ValueError):
+                return json_response({
+                    'success': False,
+                    'message': 'sample 必须是 true 或正整数',
+                    'data': None
+                }, status=400)
+        fill_remaining = bool(data.get('fill_remaining', get_sampling_config()['fill_remaining']))
         
         print(f"开始聚类分析流程 [term_id={term_id}, question_id={question_id}]")
         
-        # 首先检查是否已有结果
+        # 同一题目的分析请求在进程内串行，后到的请求等前一次完成后直接使用其结果，不重复调用LLM
+        analysis_lock = get_analysis_lock(term_id, question_id)
+        if not analysis_lock.acquire(blocking=False):
+            print(f"同一题目的分析正在进行，等待其完成 [term_id={term_id}, question_id={question_id}]")
+            analysis_lock.acquire()
+        # 其他worker进程的分析请求同样等待其完成
+        analysis_file = acquire_analysis_file_lock(term_id, question_id)
+        
+        # 抽样分析后的后台补全仍在进行（本进程或运行日志显示其他进程正在写入）时不再启动第二个分析进程，返回当前已完成的结果
+        background_fill = fill_running(term_id, question_id)
+        tail = get_journal_tail(term_id, question_id)
+        if tail is not None:
+            tail.poll()
+        if background_fill or (tail is not None and tail.running(JOURNAL_STALE_SECONDS)):
+            partial_results = get_clustering_results(term_id, question_id)
+            detailed_data = (partial_results or {}).get('detailed_data') or {'statistics': {}, 'ai_table_data': []}
+            return json_response({
+                'success': True,
+                'partial': True,
+                'background_fill': True,
+                'message': '后台正在继续分析剩余记录，返回已完成的部分结果' if background_fill
+                           else '其他进程正在分析该题目，返回已完成的部分结果',
+                'term_id': term_id,
+                'question_id': question_id,
+                'statistics': detailed_data['statistics'],
+                'ai_table_data': detailed_data['ai_table_data']
+            })
+        
+        # 首先检查是否已有结果；只有覆盖全部学生的结果直接返回，
+        # 超时、取消或抽样留下的部分结果用 --resume 继续分析剩余记录（已完成和已失败的记录不再提交）
+        resume = False
         analysis_results = get_clustering_results(term_id, question_id)
         if analysis_results and isinstance(analysis_results, dict) and 'detailed_data' in analysis_results:
+            existing_statistics = analysis_results['detailed_data']['statistics']
+            resume = existing_statistics['coverage'] < 1 and existing_statistics['total_users_count'] > 0
+        if resume:
+            print(f"现有分析结果只覆盖 {existing_statistics['coverage'] * 100:.1f}% 的学生，继续分析剩余记录"
+                  f" [term_id={term_id}, question_id={question_id}]")
+        elif analysis_results and isinstance(analysis_results, dict) and 'detailed_data' in analysis_results:
             print(f"找到现有分析结果，直接返回 [term_id={term_id}, question_id={question_id}]")
             
             detailed_data = analysis_results['detailed_data']
@@ -357,12 +705,9 @@ def clustering_analysis():
                 'ai_table_data': detailed_data['ai_table_data']  # AI表中的所有数据（已包含聚合的用户信息）
             }
             
-            return Response(
-                safe_json_serialize(response_data),
-                mimetype='application/json; charset=utf-8'
-            )
-        
-        print(f"没有找到现有分析结果，开始执行分析流程 [term_id={term_id}, question_id={question_id}]")
+            return json_response(response_data)
+        else:
+            print(f"没有找到现有分析结果，开始执行分析流程 [term_id={term_id}, question_id={question_id}]")
         
         # 步骤1: 执行AI分析流程
         start_time = time.time()
@@ -371,31 +716,71 @@ def clustering_analysis():
         config = configparser.ConfigParser()
         config.read(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config.ini'), encoding='utf-8')
         analysis_timeout = config.getint('API', 'analysis_timeout', fallback=600)
+        cancel_grace = config.getfloat('API', 'cancel_grace', fallback=30.0)
+        # 数据处理和AI分析共用同一个截止时间
+        deadline = start_time + analysis_timeout
+        cancel_file = get_cancel_file(term_id, question_id)
+        clear_cancel(cancel_file)
         
-        commands = [
-            (f"python src/AIProcess/dataProcess.py {term_id} {question_id}", "步骤1: 数据处理"),
-            (f"python src/AIProcess/AI_process.py {term_id} {question_id}", "步骤2: AI分析")
+        sample_args = ['--sample', str(sample_size)] if sample_size is not None else []
+        resume_args = ['--resume'] if resume else []
+        steps = [
+            ('data_process', "步骤1: 数据处理", ['src/AIProcess/dataProcess.py', term_id, question_id]),
+            ('ai_process', "步骤2: AI分析", ['src/AIProcess/AI_process.py', term_id, question_id, *sample_args, *resume_args])
         ]
         
-        for cmd, step_name in commands:
+        for stage, step_name, args in steps:
             step_start = time.time()
-            print(f"执行 {step_name} [term_id={term_id}, question_id={question_id}]: {cmd}")
+            # 只有AI分析支持取消文件：收到取消后停止调度、写完报告再退出；数据处理取消时直接结束
+            grace = 0
+            if stage == 'ai_process':
+                # AI分析在截止时间前按时间预算停止调度，先完成作答人数多的记录，剩余时间用于等待进行中的请求和写报告
+                remaining = deadline - step_start
+                time_budget = max(remaining - 60, remaining * 0.8, 1)
+                args = [*args, '--time-budget', f"{time_budget:.0f}"]
+                grace = min(cancel_grace, remaining / 2)
+            cmd = [sys.executable, *args]
+            print(f"执行 {step_name} [term_id={term_id}, question_id={question_id}]: {' '.join(cmd)}")
             
             try:
-                result = subprocess.run(
-                    cmd, 
-                    shell=True, 
-                    capture_output=True, 
-                    text=True, 
-                    timeout=analysis_timeout,  # 使用配置的超时时间
-                    encoding='utf-8',
-                    errors='replace',  # 添加错误处理，用替换字符代替无法解码的字节
-                    cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # 设置工作目录为项目根目录
-                )
+                returncode, stdout, stderr, cancel_reason = run_pipeline_step(
+                    cmd, deadline, cancel_file, grace, request.environ)
                 
                 step_duration = time.time() - step_start
+                metrics.observe(stage, step_duration)
                 
-                if result.returncode == 0:
+                if cancel_reason is not None:
+                    print(f"⏹️ {step_name} 已取消（{CANCEL_REASONS[cancel_reason]}）"
+                          f" [term_id={term_id}, question_id={question_id}] ({step_duration:.2f}秒)")
+                    if cancel_reason == 'deadline':
+                        metrics.increment('analysis_timeout')
+                    status_message = '执行超时' if cancel_reason == 'deadline' else f'已取消（{CANCEL_REASONS[cancel_reason]}）'
+                    # 结果逐条写入ai表，取消时返回已完成的部分结果（优先分析的是作答人数多的错误）
+                    partial_results = get_clustering_results(term_id, question_id) if stage == 'ai_process' else None
+                    if partial_results and 'detailed_data' in partial_results:
+                        detailed_data = partial_results['detailed_data']
+                        response_data = {
+                            'success': True,
+                            'partial': True,
+                            'cancel_reason': cancel_reason,
+                            'message': f'{step_name} {status_message}，返回已完成的部分结果',
+                            'term_id': term_id,
+                            'question_id': question_id,
+                            'statistics': detailed_data['statistics'],
+                            'ai_table_data': detailed_data['ai_table_data']
+                        }
+                        return json_response(response_data)
+                    response_data = {
+                        'success': False,
+                        'cancel_reason': cancel_reason,
+                        'message': f'{step_name} {status_message}',
+                        'term_id': term_id,
+                        'question_id': question_id,
+                        'result_list': []
+                    }
+                    return json_response(response_data, status=500)
+                
+                if returncode == 0:
                     print(f"✅ {step_name} 执行成功 [term_id={term_id}, question_id={question_id}] ({step_duration:.2f}秒)")
                 else:
                     response_data = {
@@ -404,27 +789,9 @@ def clustering_analysis():
                         'term_id': term_id,
                         'question_id': question_id,
                         'result_list': [],
-                        'error_details': result.stderr
+                        'error_details': stderr
                     }
-                    return Response(
-                        safe_json_serialize(response_data),
-                        mimetype='application/json; charset=utf-8',
-                        status=500
-                    )
-                    
-            except subprocess.TimeoutExpired:
-                response_data = {
-                    'success': False,
-                    'message': f'{step_name} 执行超时',
-                    'term_id': term_id,
-                    'question_id': question_id,
-                    'result_list': []
-                }
-                return Response(
-                    safe_json_serialize(response_data),
-                    mimetype='application/json; charset=utf-8',
-                    status=500
-                )
+                    return json_response(response_data, status=500)
                 
             except Exception as e:
                 response_data = {
@@ -434,11 +801,7 @@ def clustering_analysis():
                     'question_id': question_id,
                     'result_list': []
                 }
-                return Response(
-                    safe_json_serialize(response_data),
-                    mimetype='application/json; charset=utf-8',
-                    status=500
-                )
+                return json_response(response_data, status=500)
         
         total_duration = time.time() - start_time
         print(f"AI分析完成 [term_id={term_id}, question_id={question_id}]，总耗时: {total_duration:.2f}秒")
@@ -453,12 +816,19 @@ def clustering_analysis():
             
             response_data = {
                 'success': True,
-                'message': '聚类分析完成',
+                'message': '聚类分析完成' if sample_size is None else '抽样分析完成，分类占比为估计值',
                 'term_id': term_id,
                 'question_id': question_id,
                 'statistics': detailed_data['statistics'],  # 统计信息放在前面
                 'ai_table_data': detailed_data['ai_table_data']  # AI表中的所有数据（已包含聚合的用户信息）
             }
+            if sample_size is not None:
+                response_data['background_fill'] = (fill_remaining and detailed_data['statistics']['coverage'] < 1
+                                                    and start_background_fill(term_id, question_id))
+            elif detailed_data['statistics']['coverage'] < 1:
+                # 运行日志中失败的记录没有结果，可用 AI_process.py --retry-failed 重试
+                response_data['partial'] = True
+                response_data['message'] = '聚类分析完成，部分记录分析失败，返回已完成的部分结果'
         else:
             # 没有分析结果或分析失败
             print(f"警告：AI分析完成但没有生成结果 [term_id={term_id}, question_id={question_id}]")
@@ -471,11 +841,10 @@ def clustering_analysis():
                 'ai_table_data': []
             }
         
-        return Response(
-            safe_json_serialize(response_data),
-            mimetype='application/json; charset=utf-8'
-        )
+        return json_response(response_data)
         
+    except SchemaOutdatedError:
+        raise
     except Exception as e:
         response_data = {
             'success': False,
@@ -484,11 +853,135 @@ def clustering_analysis():
             'question_id': question_id if 'question_id' in locals() else '',
             'result_list': []
         }
-        return Response(
-            safe_json_serialize(response_data),
-            mimetype='application/json; charset=utf-8',
-            status=500
+        return json_response(response_data, status=500)
+    finally:
+        if analysis_file is not None:
+            analysis_file.close()
+        if analysis_lock is not None:
+            analysis_lock.release()
+
+def get_cancel_file(term_id, question_id):
+    cancel_dir = os.path.join(PROJECT_ROOT, db_manager.config.get('Schedule', 'cancel_dir', fallback='data/cancel'))
+    return cancel_path(cancel_dir, term_id, question_id)
+
+def client_disconnected(environ):
+    """
+    客户端是否已断开：gunicorn在environ中提供连接的socket，非阻塞读到EOF表示客户端已关闭连接；
+    其他服务器（waitress、Flask开发服务器）无法检测，总是返回False，可由页面调用取消接口
+    """
+    sock = environ.get('gunicorn.socket')
+    if sock is None or not hasattr(socket, 'MSG_DONTWAIT'):
+        return False
+    try:
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+    except BlockingIOError:
+        return False
+    except OSError:
+        return True
+
+# 等待分析子进程时检查截止时间、客户端连接和取消请求的间隔（秒）
+CANCEL_POLL_SECONDS = 1.0
+
+def run_pipeline_step(cmd, deadline, cancel_file, cancel_grace, environ):
+    """
+    运行分析流程的一个步骤，返回 (returncode, stdout, stderr, cancel_reason)
+    到达 deadline - cancel_grace、客户端断开或收到取消请求（取消接口写入cancel_file）时写入取消文件，
+    AI_process停止调度、写完结果和报告后退出；cancel_grace秒后仍未退出时结束子进程。
+    cancel_reason为None表示正常结束
+    """
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        encoding='utf-8',
+        errors='replace',  # 用替换字符代替无法解码的字节
+        cwd=PROJECT_ROOT  # 设置工作目录为项目根目录
+    )
+    cancel_reason = None
+    kill_at = deadline
+    while True:
+        try:
+            stdout, stderr = process.communicate(timeout=CANCEL_POLL_SECONDS)
+            return process.returncode, stdout, stderr, cancel_reason
+        except subprocess.TimeoutExpired:
+            pass
+        
+        now = time.time()
+        if cancel_reason is None:
+            if client_disconnected(environ):
+                cancel_reason = 'client_disconnected'
+            elif cancel_requested(cancel_file):
+                cancel_reason = 'cancelled'
+            elif now >= deadline - cancel_grace:
+                cancel_reason = 'deadline'
+            if cancel_reason is not None:
+                metrics.increment(f'analysis_cancel_{cancel_reason}')
+                kill_at = min(now + cancel_grace, deadline)
+        if cancel_reason is not None:
+            if now >= kill_at:
+                process.kill()
+                stdout, stderr = process.communicate()
+                metrics.increment('analysis_killed')
+                return process.returncode, stdout, stderr, cancel_reason
+            # AI_process启动时会清除旧的取消文件，在它退出前保持文件存在
+            if not cancel_requested(cancel_file):
+                request_cancel(cancel_file, cancel_reason)
+
+def add_sample_estimates(term_id, question_id, statistics, ai_table_data):
+    """
+    题目有抽样分析的样本（analysisSample_{term_id}）时，在categories_summary的每个分类中加入
+    estimated_share / ci_low / ci_high（该分类覆盖的学生比例的估计值和置信区间），并加入statistics['sampling']
+    """
+    sample_table = f"analysisSample_{term_id}"
+    if not db_manager.ensure_table('sample', sample_table):
+        return
+    sample_rows = db_manager.execute_query(
+        f"SELECT answer_hash, stratum, stratum_records, stratum_users, user_count FROM {sample_table} "
+        f"WHERE question_id = %s",
+        (question_id,)
+    )
+    if not sample_rows:
+        return
+    
+    categories = {record['answer_hash']: record.get('category', '未知') for record in ai_table_data}
+    estimate = estimate_shares(sample_rows, categories, get_sampling_config()['confidence'])
+    for category, summary in statistics['categories_summary'].items():
+        summary.update(estimate['categories'].get(category, {'estimated_share': 0.0, 'ci_low': 0.0, 'ci_high': 0.0}))
+    statistics['sampling'] = {key: value for key, value in estimate.items() if key != 'categories'}
+
+# 抽样分析后在后台继续分析剩余记录的进程 {(term_id, question_id): Popen}
+_fill_processes = {}
+_fill_processes_guard = Lock()
+
+def fill_running(term_id, question_id):
+    """本进程启动的后台补全是否仍在运行"""
+    with _fill_processes_guard:
+        process = _fill_processes.get((term_id, question_id))
+    return process is not None and process.poll() is None
+
+def start_background_fill(term_id, question_id):
+    """
+    在后台运行完整分析（已分析的样本不再调用LLM），同一题目同时只有一个后台进程
+    调用方需持有该题目的分析锁；补全运行期间的分析请求见 fill_running 的检查，不会再启动分析进程
+    """
+    term_id, question_id = str(term_id), str(question_id)
+    if not is_valid_id(term_id) or not is_valid_id(question_id):
+        raise ValueError(f"无效的题目: term_id={term_id}, question_id={question_id}")
+    key = (term_id, question_id)
+    with _fill_processes_guard:
+        process = _fill_processes.get(key)
+        if process is not None and process.poll() is None:
+            return False
+        _fill_processes[key] = subprocess.Popen(
+            [sys.executable, 'src/AIProcess/AI_process.py', term_id, question_id],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            cwd=PROJECT_ROOT
         )
+    metrics.increment('sample_fill_started')
+    print(f"后台继续分析剩余记录 [term_id={term_id}, question_id={question_id}]")
+    return True
 
 def get_clustering_results(term_id, question_id):
     """
@@ -500,21 +993,11 @@ def get_clustering_results(term_id, question_id):
         ai_table_name = f"ai_{term_id}"
         records_table = db_manager.config.get('DataTable', 'records_table')
         
-        # 先检查AI结果表是否存在
-        check_ai_table = f"SHOW TABLES LIKE '{ai_table_name}'"
-        ai_table_exists = db_manager.execute_query(check_ai_table)
-        
-        if not ai_table_exists:
+        # 先检查AI结果表是否存在（表结构确认后缓存在进程内，之后的请求不再查询）
+        if not db_manager.ensure_table('ai', ai_table_name):
             print(f"AI结果表 {ai_table_name} 不存在")
             return []
         
-        # 查看AI表的结构
-        describe_ai_query = f"DESCRIBE {ai_table_name}"
-        ai_table_structure = db_manager.execute_query(describe_ai_query)
-        
-        if ai_table_structure:
-            print(f"AI表结构: {[row['Field'] for row in ai_table_structure]}")
-        
         # 获取AI表中的数据，按question_id筛选
         ai_all_data_query = f"""
         SELECT *
@@ -525,9 +1008,9 @@ def get_clustering_results(term_id, question_id):
         
         ai_all_data = db_manager.execute_query(ai_all_data_query, (question_id,))
         
-        # 获取输入文件中的所有用户数据
+        # 获取输入文件中的所有用户数据（只需要user_id和answer_hash用于聚合）
         all_users_query = f"""
-        SELECT *
+        SELECT user_id, answer_hash
         FROM {records_table}
         WHERE term_id = %s AND question_id = %s
         ORDER BY user_id
@@ -541,7 +1024,12 @@ def get_clustering_results(term_id, question_id):
             'statistics': {
                 'ai_records_count': 0,
                 'input_users_count': 0,
-                'categories_summary': {}
+                'categories_summary': {},
+                'token_usage': {'prompt_tokens': 0, 'completion_tokens': 0},
+                # 已有分析结果覆盖的学生数/比例（分析未完成时小于1）
+                'covered_users_count': 0,
+                'total_users_count': 0,
+                'coverage': 0.0
             }
         }
         
@@ -549,37 +1037,22 @@ def get_clustering_results(term_id, question_id):
         hash_to_users = {}
         if all_users_data:
             for row in all_users_data:
-                # 处理特殊类型
-                user_record = {}
-                for key, value in row.items():
-                    if isinstance(value, datetime):
-                        user_record[key] = value.strftime('%Y-%m-%d %H:%M:%S')
-                    else:
-                        user_record[key] = value
-                
-                answer_hash = user_record.get('answer_hash')
+                answer_hash = row.get('answer_hash')
                 if answer_hash:
                     if answer_hash not in hash_to_users:
                         hash_to_users[answer_hash] = []
-                    hash_to_users[answer_hash].append(user_record)
+                    hash_to_users[answer_hash].append(row['user_id'])
         
         # 处理AI表数据，并合并用户信息
         if ai_all_data:
-            for row in ai_all_data:
-                # 将所有字段都包含进来，并处理特殊类型
-                ai_record = {}
-                for key, value in row.items():
-                    if isinstance(value, datetime):
-                        ai_record[key] = value.strftime('%Y-%m-%d %H:%M:%S')
-                    else:
-                        ai_record[key] = value
-                
+            for ai_record in ai_all_data:
+                # 直接使用查询结果行，datetime等类型由序列化层统一处理
                 # 根据answer_hash聚合对应的用户信息
                 answer_hash = ai_record.get('answer_hash')
                 if answer_hash and answer_hash in hash_to_users:
                     # 添加聚合的用户信息（只保留user_ids和user_count）
                     users_for_hash = hash_to_users[answer_hash]
-                    ai_record['user_ids'] = [user.get('user_id') for user in users_for_hash]
+                    ai_record['user_ids'] = users_for_hash
                     ai_record['user_count'] = len(users_for_hash)
                 else:
                     ai_record['user_ids'] = []
@@ -587,6 +1060,11 @@ def get_clustering_results(term_id, question_id):
                 
                 result_data['ai_table_data'].append(ai_record)
                 
+                # 统计token用量（旧表没有这两列时为0）
+                token_usage = result_data['statistics']['token_usage']
+                token_usage['prompt_tokens'] += int(ai_record.get('prompt_tokens') or 0)
+                token_usage['completion_tokens'] += int(ai_record.get('completion_tokens') or 0)
+                
                 # 统计分类信息
                 category = ai_record.get('category', '未知')
                 if category not in result_data['statistics']['categories_summary']:
@@ -604,6 +1082,15 @@ def get_clustering_results(term_id, question_id):
         # 更新统计信息
         result_data['statistics']['ai_records_count'] = len(result_data['ai_table_data'])
         result_data['statistics']['input_users_count'] = len(hash_to_users) if hash_to_users else 0
+        total_users = sum(len(users) for users in hash_to_users.values())
+        covered_users = sum(record['user_count'] for record in result_data['ai_table_data'])
+        result_data['statistics']['covered_users_count'] = covered_users
+        result_data['statistics']['total_users_count'] = total_users
+        result_data['statistics']['coverage'] = round(covered_users / total_users, 4) if total_users else 0.0
+        
+        # 抽样分析的结果尚未覆盖全部学生时，按样本估计各分类的学生比例和置信区间
+        if total_users and covered_users < total_users:
+            add_sample_estimates(term_id, question_id, result_data['statistics'], result_data['ai_table_data'])
         
         # 如果没有AI分析数据，返回None表示没有现有结果
         if not result_data['ai_table_data']:
@@ -615,6 +1102,8 @@ def get_clustering_results(term_id, question_id):
             'detailed_data': result_data  # 只返回详细数据
         }
         
+    except SchemaOutdatedError:
+        raise
     except Exception as e:
         print(f"获取聚类结果失败: {e}")
         import traceback
@@ -622,6 +1111,315 @@ def get_clustering_results(term_id, question_id):
         # 发生异常时返回None，表示没有现有结果
         return None
 
+# 运行日志超过该时间没有写入时，认为写日志的分析进程已经退出（其他worker进程或被终止的运行）
+JOURNAL_STALE_SECONDS = 120
+# 打开进度流时分析还没有开始（例如页面先打开进度流再发送POST请求），最多等待的秒数
+STREAM_START_GRACE = 10
+
+def get_journal_tail(term_id, question_id):
+    """题目运行日志的JournalTail，未开启运行日志时返回None"""
+    if not db_manager.config.getboolean('Journal', 'enabled', fallback=True):
+        return None
+    journal_dir = os.path.join(PROJECT_ROOT, db_manager.config.get('Journal', 'journal_dir', fallback='data/journal'))
+    return JournalTail(journal_path(journal_dir, term_id, question_id))
+
+def analysis_running(term_id, question_id, tail):
+    """题目是否正在分析：本进程的分析请求或后台补全进程，或运行日志显示其他进程正在写入"""
+    if get_analysis_lock(term_id, question_id).locked() or fill_running(term_id, question_id):
+        return True
+    return tail is not None and tail.running(JOURNAL_STALE_SECONDS)
+
+def get_partial_summary(term_id, question_id):
+    """
+    按分类汇总已写入ai_{term_id}的结果（只做分组统计，不读取完整结果）
+    返回 (已分析记录数, 覆盖的学生数, categories_summary)，结构与 get_clustering_results 中的categories_summary相同
+    """
+    ai_table_name = f"ai_{term_id}"
+    try:
+        if not db_manager.ensure_table('ai', ai_table_name):
+            return 0, 0, {}
+    except SchemaOutdatedError:
+        # 正在进行的分析进程会先完成迁移，迁移前按暂无结果推送
+        return 0, 0, {}
+    rows = db_manager.execute_query(
+        f"SELECT category, subcategory, COUNT(*) AS count, SUM(user_count) AS users "
+        f"FROM {ai_table_name} WHERE question_id = %s GROUP BY category, subcategory",
+        (question_id,)
+    ) or []
+    categories_summary = {}
+    for row in rows:
+        summary = categories_summary.setdefault(row['category'] or '未知', {'count': 0, 'subcategories': {}})
+        summary['count'] += int(row['count'])
+        summary['subcategories'][row['subcategory'] or '未知'] = int(row['count'])
+    return (sum(int(row['count']) for row in rows), sum(int(row['users'] or 0) for row in rows),
+            categories_summary)
+
+def sse_event(event, data):
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {safe_json_serialize(data, pretty=False).decode('utf-8')}\n\n"
+
+def stream_progress(term_id, question_id, interval, max_seconds):
+    """
+    进度流生成器：每interval秒检查一次运行日志和ai表
+      progress:   completed/total、processed/skipped/error/in_flight（来自运行日志，未开启日志时只有processed）
+      categories: 本次运行新增的分类（运行日志中的分类库更新）
+      summary:    已写入结果的categories_summary快照（结果有变化时）
+      done:       分析结束（或超过max_seconds）后发送最后一次统计并关闭
+    """
+    tail = get_journal_tail(term_id, question_id)
+    start_time = time.time()
+    seen_running = False
+    sent_categories = 0
+    last_progress = last_rows = None
+    while True:
+        running = analysis_running(term_id, question_id, tail)
+        seen_running = seen_running or running
+        finished = (not running and (seen_running or time.time() - start_time >= STREAM_START_GRACE)
+                    or time.time() - start_time >= max_seconds)
+        
+        if tail is not None:
+            tail.poll()
+            new_subcategories = tail.summary['new_subcategories']
+            if len(new_subcategories) < sent_categories:
+                # 新的一次运行重写了日志
+                sent_categories = 0
+            if len(new_subcategories) > sent_categories:
+                yield sse_event('categories', {'new_subcategories': new_subcategories[sent_categories:]})
+                sent_categories = len(new_subcategories)
+        
+        rows, covered_users, categories_summary = get_partial_summary(term_id, question_id)
+        progress = tail.counts() if tail is not None and tail.summary['tasks'] else {'processed': rows}
+        progress.update({'running': running, 'analyzed_count': rows, 'covered_users_count': covered_users})
+        if progress != last_progress:
+            yield sse_event('progress', dict(progress, elapsed=round(time.time() - start_time, 1)))
+            last_progress = progress
+        if rows != last_rows:
+            yield sse_event('summary', {'categories_summary': categories_summary})
+            last_rows = rows
+        
+        if finished:
+            yield sse_event('done', {'running': running, 'analyzed_count': rows})
+            return
+        # 注释行作为心跳，代理和浏览器不会因长时间没有数据而断开
+        yield ": keepalive\n\n"
+        time.sleep(interval)
+
+@app.route('/domain/api/clustering/stream', methods=['GET'])
+def clustering_progress_stream():
+    """
+    分析进度推送（text/event-stream），与 POST /domain/api/clustering 同时打开
+    分析过程中持续推送进度、新增分类和部分categories_summary，分析结束后发送done事件并关闭
+    """
+    # 两个ID都会拼接到运行日志的路径中
+    term_id, question_id, error = validate_ids(request.args.get('term_id'), request.args.get('question_id'))
+    if error is not None:
+        return error
+    
+    interval = max(db_manager.config.getfloat('Server', 'stream_interval', fallback=1.0), 0.1)
+    max_seconds = db_manager.config.getint('Server', 'stream_max_seconds', fallback=3600)
+    metrics.increment('progress_stream')
+    return Response(
+        stream_progress(term_id, question_id, interval, max_seconds),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/domain/api/clustering/cancel', methods=['POST'])
+def cancel_clustering():
+    """
+    取消题目正在进行的分析（页面关闭时由浏览器通过sendBeacon发送，参数可放在JSON或查询字符串中）
+    写入取消文件后分析进程停止调度新记录，进行中的 POST /domain/api/clustering 返回已完成的部分结果
+    """
+    data = request.get_json(silent=True) or request.args
+    # 两个ID都会拼接到取消文件和运行日志的路径中
+    term_id, question_id, error = validate_ids(data.get('term_id'), data.get('question_id'))
+    if error is not None:
+        return error
+    
+    # 分析可能在其他worker进程中，通过运行日志判断
+    tail = get_journal_tail(term_id, question_id)
+    if tail is not None:
+        tail.poll()
+    running = analysis_running(term_id, question_id, tail)
+    if running:
+        request_cancel(get_cancel_file(term_id, question_id), 'cancelled')
+        metrics.increment('analysis_cancel_request')
+        print(f"收到取消请求 [term_id={term_id}, question_id={question_id}]")
+    return json_response({
+        'success': True,
+        'message': '已请求取消分析' if running else '该题目没有正在进行的分析',
+        'cancelled': running,
+        'term_id': term_id,
+        'question_id': question_id
+    })
+
+@app.route('/domain/api/mark_code', methods=['GET'])
+def get_mark_code():
+    """
+    获取一条分析结果的标记代码
+    [Prompt] mark_code = lazy 时批量分析不生成标记代码，第一次打开时调用LLM生成并写回ai_{term_id}表
+    参数: term_id, question_id, answer_hash（均必填）
+    """
+    term_id = request.args.get('term_id')
+    question_id = request.args.get('question_id')
+    answer_hash = request.args.get('answer_hash')
+    
+    if not term_id or not question_id or not answer_hash:
+        return json_response({
+            'success': False,
+            'message': '缺少必要参数: term_id、question_id 和 answer_hash',
+            'data': None
+        }, status=400)
+    term_id, question_id, error = validate_ids(term_id, question_id)
+    if error is not None:
+        return error
+    if not _HASH_PATTERN.match(answer_hash):
+        return json_response({
+            'success': False,
+            'message': 'answer_hash 必须是32到64位的十六进制摘要',
+            'data': None
+        }, status=400)
+    
+    if not db_manager.ensure_table('ai', f"ai_{term_id}"):
+        return json_response({
+            'success': False,
+            'message': '暂无分析结果，请先调用 POST /domain/api/clustering 执行分析',
+            'data': None
+        }, status=404)
+    
+    connection = db_manager.get_connection()
+    if connection is None:
+        return json_response({
+            'success': False,
+            'message': '数据库连接失败',
+            'data': None
+        }, status=500)
+    
+    try:
+        _, api_config, prompt_config, _, _ = get_analysis_config(db_manager.config)
+        question_info_table = db_manager.config.get('DataTable', 'question_info_table')
+        with get_mark_code_lock(term_id, question_id, answer_hash):
+            with metrics.timer('mark_code'):
+                mark_code, generated = generate_mark_code(
+                    connection, term_id, question_id, answer_hash, api_config, prompt_config,
+                    question_info_table, base_dir=PROJECT_ROOT
+                )
+    except RuntimeError as e:
+        # LLM调用失败
+        return json_response({
+            'success': False,
+            'message': str(e),
+            'data': None
+        }, status=502)
+    except Exception as e:
+        return json_response({
+            'success': False,
+            'message': f'标记代码生成失败: {str(e)}',
+            'data': None
+        }, status=500)
+    finally:
+        connection.close()
+    
+    if mark_code is None:
+        return json_response({
+            'success': False,
+            'message': '该作答没有分析结果',
+            'data': None
+        }, status=404)
+    
+    metrics.increment('mark_code_generated' if generated else 'mark_code_cached')
+    return json_response({
+        'success': True,
+        'message': '标记代码已生成' if generated else '使用已有标记代码',
+        'data': {
+            'term_id': term_id,
+            'question_id': question_id,
+            'answer_hash': answer_hash,
+            'mark_code': mark_code,
+            'generated': generated
+        }
+    })
+
+@app.route('/domain/api/export', methods=['GET'])
+def export_results():
+    """
+    导出分析数据为文件下载
+    参数: term_id（必填）, question_id（可选，不填导出整个学期）,
+         dataset=results|inputs, format=parquet|arrow|excel
+    """
+    term_id = request.args.get('term_id')
+    question_id = request.args.get('question_id') or None
+    dataset = request.args.get('dataset', 'results')
+    export_config = get_export_config(db_manager.config)
+    fmt = request.args.get('format', export_config['format'])
+    
+    if not term_id:
+        return json_response({
+            'success': False,
+            'message': '缺少必要参数: term_id',
+            'data': None
+        }, status=400)
+    if not is_valid_id(term_id) or (question_id is not None and not is_valid_id(question_id)):
+        return json_response({
+            'success': False,
+            'message': 'term_id 和 question_id 必须是有效的数字',
+            'data': None
+        }, status=400)
+    if dataset not in DATASETS or fmt not in EXPORT_FORMATS:
+        return json_response({
+            'success': False,
+            'message': f'参数错误: dataset可选 {", ".join(DATASETS)}，format可选 {", ".join(EXPORT_FORMATS)}',
+            'data': None
+        }, status=400)
+    
+    output_dir = os.path.join(PROJECT_ROOT, export_config['output_dir'])
+    connection = db_manager.get_connection()
+    if connection is None:
+        return json_response({
+            'success': False,
+            'message': '数据库连接失败',
+            'data': None
+        }, status=500)
+    
+    try:
+        start_time = time.time()
+        output_path, row_count = export_dataset(
+            connection, term_id, dataset, question_id=question_id, fmt=fmt,
+            output_dir=output_dir, partition=False, export_config=export_config
+        )
+        print(f"导出完成 [{dataset}, term_id={term_id}, question_id={question_id}]: "
+              f"{row_count} 行 ({time.time() - start_time:.2f}秒)")
+    except Exception as e:
+        return json_response({
+            'success': False,
+            'message': f'导出失败: {str(e)}',
+            'data': None
+        }, status=500)
+    finally:
+        connection.close()
+    
+    if output_path is None:
+        return json_response({
+            'success': False,
+            'message': '没有可导出的数据',
+            'data': None
+        }, status=404)
+    
+    return send_file(output_path, as_attachment=True, download_name=os.path.basename(output_path))
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Prometheus文本格式的性能指标
+    包括本进程的响应序列化、数据库查询、分析子进程耗时和缓存命中等计数，
+    以及各题目最近一次分析运行（AI_process.py / batchProcess.py）保存的阶段耗时
+    """
+    sources = [({'source': 'api', 'pid': os.getpid()}, metrics.snapshot())]
+    metrics_dir = os.path.join(PROJECT_ROOT, get_metrics_config(db_manager.config)['metrics_dir'])
+    for snapshot in load_run_metrics(metrics_dir):
+        sources.append((dict(snapshot.get('labels', {}), source='run'), snapshot))
+    return Response(format_prometheus(sources), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """健康检查接口"""
@@ -637,20 +1435,13 @@ def health_check():
             'database': db_status,
             'message': 'API服务运行正常'
         }
-        return Response(
-            safe_json_serialize(response_data),
-            mimetype='application/json; charset=utf-8'
-        )
+        return json_response(response_data)
     except Exception as e:
         response_data = {
             'status': 'unhealthy',
             'message': f'服务异常: {str(e)}'
         }
-        return Response(
-            json.dumps(response_data, ensure_ascii=False, indent=2),
-            mimetype='application/json; charset=utf-8',
-            status=500
-        )
+        return json_response(response_data, status=500)
 
 @app.errorhandler(404)
 def not_found(error):
@@ -660,11 +1451,18 @@ def not_found(error):
         'message': '接口不存在',
         'data': None
     }
-    return Response(
-        safe_json_serialize(response_data),
-        mimetype='application/json; charset=utf-8',
-        status=404
-    )
+    return json_response(response_data, status=404)
+
+@app.errorhandler(SchemaOutdatedError)
+def schema_outdated(error):
+    """表结构版本落后：API不执行迁移，需要先执行 schemaMigration.py"""
+    print(f"警告: {error}")
+    response_data = {
+        'success': False,
+        'message': str(error),
+        'data': None
+    }
+    return json_response(response_data, status=503)
 
 @app.errorhandler(500)
 def internal_error(error):
@@ -674,11 +1472,7 @@ def internal_error(error):
         'message': '服务器内部错误',
         'data': None
     }
-    return Response(
-        safe_json_serialize(response_data),
-        mimetype='application/json; charset=utf-8',
-        status=500
-    )
+    return json_response(response_data, status=500)
 
 if __name__ == '__main__':
     print("启动AI错误分析系统API服务...")
@@ -687,9 +1481,10 @@ if __name__ == '__main__':
     print("健康检查: http://localhost:5000/health")
     print()
     
-    # 启动Flask应用
+    # 启动Flask开发服务器（生产环境请使用 python start_api.py --prod）
     app.run(
-        host='0.0.0.0',
-        port=5000,
-        debug=True
+        host=db_manager.config.get('Server', 'host', fallback='0.0.0.0'),
+        port=db_manager.config.getint('Server', 'port', fallback=5000),
+        debug=True,
+        threaded=True
     )
\ No newline at end of file
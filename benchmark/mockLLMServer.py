@@ -0,0 +1,256 @@
+"""
+本地模拟的OpenAI兼容 /v1/chat/completions 服务，仅用于离线性能测试
+可配置响应延迟、错误率、429限流比例和返回非法JSON的比例
+按系统提示词中要求的字段输出（只要求分类时不返回mark_code），mark_code为带<mark>标记的完整学生代码
+
+单独运行: python benchmark/mockLLMServer.py --port 8001 --latency 0.8 --rate-429 0.05
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 模拟分类：(category, subcategory, thirdCategory)
+TAXONOMY = (
+    ('语法错误', '缺失符号', '缺少分号'),
+    ('语法错误', '缺失符号', '括号不匹配'),
+    ('语法错误', '拼写错误', '关键字拼写错误'),
+    ('逻辑错误', '循环错误', '循环边界错误'),
+    ('逻辑错误', '条件错误', '条件判断错误'),
+    ('逻辑错误', '计算错误', '整数溢出'),
+    ('运行错误', '内存错误', '数组越界'),
+    ('运行错误', '超时', '算法复杂度过高'),
+    ('输入输出错误', '格式错误', '输出格式不符'),
+)
+
+def default_options():
+    return {
+        # 平均延迟（秒）及抖动（标准差占平均值的比例）
+        'latency': 0.5,
+        'jitter': 0.3,
+        'error_rate': 0.0,
+        'rate_429': 0.0,
+        'malformed_rate': 0.0,
+        # 把JSON包在```json代码块中并附加说明文字和尾逗号的比例（可在本地修复）
+        'wrapped_rate': 0.0,
+        # 每个输出token增加的延迟（秒），模拟输出越长响应越慢
+        'token_latency': 0.0,
+        # 长尾：该比例的请求延迟为slow_latency秒（模拟上游偶发的慢请求）
+        'slow_rate': 0.0,
+        'slow_latency': 10.0,
+        # 同时处理的请求数上限（模拟单个key的并发额度），超出的请求返回429，0表示不限制
+        'max_concurrency': 0,
+        # 启动后前outage_seconds秒所有请求返回500（模拟上游故障后恢复）
+        'outage_seconds': 0.0,
+        # 名称包含lite的模型（便宜模型）：延迟为latency的lite_latency_factor倍，
+        # lite_novel_rate比例的结果使用分类库中没有的三级类别，要求置信度时给出0.6~1.0的置信度
+        'lite_latency_factor': 0.3,
+        'lite_novel_rate': 0.0,
+        # 按报错信息（去掉数字后）确定分类，同类报错得到相同分类（用于测试本地分类器），否则随机选择
+        'consistent_labels': False,
+        'seed': 42,
+    }
+
+_ANSWER_CODE = re.compile(r'用户作答：(.*?)(?:\\n\\n|\n\n)错误信息', re.S)
+_ERROR_INFO = re.compile(r'错误信息：(.*)$', re.S)
+
+def _consistent_label(user_prompt):
+    match = _ERROR_INFO.search(user_prompt)
+    signature = re.sub(r'\d+', '', match.group(1).strip() if match else '')
+    return TAXONOMY[int(hashlib.md5(signature.encode('utf-8')).hexdigest(), 16) % len(TAXONOMY)]
+
+def _mark_code(user_prompt):
+    """从用户提示词中取出学生代码，标记第一行后原样返回"""
+    match = _ANSWER_CODE.search(user_prompt)
+    if not match or not match.group(1).strip():
+        return '// 在此处标注错误位置'
+    lines = match.group(1).split('\n')
+    lines[0] = f"<mark>{lines[0]}</mark>"
+    return '\n'.join(lines)
+
+class MockLLMServer:
+    """在后台线程运行的模拟LLM服务"""
+
+    def __init__(self, host='127.0.0.1', port=0, **options):
+        self.options = dict(default_options(), **options)
+        self._rng = random.Random(self.options['seed'])
+        self._rng_lock = threading.Lock()
+        self.stats = {'requests': 0, 'ok': 0, 'http_429': 0, 'http_500': 0, 'malformed': 0, 'wrapped': 0}
+        self._stats_lock = threading.Lock()
+        self._in_flight = 0
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def _random(self):
+        with self._rng_lock:
+            return self._rng.random(), self._rng.gauss(0, 1), self._rng.choice(TAXONOMY), self._rng.random()
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats['requests'] += 1
+            self.stats[key] += 1
+
+    def _enter(self):
+        """占用一个并发名额，超出max_concurrency时返回False"""
+        with self._stats_lock:
+            if 0 < self.options['max_concurrency'] <= self._in_flight:
+                return False
+            self._in_flight += 1
+            return True
+
+    def _leave(self):
+        with self._stats_lock:
+            self._in_flight -= 1
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body):
+                payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(payload)))
+                if status == 429:
+                    self.send_header('Retry-After', '1')
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                request = json.loads(self.rfile.read(length) or b'{}')
+                if not server._enter():
+                    server._count('http_429')
+                    self._send(429, {'error': {'message': 'Concurrency limit exceeded', 'type': 'rate_limit'}})
+                    return
+                try:
+                    self._respond(request)
+                finally:
+                    server._leave()
+
+            def _respond(self, request):
+                options = server.options
+                roll, noise, (category, subcategory, third), slow_roll = server._random()
+
+                if roll < options['rate_429']:
+                    server._count('http_429')
+                    self._send(429, {'error': {'message': 'Rate limit exceeded', 'type': 'rate_limit'}})
+                    return
+                roll -= options['rate_429']
+
+                lite = 'lite' in str(request.get('model', ''))
+                if slow_roll < options['slow_rate']:
+                    time.sleep(options['slow_latency'])
+                else:
+                    latency = options['latency'] * (options['lite_latency_factor'] if lite else 1)
+                    time.sleep(max(latency * (1 + options['jitter'] * noise), 0))
+
+                if roll < options['error_rate'] or time.time() - server.started_at < options['outage_seconds']:
+                    server._count('http_500')
+                    self._send(500, {'error': {'message': 'Internal error', 'type': 'server_error'}})
+                    return
+                roll -= options['error_rate']
+
+                messages = request.get('messages', [])
+                system_prompt = messages[0].get('content', '') if messages else ''
+                if options['consistent_labels'] and messages:
+                    category, subcategory, third = _consistent_label(messages[-1].get('content', ''))
+                if roll < options['malformed_rate']:
+                    server._count('malformed')
+                    content = f"分类结果：{category} -> {subcategory}"
+                else:
+                    result = {}
+                    if '"category"' in system_prompt or not system_prompt:
+                        result.update({
+                            'category': category,
+                            'subcategory': subcategory,
+                            'thirdCategory': third,
+                            'specific_reason': f"{third}导致程序结果不正确",
+                        })
+                        if lite and slow_roll < options['lite_novel_rate']:
+                            result['thirdCategory'] = f"{third}（其他）"
+                    if '"confidence"' in system_prompt:
+                        result['confidence'] = round(0.6 + 0.4 * slow_roll, 2) if lite else 0.95
+                    if '"mark_code"' in system_prompt or not system_prompt:
+                        result['mark_code'] = _mark_code(messages[-1].get('content', '') if messages else '')
+                    content = json.dumps(result, ensure_ascii=False)
+                    if roll - options['malformed_rate'] < options['wrapped_rate']:
+                        server._count('wrapped')
+                        content = f"分析结果如下：\n```json\n{content[:-1]},\n}}\n```\n如有疑问请进一步说明。"
+                    else:
+                        server._count('ok')
+
+                time.sleep(options['token_latency'] * (len(content) // 2))
+                prompt_chars = sum(len(m.get('content', '')) for m in messages)
+                self._send(200, {
+                    'id': 'mock-completion',
+                    'object': 'chat.completion',
+                    'model': request.get('model', 'mock'),
+                    'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content},
+                                 'finish_reason': 'stop'}],
+                    'usage': {
+                        'prompt_tokens': prompt_chars // 2,
+                        'completion_tokens': len(content) // 2,
+                        'total_tokens': prompt_chars // 2 + len(content) // 2
+                    }
+                })
+
+        return Handler
+
+    def start(self):
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description='模拟OpenAI兼容的LLM服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.5, help='平均响应延迟（秒）')
+    parser.add_argument('--jitter', type=float, default=0.3, help='延迟抖动（标准差占平均值的比例）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回HTTP 500的比例')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='返回HTTP 429的比例')
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help='返回非法JSON内容的比例')
+    parser.add_argument('--wrapped-rate', type=float, default=0.0, help='返回代码块包裹、带尾逗号的JSON的比例')
+    parser.add_argument('--token-latency', type=float, default=0.0, help='每个输出token增加的延迟（秒）')
+    parser.add_argument('--slow-rate', type=float, default=0.0, help='长尾慢请求的比例')
+    parser.add_argument('--slow-latency', type=float, default=10.0, help='长尾慢请求的延迟（秒）')
+    parser.add_argument('--max-concurrency', type=int, default=0, help='同时处理的请求数上限，超出返回429')
+    parser.add_argument('--outage-seconds', type=float, default=0.0, help='启动后前N秒所有请求返回500')
+    args = parser.parse_args()
+
+    server = MockLLMServer(args.host, args.port, latency=args.latency, jitter=args.jitter,
+                           error_rate=args.error_rate, rate_429=args.rate_429, malformed_rate=args.malformed_rate,
+                           wrapped_rate=args.wrapped_rate, token_latency=args.token_latency,
+                           slow_rate=args.slow_rate, slow_latency=args.slow_latency,
+                           max_concurrency=args.max_concurrency, outage_seconds=args.outage_seconds)
+    server.started_at = time.time()
+    print(f"模拟LLM服务: {server.url}，Ctrl+C 退出")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.httpd.server_close()
+
+if __name__ == "__main__":
+    main()
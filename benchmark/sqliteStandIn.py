@@ -0,0 +1,255 @@
+"""
+基于SQLite的MySQL替身，仅用于离线性能测试
+提供与mysql.connector相同的connect()/cursor()/commit()接口，并把项目中用到的MySQL语法翻译为SQLite语法
+"""
+
+import re
+import sqlite3
+import threading
+from datetime import datetime
+
+_DATETIME_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}(\.\d{3})?$')
+_SHOW_TABLES = re.compile(r"^SHOW\s+TABLES\s+LIKE\s+'([^']+)'", re.I)
+_DESCRIBE = re.compile(r'^(?:DESCRIBE|DESC)\s+`?(\w+)`?', re.I)
+_SHOW_INDEX = re.compile(r'^SHOW\s+(?:INDEX|INDEXES|KEYS)\s+FROM\s+`?(\w+)`?', re.I)
+_NAMED_LOCK = re.compile(r'^SELECT\s+(GET_LOCK|RELEASE_LOCK)\s*\(', re.I)
+_ADD_TIMESTAMP = re.compile(r'ADD\s+(?:COLUMN\s+)?`?(\w+)`?\s+TIMESTAMP\b.*?DEFAULT\s+CURRENT_TIMESTAMP(?:\(\d\))?'
+                            r'(\s+ON\s+UPDATE\s+CURRENT_TIMESTAMP)?', re.I | re.S)
+# 毫秒精度的当前时间，对应 CURRENT_TIMESTAMP(3)
+_NOW_MS = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+_KEY_LINE = re.compile(r'^\s*(UNIQUE\s+KEY|UNIQUE\s+INDEX|KEY|INDEX)\s+`?(\w+)`?\s*\((.+)\)\s*,?\s*$', re.I)
+
+def _strip_prefix_lengths(columns):
+    """category(50) -> category"""
+    return re.sub(r'(\w+)\s*\(\d+\)', r'\1', columns)
+
+def _translate_create_table(sql):
+    """CREATE TABLE: 去掉表选项，索引行改为单独的CREATE INDEX"""
+    sql = re.sub(r'\)\s*ENGINE\s*=.*$', ')', sql.strip(), flags=re.S | re.I)
+    table_name = re.search(r'CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?`?(\w+)`?', sql, re.I).group(1)
+
+    lines, indexes = [], []
+    for line in sql.split('\n'):
+        match = _KEY_LINE.match(line)
+        if match:
+            kind, name, columns = match.groups()
+            columns = _strip_prefix_lengths(columns)
+            unique = 'UNIQUE ' if kind.upper().startswith('UNIQUE') else ''
+            indexes.append(f"CREATE {unique}INDEX IF NOT EXISTS {table_name}_{name} ON {table_name} ({columns})")
+            continue
+        lines.append(line)
+    sql = '\n'.join(lines)
+    # 去掉索引行后可能留下多余的逗号
+    sql = re.sub(r',\s*\)\s*$', '\n)', sql)
+    sql = re.sub(r'PRIMARY\s+KEY\s*\(([^)]+)\)', lambda m: f"PRIMARY KEY ({_strip_prefix_lengths(m.group(1))})", sql)
+    sql = re.sub(r'\b(?:BIG)?INT\s+(?:NOT\s+NULL\s+)?AUTO_INCREMENT\s+PRIMARY\s+KEY', 'INTEGER PRIMARY KEY AUTOINCREMENT', sql, flags=re.I)
+    sql = re.sub(r'\s+ON\s+UPDATE\s+CURRENT_TIMESTAMP', '', sql, flags=re.I)
+    sql = re.sub(r"\s+COMMENT\s+'[^']*'", '', sql, flags=re.I)
+    sql = re.sub(r'\s+(?:CHARACTER\s+SET|CHARSET|COLLATE)\s+\w+', '', sql, flags=re.I)
+    return [sql] + indexes
+
+def _translate_alter_table(sql):
+    """ALTER TABLE: 支持ADD COLUMN / ADD INDEX / CHANGE COLUMN"""
+    match = re.match(r'ALTER\s+TABLE\s+`?(\w+)`?\s+(.*)$', sql.strip(), re.S | re.I)
+    table_name, action = match.groups()
+    index = re.match(r'ADD\s+(UNIQUE\s+)?(?:INDEX|KEY)\s+`?(\w+)`?\s*\((.+)\)', action, re.I)
+    if index:
+        unique, name, columns = index.groups()
+        return [f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {table_name}_{name} "
+                f"ON {table_name} ({_strip_prefix_lengths(columns)})"]
+    timestamp = _ADD_TIMESTAMP.match(action)
+    if timestamp:
+        # SQLite的ADD COLUMN不支持非常量默认值：已有行填入当前时间，新行和 ON UPDATE 由触发器设置
+        column, on_update = timestamp.groups()
+        statements = [
+            f"ALTER TABLE {table_name} ADD COLUMN {column} TIMESTAMP",
+            f"UPDATE {table_name} SET {column} = {_NOW_MS}",
+            f"CREATE TRIGGER IF NOT EXISTS {table_name}_{column}_insert AFTER INSERT ON {table_name} "
+            f"WHEN NEW.{column} IS NULL BEGIN UPDATE {table_name} SET {column} = {_NOW_MS} WHERE rowid = NEW.rowid; END",
+        ]
+        if on_update:
+            statements.append(
+                f"CREATE TRIGGER IF NOT EXISTS {table_name}_{column}_update AFTER UPDATE ON {table_name} "
+                f"WHEN NEW.{column} IS OLD.{column} BEGIN UPDATE {table_name} SET {column} = {_NOW_MS} "
+                f"WHERE rowid = NEW.rowid; END")
+        return statements
+    change = re.match(r'CHANGE\s+(?:COLUMN\s+)?`?(\w+)`?\s+`?(\w+)`?', action, re.I)
+    if change:
+        return [f"ALTER TABLE {table_name} RENAME COLUMN {change.group(1)} TO {change.group(2)}"]
+    action = re.sub(r'\s+AFTER\s+\w+\s*$', '', action, flags=re.I)
+    return [f"ALTER TABLE {table_name} {action}"]
+
+def translate(sql):
+    """把MySQL语句翻译为一条或多条SQLite语句，返回None表示忽略该语句"""
+    stripped = sql.strip()
+    upper = stripped.upper()
+    if upper.startswith('SET ') or upper.startswith('START TRANSACTION'):
+        return None
+    if upper.startswith('CREATE TABLE'):
+        return _translate_create_table(stripped)
+    if upper.startswith('ALTER TABLE'):
+        return _translate_alter_table(stripped)
+
+    sql = stripped.replace('%s', '?')
+    sql = re.sub(r'^INSERT\s+IGNORE', 'INSERT OR IGNORE', sql, flags=re.I)
+    if re.search(r'ON\s+DUPLICATE\s+KEY\s+UPDATE', sql, re.I):
+        head, tail = re.split(r'ON\s+DUPLICATE\s+KEY\s+UPDATE', sql, maxsplit=1, flags=re.I)
+        tail = re.sub(r'VALUES\((\w+)\)', r'excluded.\1', tail)
+        sql = f"{head} ON CONFLICT DO UPDATE SET {tail}"
+    sql = re.sub(r'GROUP_CONCAT\((.+?)\s+ORDER\s+BY\s+\w+\s+SEPARATOR\s+(\'[^\']*\')\)', r'GROUP_CONCAT(\1, \2)', sql, flags=re.I)
+    sql = re.sub(r'\bANY_VALUE\(', 'MAX(', sql, flags=re.I)
+    sql = re.sub(r'DATE_ADD\(NOW\(\),\s*INTERVAL\s+\?\s+SECOND\)', "datetime('now', '+' || ? || ' seconds')", sql, flags=re.I)
+    sql = re.sub(r'\bNOW\(\)', 'CURRENT_TIMESTAMP', sql, flags=re.I)
+    sql = re.sub(r'\bCONCAT\(([^()]*)\)', lambda m: '(' + ' || '.join(p.strip() for p in m.group(1).split(',')) + ')', sql, flags=re.I)
+    sql = re.sub(r'\s+FOR\s+UPDATE(\s+SKIP\s+LOCKED)?\s*$', '', sql, flags=re.I)
+    return [sql]
+
+def _convert_value(value):
+    """时间字符串转换为datetime，与mysql.connector返回的类型一致"""
+    if isinstance(value, str) and _DATETIME_PATTERN.match(value):
+        return datetime.fromisoformat(value)
+    return value
+
+def _convert_param(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if hasattr(value, 'item'):
+        # numpy标量
+        return value.item()
+    return value
+
+class Cursor:
+    def __init__(self, connection, dictionary=False):
+        self._connection = connection
+        self._dictionary = dictionary
+        self._rows = []
+        self.description = None
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def execute(self, sql, params=()):
+        params = tuple(_convert_param(p) for p in (params or ()))
+        show_tables = _SHOW_TABLES.match(sql.strip())
+        if show_tables:
+            return self._run("SELECT name AS table_name FROM sqlite_master WHERE type = 'table' AND name LIKE ?",
+                             (show_tables.group(1),))
+        show_index = _SHOW_INDEX.match(sql.strip())
+        if show_index:
+            self._set_result([('Table',), ('Non_unique',), ('Key_name',), ('Seq_in_index',), ('Column_name',)],
+                             self._index_rows(show_index.group(1)))
+            return
+        named_lock = _NAMED_LOCK.match(sql.strip())
+        if named_lock:
+            # 单进程替身不需要命名锁，总是获取成功
+            self._set_result([(named_lock.group(1).upper(),)], [(1,)])
+            return
+        describe = _DESCRIBE.match(sql.strip())
+        if describe:
+            rows = self._connection.raw.execute(f"PRAGMA table_info({describe.group(1)})").fetchall()
+            self._set_result([('Field',), ('Type',), ('Null',), ('Key',), ('Default',)],
+                             [(r[1], r[2], 'NO' if r[3] else 'YES', 'PRI' if r[5] else '', r[4]) for r in rows])
+            return
+
+        statements = translate(sql)
+        if statements is None:
+            self._set_result(None, [])
+            return
+        for i, statement in enumerate(statements):
+            self._run(statement, params if i == 0 else ())
+
+    def _index_rows(self, table_name):
+        """SHOW INDEX FROM: 索引名去掉建表时添加的表名前缀"""
+        rows = []
+        raw = self._connection.raw
+        for _, name, unique, *_ in raw.execute(f"PRAGMA index_list({table_name})").fetchall():
+            key_name = name[len(table_name) + 1:] if name.startswith(f"{table_name}_") else name
+            for seq, _, column in raw.execute(f"PRAGMA index_info({name})").fetchall():
+                rows.append((table_name, 0 if unique else 1, key_name, seq + 1, column))
+        return rows
+
+    def _run(self, sql, params):
+        with self._connection.lock:
+            try:
+                cursor = self._connection.raw.execute(sql, params)
+            except sqlite3.IntegrityError as e:
+                raise DatabaseError(str(e), errno=1062)
+            except sqlite3.OperationalError as e:
+                raise DatabaseError(f"{e} [SQL: {sql.strip()[:200]}]")
+            self.rowcount = cursor.rowcount
+            self.lastrowid = cursor.lastrowid
+            rows = cursor.fetchall() if cursor.description else []
+            self._set_result(cursor.description, rows)
+
+    def _set_result(self, description, rows):
+        self.description = description
+        rows = [tuple(_convert_value(v) for v in row) for row in rows]
+        if self._dictionary and description:
+            columns = [d[0] for d in description]
+            rows = [dict(zip(columns, row)) for row in rows]
+        self._rows = rows
+
+    def executemany(self, sql, seq_params):
+        for params in seq_params:
+            self.execute(sql, params)
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchmany(self, size=1):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def close(self):
+        self._rows = []
+
+class DatabaseError(Exception):
+    """与mysql.connector.Error一样带errno属性"""
+
+    def __init__(self, msg, errno=None):
+        super().__init__(msg)
+        self.msg = msg
+        self.errno = errno
+
+class Connection:
+    def __init__(self, path, lock):
+        # 自动提交，commit/rollback为空操作；多线程共用一个数据库文件
+        self.raw = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self.raw.execute('PRAGMA journal_mode=WAL')
+        self.raw.execute('PRAGMA synchronous=NORMAL')
+        self.lock = lock
+
+    def cursor(self, dictionary=False, **kwargs):
+        return Cursor(self, dictionary=dictionary)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def start_transaction(self, **kwargs):
+        pass
+
+    def is_connected(self):
+        return True
+
+    def ping(self, **kwargs):
+        pass
+
+    def close(self):
+        self.raw.close()
+
+class StandInDatabase:
+    """一个SQLite数据库文件，connect()每次返回新连接（对应mysql.connector.connect）"""
+
+    def __init__(self, path):
+        self.path = path
+        # SQLite同一时刻只允许一个写入者，进程内串行化语句避免频繁的busy重试
+        self.lock = threading.RLock()
+
+    def connect(self, *args, **kwargs):
+        return Connection(self.path, self.lock)
@@ -0,0 +1,153 @@
+"""
+合成答题数据生成器，仅用于离线性能测试
+生成与 records 表 / question_info 表结构一致的数据，可控制answer_hash基数、代码长度和错误信息分布
+"""
+
+import hashlib
+import json
+import random
+from datetime import datetime, timedelta
+
+# 错误信息分布：(错误类型, 权重, 模板)
+ERROR_DISTRIBUTION = (
+    ('compile_error', 0.45, "main.cpp:{line}:{col}: error: expected ';' before '{token}'"),
+    ('runtime_error', 0.2, "Runtime Error: Segmentation fault (core dumped) at line {line}"),
+    ('wrong_answer', 0.25, "Wrong Answer: expected {expected} but got {actual}"),
+    ('timeout', 0.05, "Time Limit Exceeded: {ms}ms"),
+    ('empty', 0.05, ""),
+)
+
+CODE_LINES = (
+    "int a = {n};",
+    "for (int i = 0; i < {n}; i++) {{ sum += i; }}",
+    "if (x > {n}) {{ cout << x << endl; }}",
+    "while (n-- > 0) {{ ans = ans * {n} % MOD; }}",
+    "vector<int> v({n}, 0);",
+    "cin >> a >> b;",
+    "printf(\"%d\\n\", a + {n});",
+)
+
+def default_options():
+    return {
+        'term_id': 900001,
+        'questions': 3,
+        'users_per_question': 500,
+        # 每个题目的不同作答数量（answer_hash基数）
+        'hash_cardinality': 100,
+        # 作答分布的Zipf指数，越大越集中在少数常见错误上
+        'zipf_skew': 1.1,
+        # 作答代码的平均长度（字节）
+        'code_size': 600,
+        'seed': 42,
+    }
+
+def create_tables(conn, records_table, question_info_table):
+    """创建与线上结构一致的records表和题目信息表"""
+    cursor = conn.cursor()
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {records_table} (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        term_id BIGINT NOT NULL,
+        question_id BIGINT NOT NULL,
+        user_id BIGINT NOT NULL,
+        answer_url VARCHAR(255),
+        error_info TEXT,
+        answer_code LONGTEXT,
+        answer_hash VARCHAR(64),
+        event_time DATETIME,
+        unit_sequence INT,
+        unit_id BIGINT,
+        unit_template_id BIGINT,
+        unit_template_name VARCHAR(100),
+        course_level INT,
+        INDEX idx_term_question (term_id, question_id),
+        INDEX idx_answer_hash (answer_hash)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {question_info_table} (
+        question_id BIGINT NOT NULL PRIMARY KEY,
+        name VARCHAR(255),
+        requirements TEXT,
+        standard_code LONGTEXT
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+    conn.commit()
+    cursor.close()
+
+def _zipf_weights(count, skew):
+    return [1.0 / (rank ** skew) for rank in range(1, count + 1)]
+
+def _make_code(rng, size):
+    lines = ["#include <bits/stdc++.h>", "using namespace std;", "int main() {"]
+    length = sum(len(line) + 1 for line in lines)
+    target = max(int(rng.gauss(size, size * 0.3)), 80)
+    while length < target:
+        line = "    " + rng.choice(CODE_LINES).format(n=rng.randint(1, 1000))
+        lines.append(line)
+        length += len(line) + 1
+    lines.extend(["    return 0;", "}"])
+    return "\n".join(lines)
+
+def _make_error(rng):
+    kinds = [kind for kind in ERROR_DISTRIBUTION]
+    _, _, template = rng.choices(kinds, weights=[kind[1] for kind in kinds])[0]
+    return template.format(line=rng.randint(1, 40), col=rng.randint(1, 30), token=rng.choice('}){'),
+                           expected=rng.randint(1, 100), actual=rng.randint(1, 100), ms=rng.randint(1000, 5000))
+
+def generate(conn, records_table, question_info_table, options=None, batch_size=2000):
+    """
+    生成合成数据并写入数据库，返回 [(term_id, question_id, user_count)]
+    同一题目内按Zipf分布把用户分配到hash_cardinality种不同作答上
+    """
+    options = dict(default_options(), **(options or {}))
+    rng = random.Random(options['seed'])
+    create_tables(conn, records_table, question_info_table)
+    cursor = conn.cursor()
+
+    term_id = options['term_id']
+    base_time = datetime(2024, 1, 1)
+    questions = []
+    user_id = 0
+    for q in range(options['questions']):
+        question_id = 800000 + q
+        cursor.execute(f"DELETE FROM {records_table} WHERE term_id = %s AND question_id = %s", (term_id, question_id))
+        cursor.execute(f"DELETE FROM {question_info_table} WHERE question_id = %s", (question_id,))
+        cursor.execute(
+            f"INSERT INTO {question_info_table} (question_id, name, requirements, standard_code) VALUES (%s, %s, %s, %s)",
+            (question_id, f"合成题目{q + 1}",
+             json.dumps({'description': f"计算1到n的和（题目{q + 1}）", 'input': 'n', 'output': 'sum'}, ensure_ascii=False),
+             _make_code(rng, options['code_size']))
+        )
+
+        answers = []
+        for _ in range(options['hash_cardinality']):
+            code = _make_code(rng, options['code_size'])
+            error_info = _make_error(rng)
+            answer_hash = hashlib.md5(f"{question_id}:{code}:{error_info}".encode('utf-8')).hexdigest()
+            answers.append((code, error_info, answer_hash))
+        weights = _zipf_weights(len(answers), options['zipf_skew'])
+
+        rows = []
+        for i in range(options['users_per_question']):
+            user_id += 1
+            code, error_info, answer_hash = rng.choices(answers, weights=weights)[0]
+            rows.append((term_id, question_id, user_id, f"https://example.com/answer/{user_id}", error_info, code,
+                         answer_hash, base_time + timedelta(seconds=i), q + 1, 1000 + q, 2000 + q, f"单元{q + 1}", 1))
+            if len(rows) >= batch_size:
+                _insert_records(cursor, records_table, rows)
+                rows = []
+        if rows:
+            _insert_records(cursor, records_table, rows)
+        conn.commit()
+        questions.append((str(term_id), str(question_id), options['users_per_question']))
+
+    cursor.close()
+    return questions
+
+def _insert_records(cursor, records_table, rows):
+    cursor.executemany(f"""
+    INSERT INTO {records_table} (term_id, question_id, user_id, answer_url, error_info, answer_code, answer_hash,
+                                 event_time, unit_sequence, unit_id, unit_template_id, unit_template_name, course_level)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """, rows)
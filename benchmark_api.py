@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+API吞吐量测试脚本
+用法: python benchmark_api.py [--url http://localhost:5000] [--term-id 17787 --question-id 77337]
+      [--concurrency 16] [--duration 20]
+
+分别压测概览接口和已有结果查询接口（GET /domain/api/clustering），输出每秒请求数和延迟分位数。
+"""
+
+import argparse
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(sorted_values, pct):
+    """计算分位数（输入需已排序）"""
+    if not sorted_values:
+        return 0.0
+    index = min(int(len(sorted_values) * pct / 100), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def run_benchmark(url, concurrency, duration, headers=None):
+    """在duration秒内用concurrency个线程持续请求url"""
+    latencies = []
+    status_counts = {}
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def worker():
+        while time.time() < deadline:
+            request = urllib.request.Request(url, headers=headers or {})
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=60) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            except Exception:
+                status = 'error'
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                status_counts[status] = status_counts.get(status, 0) + 1
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(worker)
+    total_time = time.time() - started
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'rps': len(latencies) / total_time if total_time > 0 else 0,
+        'mean_ms': statistics.mean(latencies) * 1000 if latencies else 0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'status': status_counts,
+    }
+
+
+def print_result(name, result):
+    print(f"\n=== {name} ===")
+    print(f"请求数: {result['requests']}")
+    print(f"吞吐量: {result['rps']:.1f} req/s")
+    print(f"延迟: 平均 {result['mean_ms']:.1f}ms, p50 {result['p50_ms']:.1f}ms, "
+          f"p95 {result['p95_ms']:.1f}ms, p99 {result['p99_ms']:.1f}ms")
+    print(f"状态码: {result['status']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='API吞吐量测试')
+    parser.add_argument('--url', default='http://localhost:5000', help='API服务地址')
+    parser.add_argument('--term-id', help='用于测试已有结果查询接口的term_id')
+    parser.add_argument('--question-id', help='用于测试已有结果查询接口的question_id')
+    parser.add_argument('--concurrency', type=int, default=16, help='并发线程数')
+    parser.add_argument('--duration', type=int, default=20, help='每个接口的测试时长（秒）')
+    args = parser.parse_args()
+
+    base_url = args.url.rstrip('/')
+    print(f"测试目标: {base_url}, 并发: {args.concurrency}, 时长: {args.duration}秒/接口")
+
+    targets = [('GET /domain/api/overview', f"{base_url}/domain/api/overview", None)]
+    if args.term_id and args.question_id:
+        clustering_url = f"{base_url}/domain/api/clustering?term_id={args.term_id}&question_id={args.question_id}"
+        targets.append(('GET /domain/api/clustering（已有结果）', clustering_url, {'Accept-Encoding': 'gzip'}))
+
+        # 先取一次ETag，测试条件请求（304）路径
+        try:
+            with urllib.request.urlopen(clustering_url, timeout=60) as response:
+                etag = response.headers.get('ETag')
+            if etag:
+                targets.append(('GET /domain/api/clustering（If-None-Match命中）', clustering_url,
+                                {'If-None-Match': etag}))
+        except Exception as e:
+            print(f"获取ETag失败，跳过条件请求测试: {e}")
+
+    for name, url, headers in targets:
+        print_result(name, run_benchmark(url, args.concurrency, args.duration, headers))
+
+
+if __name__ == "__main__":
+    main()
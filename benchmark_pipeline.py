@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+离线端到端性能测试脚本（不需要线上MySQL和付费LLM接口）
+用法: python benchmark_pipeline.py [--questions 3 --users 500 --hash-cardinality 100]
+      [--latency 0.5 --rate-429 0.05 --error-rate 0.01] [--workers 8 --llm-concurrency 8]
+
+流程:
+1. 启动本地模拟LLM服务（benchmark/mockLLMServer.py）
+2. 在SQLite替身（默认）或本地MySQL（--db mysql，使用config.ini [Database]）中生成合成答题数据
+3. 在临时工作目录中生成config.ini，运行 batchProcess.process_batch（--mode single 时逐题运行 process_ai_analysis）
+4. 启动API服务并压测 overview / clustering / metrics 接口
+5. 输出分析吞吐量、各阶段耗时分位数和接口延迟
+"""
+
+import argparse
+import configparser
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, 'benchmark'))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, 'src', 'AIProcess'))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, 'api'))
+
+import syntheticData
+from mockLLMServer import MockLLMServer
+
+RECORDS_TABLE = 'bench_answer_record'
+QUESTION_INFO_TABLE = 'bench_question_parse'
+
+
+def load_user_prompt():
+    """沿用项目配置中的用户提示词模板"""
+    config = configparser.ConfigParser(interpolation=None)
+    for name in ('config.ini', 'config.ini.example'):
+        config.read(os.path.join(PROJECT_ROOT, name), encoding='utf-8')
+        if config.has_option('Prompt', 'user_prompt'):
+            return config.get('Prompt', 'user_prompt')
+    return "题目配置：{question_info}\\n\\n参考答案：{standard_code}\\n\\n用户作答：{answer_code}\\n\\n错误信息：{error_info}"
+
+
+def load_mysql_config():
+    """--db mysql 时使用项目config.ini中的数据库配置"""
+    config = configparser.ConfigParser()
+    config.read(os.path.join(PROJECT_ROOT, 'config.ini'), encoding='utf-8')
+    return {key: config.get('Database', key) for key in ('host', 'port', 'user', 'password', 'database')}
+
+
+def write_config(workdir, llm_urls, db_config, args):
+    """生成测试用config.ini，多个模拟LLM时每个作为一个端点（[API] endpoints）"""
+    config = configparser.ConfigParser(interpolation=None)
+    config['API'] = {
+        'api_url': llm_urls[0],
+        'api_key': 'mock-key',
+        'model': 'mock-model',
+        'temperature': '0',
+        'timeout': '30',
+        'max_retry': str(args.max_retry),
+        'max_workers': str(args.workers),
+        'request_delay': '0',
+        'analysis_timeout': '600',
+        'json_repair': str(not args.no_json_repair).lower(),
+    }
+    if len(llm_urls) > 1:
+        names = [f"mock{i + 1}" for i in range(len(llm_urls))]
+        config['API']['endpoints'] = ', '.join(names)
+        for name, url in zip(names, llm_urls):
+            config[f"Endpoint.{name}"] = {
+                'api_url': url,
+                'api_key': f"{name}-key",
+                'max_concurrency': str(args.key_concurrency),
+            }
+        config['Router'] = {
+            'strategy': args.router_strategy,
+            'eject_seconds': '5',
+        }
+    config['Prompt'] = {
+        'system_prompt_path': os.path.join(PROJECT_ROOT, 'assets', 'system_prompt.txt'),
+        'user_prompt': load_user_prompt(),
+        'mark_code': args.mark_code,
+        'classify_prompt_path': os.path.join(PROJECT_ROOT, 'assets', 'system_prompt_classify.txt'),
+    }
+    config['Database'] = db_config
+    config['DataTable'] = {
+        'records_table': RECORDS_TABLE,
+        'question_info_table': QUESTION_INFO_TABLE,
+    }
+    config['Batch'] = {
+        'max_workers': str(args.workers),
+        'llm_concurrency': str(args.llm_concurrency or args.workers),
+        'request_delay': '0',
+    }
+    config['Metrics'] = {
+        'metrics_dir': os.path.join(workdir, 'data', 'metrics'),
+    }
+    config['Schedule'] = {
+        'time_budget': str(args.time_budget),
+    }
+    config['Hedge'] = {
+        'enabled': str(args.hedge).lower(),
+        # 测试数据量小，较少的样本后即按分位数对冲
+        'min_samples': '10',
+        'initial_delay': '2',
+        'min_delay': '0.1',
+    }
+    config['Breaker'] = {
+        'enabled': str(not args.no_breaker).lower(),
+        'open_seconds': str(args.breaker_open_seconds),
+        'pause_seconds': str(args.breaker_pause_seconds),
+    }
+    config['Cascade'] = {
+        'enabled': str(args.cascade).lower(),
+        'model': 'mock-model-lite',
+    }
+    config['Usage'] = {
+        'max_tokens_per_run': str(args.max_tokens_per_run),
+        'on_exceed': args.on_exceed,
+        'degrade_model': 'mock-model-lite',
+    }
+    path = os.path.join(workdir, 'config.ini')
+    with open(path, 'w', encoding='utf-8') as f:
+        config.write(f)
+    return config
+
+
+def run_pipeline(args, connect, questions):
+    """运行分析流程，返回 (耗时, 指标快照列表)"""
+    import AI_process
+    import batchProcess
+    from runMetrics import get_metrics_config, load_run_metrics
+
+    # 替换数据库连接（SQLite替身或本地MySQL）
+    AI_process.connect_to_database = lambda db_config: connect()
+    batchProcess.connect_to_database = AI_process.connect_to_database
+
+    start_time = time.time()
+    if args.sample is not None:
+        for term_id, question_id, _ in questions:
+            AI_process.process_ai_analysis(term_id, question_id, sample_size=args.sample)
+    elif args.mode == 'batch':
+        batchProcess.process_batch(questions, 'benchmark')
+    else:
+        for term_id, question_id, _ in questions:
+            AI_process.process_ai_analysis(term_id, question_id)
+    elapsed_time = time.time() - start_time
+    return elapsed_time, load_run_metrics(get_metrics_config()['metrics_dir'])
+
+
+def reset_term_tables(conn, term_id):
+    """重复运行时清空上次的分析结果和分类库，保证每次都完整调用LLM"""
+    tables = (f"ai_{term_id}", f"reusableCategory_{term_id}")
+    cursor = conn.cursor()
+    for table in tables:
+        cursor.execute(f"SHOW TABLES LIKE '{table}'")
+        if cursor.fetchone():
+            cursor.execute(f"DROP TABLE {table}")
+    # 删除表后同时清除迁移版本记录，否则会被当作已是最新版本而不再建表
+    cursor.execute("SHOW TABLES LIKE 'schema_version'")
+    if cursor.fetchone():
+        cursor.execute("DELETE FROM schema_version WHERE table_name IN (%s, %s)", tables)
+    conn.commit()
+    cursor.close()
+
+
+def retrain_with_classifier(args, config, connect, workdir):
+    """
+    --classifier: 用第一次运行的LLM结果训练本地分类器，生成下一学期（term_id + 1）同一批题目的新作答，
+    开启 [Classifier] 后在新学期（分析结果和分类库都为空）再运行一次
+    """
+    from localClassifier import get_classifier_config, train_and_save
+
+    config['Classifier'] = {
+        'enabled': 'true',
+        'model_dir': os.path.join(workdir, 'data', 'models'),
+        'min_samples': '10',
+    }
+    with open(os.path.join(workdir, 'config.ini'), 'w', encoding='utf-8') as f:
+        config.write(f)
+
+    next_term_id = args.term_id + 1
+    conn = connect()
+    questions = syntheticData.generate(conn, RECORDS_TABLE, QUESTION_INFO_TABLE, {
+        'term_id': next_term_id,
+        'questions': args.questions,
+        'users_per_question': args.users,
+        'hash_cardinality': args.hash_cardinality,
+        'zipf_skew': args.zipf_skew,
+        'code_size': args.code_size,
+        'seed': args.seed + 1,
+    })
+    reset_term_tables(conn, next_term_id)
+    # 模型按题目训练，使用所有学期（这里是上一学期）的LLM结果
+    classifier_config = get_classifier_config()
+    for _, question_id, _ in questions:
+        train_and_save(conn, question_id, classifier_config)
+    conn.close()
+    return questions
+
+
+def compare_sample_estimates(args, connect, questions):
+    """
+    --sample: 抽样分析后再完整分析剩余记录，比较各分类学生比例的估计值与真实值，
+    返回 (完整分析耗时, 真实值落在置信区间内的分类数, 分类总数)
+    """
+    import AI_process
+
+    start_time = time.time()
+    for term_id, question_id, _ in questions:
+        AI_process.process_ai_analysis(term_id, question_id)
+    elapsed_time = time.time() - start_time
+
+    conn = connect()
+    covered = total = 0
+    for term_id, question_id, _ in questions:
+        ai_table_name = f"ai_{term_id}"
+        estimate = AI_process.estimate_sample(conn, term_id, question_id, ai_table_name)
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT category, SUM(user_count) FROM {ai_table_name} WHERE question_id = %s GROUP BY category",
+                       (question_id,))
+        users = {category: int(count) for category, count in cursor.fetchall()}
+        cursor.close()
+        print(f"\nquestion_id={question_id}: 样本 {estimate['analyzed_samples']} 条 / 总体 "
+              f"{estimate['population_records']} 条, {estimate['strata']} 层")
+        for category in sorted(users, key=users.get, reverse=True):
+            actual = users[category] / sum(users.values())
+            result = estimate['categories'].get(category, {'estimated_share': 0.0, 'ci_low': 0.0, 'ci_high': 0.0})
+            inside = result['ci_low'] <= actual <= result['ci_high']
+            covered += inside
+            total += 1
+            print(f"  {category}: 估计 {result['estimated_share'] * 100:.1f}% "
+                  f"[{result['ci_low'] * 100:.1f}%, {result['ci_high'] * 100:.1f}%], 实际 {actual * 100:.1f}%"
+                  f"{'' if inside else '  (区间外)'}")
+    conn.close()
+    return elapsed_time, covered, total
+
+def start_api(config, connect):
+    """在后台线程启动API服务，返回 (服务地址, server)"""
+    import logging
+    from werkzeug.serving import make_server
+    import app as api_app
+
+    # 压测时不输出每个请求的访问日志
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    api_app.db_manager.config = config
+    api_app.db_manager.pool = None
+    api_app.db_manager.get_connection = connect
+    server = make_server('127.0.0.1', 0, api_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server
+
+
+def run_api_benchmark(base_url, questions, args):
+    """压测API接口"""
+    import urllib.request
+    from benchmark_api import run_benchmark
+
+    term_id, question_id, _ = questions[0]
+    clustering_url = f"{base_url}/domain/api/clustering?term_id={term_id}&question_id={question_id}"
+    targets = [
+        ('GET /domain/api/overview', f"{base_url}/domain/api/overview", {'Accept-Encoding': 'gzip'}),
+        ('GET /domain/api/clustering', clustering_url, {'Accept-Encoding': 'gzip'}),
+    ]
+    with urllib.request.urlopen(clustering_url, timeout=60) as response:
+        etag = response.headers.get('ETag')
+    if etag:
+        targets.append(('GET /domain/api/clustering（If-None-Match命中）', clustering_url, {'If-None-Match': etag}))
+    targets.append(('GET /metrics', f"{base_url}/metrics", None))
+
+    return [(name, run_benchmark(url, args.api_concurrency, args.api_duration, headers))
+            for name, url, headers in targets]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='离线端到端性能测试（模拟LLM + 合成数据）')
+    parser.add_argument('--db', choices=('sqlite', 'mysql'), default='sqlite',
+                        help='sqlite: 临时SQLite替身（默认）；mysql: 使用config.ini [Database]，只写入bench_开头的表')
+    parser.add_argument('--mode', choices=('batch', 'single'), default='batch',
+                        help='batch: batchProcess共享线程池；single: 逐题运行process_ai_analysis')
+    parser.add_argument('--term-id', type=int, default=900001, help='合成数据使用的term_id，避免与真实数据冲突')
+    parser.add_argument('--questions', type=int, default=3)
+    parser.add_argument('--users', type=int, default=500, help='每个题目的作答人数')
+    parser.add_argument('--hash-cardinality', type=int, default=100, help='每个题目的不同作答数量')
+    parser.add_argument('--zipf-skew', type=float, default=1.1, help='作答分布的Zipf指数')
+    parser.add_argument('--code-size', type=int, default=600, help='作答代码的平均长度（字节）')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--latency', type=float, default=0.5, help='模拟LLM平均延迟（秒）')
+    parser.add_argument('--jitter', type=float, default=0.3, help='模拟LLM延迟抖动')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='模拟LLM返回500的比例')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='模拟LLM返回429的比例')
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help='模拟LLM返回非法JSON的比例')
+    parser.add_argument('--wrapped-rate', type=float, default=0.0, help='模拟LLM返回代码块包裹、可本地修复的JSON的比例')
+    parser.add_argument('--no-json-repair', action='store_true', help='关闭本地JSON修复（对比重新调用的开销）')
+    parser.add_argument('--token-latency', type=float, default=0.0, help='模拟LLM每个输出token增加的延迟（秒）')
+    parser.add_argument('--slow-rate', type=float, default=0.0, help='模拟LLM长尾慢请求的比例')
+    parser.add_argument('--slow-latency', type=float, default=10.0, help='模拟LLM长尾慢请求的延迟（秒）')
+    parser.add_argument('--hedge', action='store_true', help='开启请求对冲（[Hedge] enabled）')
+    parser.add_argument('--endpoints', type=int, default=1, help='模拟LLM端点数（每个端点一个独立的模拟服务和key）')
+    parser.add_argument('--key-concurrency', type=int, default=0,
+                        help='每个端点（key）的并发额度，超出时模拟服务返回429，0表示不限制')
+    parser.add_argument('--failing-endpoints', type=int, default=0, help='其中始终返回500的端点数')
+    parser.add_argument('--router-strategy', choices=('least_outstanding', 'latency'), default='least_outstanding')
+    parser.add_argument('--outage-seconds', type=float, default=0.0, help='模拟LLM启动后前N秒所有请求返回500')
+    parser.add_argument('--no-breaker', action='store_true', help='关闭LLM熔断（[Breaker] enabled）')
+    parser.add_argument('--cascade', action='store_true', help='开启模型级联（先用mock-model-lite分类）')
+    parser.add_argument('--lite-novel-rate', type=float, default=0.05, help='便宜模型提出新三级类别的比例')
+    parser.add_argument('--classifier', action='store_true',
+                        help='用第一次运行的结果训练本地分类器，在新作答上开启 [Classifier] 再运行一次')
+    parser.add_argument('--sample', type=int, nargs='?', const=0, metavar='N',
+                        help='逐题抽样分析N条，之后完整分析并比较分类占比的估计值与真实值')
+    parser.add_argument('--breaker-open-seconds', type=float, default=30.0, help='熔断打开后进入半开状态的秒数')
+    parser.add_argument('--breaker-pause-seconds', type=float, default=300.0,
+                        help='熔断打开后最多暂停调度的秒数，0表示剩余记录直接计为未分析')
+    parser.add_argument('--mark-code', choices=('eager', 'lazy'), default='eager',
+                        help='lazy: 批量分析不生成标记代码（[Prompt] mark_code）')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--llm-concurrency', type=int, help='默认与--workers相同')
+    parser.add_argument('--max-retry', type=int, default=3)
+    parser.add_argument('--time-budget', type=float, default=0, help='分析的时间预算（秒），0表示不限制')
+    parser.add_argument('--max-tokens-per-run', type=int, default=0, help='单次运行的token预算，0表示不限制')
+    parser.add_argument('--on-exceed', choices=('stop', 'degrade'), default='stop', help='超出token预算后的处理方式')
+    parser.add_argument('--api-concurrency', type=int, default=8)
+    parser.add_argument('--api-duration', type=int, default=5, help='每个接口的压测时长（秒），0表示跳过接口压测')
+    parser.add_argument('--workdir', help='工作目录（默认临时目录，结束后删除）')
+    parser.add_argument('--keep', action='store_true', help='保留工作目录（报告、运行日志和SQLite数据库）')
+    parser.add_argument('--output', help='把测试结果保存为JSON文件')
+    args = parser.parse_args()
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='ai_clustering_bench_'))
+    os.makedirs(workdir, exist_ok=True)
+    llms = [MockLLMServer(latency=args.latency, jitter=args.jitter,
+                          error_rate=1.0 if i >= args.endpoints - args.failing_endpoints else args.error_rate,
+                          rate_429=args.rate_429, malformed_rate=args.malformed_rate,
+                          wrapped_rate=args.wrapped_rate, token_latency=args.token_latency,
+                          slow_rate=args.slow_rate, slow_latency=args.slow_latency,
+                          max_concurrency=args.key_concurrency, outage_seconds=args.outage_seconds,
+                          lite_novel_rate=args.lite_novel_rate, consistent_labels=args.classifier,
+                          seed=args.seed + i).start()
+            for i in range(max(args.endpoints, 1))]
+    llm = llms[0]
+    api_server = None
+
+    try:
+        if args.db == 'sqlite':
+            from sqliteStandIn import StandInDatabase
+            database = StandInDatabase(os.path.join(workdir, 'benchmark.sqlite3'))
+            connect = database.connect
+            db_config = {'host': 'sqlite', 'port': '0', 'user': '-', 'password': '-', 'database': database.path}
+        else:
+            import mysql.connector
+            db_config = load_mysql_config()
+            connect = lambda: mysql.connector.connect(charset='utf8mb4', use_unicode=True, **db_config)
+
+        os.chdir(workdir)
+        config = write_config(workdir, [server.url for server in llms], db_config, args)
+        print(f"工作目录: {workdir}")
+        print(f"模拟LLM: {llm.url} (延迟 {args.latency}s, 429 {args.rate_429:.0%}, 错误 {args.error_rate:.0%})"
+              + (f" 等 {len(llms)} 个端点" if len(llms) > 1 else ""))
+
+        start_time = time.time()
+        conn = connect()
+        questions = syntheticData.generate(conn, RECORDS_TABLE, QUESTION_INFO_TABLE, {
+            'term_id': args.term_id,
+            'questions': args.questions,
+            'users_per_question': args.users,
+            'hash_cardinality': args.hash_cardinality,
+            'zipf_skew': args.zipf_skew,
+            'code_size': args.code_size,
+            'seed': args.seed,
+        })
+        reset_term_tables(conn, args.term_id)
+        conn.close()
+        print(f"合成数据: {len(questions)} 个题目 x {args.users} 人 ({time.time() - start_time:.1f}秒)")
+
+        elapsed_time, run_metrics = run_pipeline(args, connect, questions)
+        if args.classifier:
+            llm_requests = llm.stats['requests']
+            print(f"\n只使用LLM: 耗时 {elapsed_time:.2f}秒, LLM请求 {llm_requests} 次；训练本地分类器后分析新作答")
+            questions = retrain_with_classifier(args, config, connect, workdir)
+            elapsed_time, run_metrics = run_pipeline(args, connect, questions)
+            print(f"本地分类器 + LLM: 耗时 {elapsed_time:.2f}秒, LLM请求 {llm.stats['requests'] - llm_requests} 次")
+        if args.sample is not None:
+            llm_requests = llm.stats['requests']
+            full_time, covered, total = compare_sample_estimates(args, connect, questions)
+            print(f"\n抽样分析: 耗时 {elapsed_time:.2f}秒, LLM请求 {llm_requests} 次；"
+                  f"完整分析剩余记录: 耗时 {full_time:.2f}秒, LLM请求 {llm.stats['requests'] - llm_requests} 次；"
+                  f"{covered}/{total} 个分类的真实占比落在置信区间内")
+
+        conn = connect()
+        cursor = conn.cursor()
+        # --classifier 时最后分析的是下一学期
+        cursor.execute(f"SELECT COUNT(*) FROM ai_{questions[0][0]}")
+        analyzed = cursor.fetchone()[0]
+        cursor.close()
+        conn.close()
+
+        api_results = []
+        if args.api_duration > 0 and analyzed:
+            base_url, api_server = start_api(config, connect)
+            api_results = run_api_benchmark(base_url, questions, args)
+
+        from runMetrics import build_metrics_report_lines
+        print("\n" + "=" * 60)
+        print(f"分析模式: {args.mode}, 线程数: {args.workers}, LLM并发: {args.llm_concurrency or args.workers}")
+        print(f"分析结果: {analyzed} 条, 耗时 {elapsed_time:.2f}秒, 吞吐量 {analyzed / elapsed_time:.2f} 条/秒"
+              if elapsed_time > 0 else f"分析结果: {analyzed} 条")
+        for i, server in enumerate(llms, 1):
+            print(f"模拟LLM请求{f' (mock{i})' if len(llms) > 1 else ''}: {server.stats}")
+        for snapshot in run_metrics:
+            print(f"\n--- 运行 {snapshot.get('labels')} ---")
+            print("\n".join(build_metrics_report_lines(snapshot)))
+        for name, result in api_results:
+            print(f"{name}: {result['rps']:.1f} req/s, p50 {result['p50_ms']:.1f}ms, "
+                  f"p95 {result['p95_ms']:.1f}ms, p99 {result['p99_ms']:.1f}ms, 状态码 {result['status']}")
+
+        if args.output:
+            output_path = os.path.join(PROJECT_ROOT, args.output) if not os.path.isabs(args.output) else args.output
+            with open(output_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'options': vars(args),
+                    'analyzed': analyzed,
+                    'elapsed_time': elapsed_time,
+                    'throughput': analyzed / elapsed_time if elapsed_time > 0 else 0,
+                    'llm_stats': [server.stats for server in llms] if len(llms) > 1 else llm.stats,
+                    'run_metrics': run_metrics,
+                    'api': {name: result for name, result in api_results},
+                }, f, ensure_ascii=False, indent=2, default=str)
+            print(f"\n测试结果已保存: {output_path}")
+    finally:
+        if api_server is not None:
+            api_server.shutdown()
+        for server in llms:
+            server.stop()
+        os.chdir(PROJECT_ROOT)
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@
 """
 AI错误分析系统 - 运行入口
 用法: python run.py <term_id> <question_id>
+      python run.py <term_id>              # 批量分析整个学期
 """
 
 import sys
@@ -62,12 +63,22 @@ def run_command(cmd, step_name, term_id, question_id):
         return False
 
 def main():
+    if len(sys.argv) == 2:
+        # 批量模式：分析整个学期的所有题目，输出直接打印便于观察进度
+        term_id = sys.argv[1]
+        print(f"开始执行AI批量分析 [term_id={term_id}]")
+        result = subprocess.run(f"python src/AIProcess/batchProcess.py {term_id}", shell=True)
+        sys.exit(result.returncode)
+    
     if len(sys.argv) != 3:
         print("用法: python run.py <term_id> <question_id>")
         print("示例: python run.py 17787 77337")
+        print("\n批量分析整个学期:")
+        print("  python run.py <term_id>")
         print("\n也可以分步执行:")
         print("  python src/AIProcess/dataProcess.py <term_id> <question_id>")
         print("  python src/AIProcess/AI_process.py <term_id> <question_id>")
+        print("  python src/AIProcess/batchProcess.py <term_id> [--questions id1,id2] [--overview 文件或URL]")
         sys.exit(1)
     
     term_id, question_id = sys.argv[1], sys.argv[2]
@@ -5,9 +5,37 @@ import pandas as pd
 import requests
 import time
 import os
-import sys
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Lock
+import signal
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from threading import Event, Lock
+
+from answerPreprocess import build_preprocess_report_lines, get_preprocess_config, preprocess_dataframe
+from circuitBreaker import STATE_CLOSED, get_breaker
+from dataProcess import aggregate_records
+from hedgedRequest import get_hedger
+from llmRouter import AcquireAborted, get_router, load_endpoints
+from localClassifier import LOCAL_MODEL, ROUTE_LOCAL, load_classifier
+from modelCascade import (
+    ROUTE_CHEAP, cascade_enabled, category_exists, cheap_api_config, cheap_prompt, escalation_reason, get_cascade_config
+)
+from runJournal import (
+    STATE_DONE, STATE_FAILED, STATE_IN_FLIGHT, STATE_QUEUED,
+    RunJournal, get_journal_config, journal_path, summarize_tasks, summarize_usage
+)
+from responseParse import (
+    CLASSIFY_FIELDS, REQUIRED_FIELDS, RESPONSE_FORMATS, build_response_format, parse_json_content, validate_response
+)
+from runMetrics import build_metrics_report_lines, metrics, save_run_metrics
+from schemaMigration import ensure_table
+from stratifiedSample import (
+    build_sample_report_lines, create_sample_table, draw_sample, estimate_shares, get_sampling_config, load_sample,
+    save_sample
+)
+from taskSchedule import (
+    CANCEL_REASONS, cancel_path, cancel_requested, clear_cancel, coverage, get_schedule_config, order_tasks
+)
+from tokenUsage import RunBudget, add_usage, build_usage_report_lines, get_usage_config, new_usage
+from workLease import claim_answer, complete_claim, create_lease_table, get_worker_config, release_claim
 
 # 全局变量
 category_updates = {
@@ -17,9 +45,31 @@ category_updates = {
 }
 file_lock = Lock()
 
+# 全局LLM并发预算（批量模式下所有题目共享），None表示不额外限制
+llm_semaphore = None
+
+# 本次运行的token/费用预算（RunBudget），None表示不限制
+run_budget = None
+
+# 本次运行的截止时间（time.time()），到达后不再发起或重试LLM请求，None表示不限制
+run_deadline = None
+
+# 本次运行的取消标记：收到取消请求（取消文件或SIGTERM）后设置，之后不再发起或重试LLM请求，已调度的任务记为未分析；
+# 每次运行开始时清除，取消文件只取消当前这一次运行
+run_cancel = Event()
+
+# 进程终止标记：收到SIGTERM后设置且不再清除，--continuous 不再开始下一次运行
+run_terminate = Event()
+
+# 等待任务结果时检查截止时间和取消请求的间隔（秒）
+TASK_POLL_SECONDS = 1.0
+
+# 接口不支持response_format参数（返回HTTP 400）后不再发送
+response_format_unsupported = False
+
 class Counter:
-    def __init__(self):
-        self._value = 0
+    def __init__(self, value=0):
+        self._value = value
         self._lock = Lock()
     
     def increment(self):
@@ -30,10 +80,11 @@ class Counter:
     def value(self):
         return self._value
 
-def get_config():
-    """从config.ini读取配置"""
-    config = configparser.ConfigParser()
-    config.read('config.ini', encoding='utf-8')
+def get_config(config=None):
+    """从config.ini读取配置，可传入已加载的ConfigParser"""
+    if config is None:
+        config = configparser.ConfigParser()
+        config.read('config.ini', encoding='utf-8')
     
     db_config = {
         'host': config.get('Database', 'host'),
@@ -50,13 +101,31 @@ def get_config():
         'temperature': config.getfloat('API', 'temperature', fallback=0),
         'timeout': config.getint('API', 'timeout', fallback=30),
         'max_retry': config.getint('API', 'max_retry', fallback=3),
-        'analysis_timeout': config.getint('API', 'analysis_timeout', fallback=600)
+        'analysis_timeout': config.getint('API', 'analysis_timeout', fallback=600),
+        # 请求模型以JSON格式输出: none / json_object / json_schema（需要接口支持response_format参数）
+        'response_format': config.get('API', 'response_format', fallback='none').strip().lower(),
+        # JSON解析失败时先在本地修复，修复失败才重新调用
+        'json_repair': config.getboolean('API', 'json_repair', fallback=True)
     }
+    if api_config['response_format'] not in RESPONSE_FORMATS:
+        raise ValueError(f"[API] response_format 可选: {', '.join(RESPONSE_FORMATS)}")
+    # 多端点路由（[API] endpoints），未配置时为 [API] 中的单个端点
+    api_config['endpoints'] = load_endpoints(config, api_config)
+    # 模型级联（[Cascade]），先用便宜模型分类
+    api_config['cascade'] = get_cascade_config(config)
     
     prompt_config = {
         'system_prompt_path': config.get('Prompt', 'system_prompt_path'),
-        'user_prompt': config.get('Prompt', 'user_prompt')
+        'user_prompt': config.get('Prompt', 'user_prompt'),
+        # eager: 批量分析时同时生成标记代码；lazy: 批量分析只做分类，标记代码在查看时按需生成
+        'mark_code': config.get('Prompt', 'mark_code', fallback='eager').strip().lower(),
+        'classify_prompt_path': config.get('Prompt', 'classify_prompt_path', fallback='assets/system_prompt_classify.txt'),
+        'mark_code_prompt_path': config.get('Prompt', 'mark_code_prompt_path', fallback='assets/mark_code_prompt.txt')
     }
+    if prompt_config['mark_code'] not in ('eager', 'lazy'):
+        raise ValueError("[Prompt] mark_code 可选: eager, lazy")
+    if prompt_config['mark_code'] == 'lazy':
+        prompt_config['system_prompt_path'] = prompt_config['classify_prompt_path']
     
     thread_config = {
         'max_workers': config.getint('API', 'max_workers', fallback=8),
@@ -77,44 +146,9 @@ def get_config():
     return db_config, api_config, prompt_config, thread_config, template_config
 
 def create_reusable_category_table(conn, term_id, question_id):
-    """创建可复用分类表"""
+    """创建可复用分类表（表结构由schemaMigration管理）"""
     table_name = f"reusableCategory_{term_id}"
-    cursor = conn.cursor()
-    
-    # 检查表是否存在
-    cursor.execute(f"SHOW TABLES LIKE '{table_name}'")
-    table_exists = cursor.fetchone() is not None
-    
-    if not table_exists:
-        create_table_sql = f"""
-        CREATE TABLE {table_name} (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            question_id BIGINT NOT NULL,
-            category VARCHAR(100) NOT NULL,
-            subcategory VARCHAR(150) NOT NULL,
-            thirdCategory VARCHAR(200) NOT NULL,
-            UNIQUE KEY unique_category (question_id, category(50), subcategory(80), thirdCategory(100)),
-            INDEX idx_question_id (question_id),
-            INDEX idx_category (category),
-            INDEX idx_subcategory (subcategory),
-            INDEX idx_thirdCategory (thirdCategory)
-        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-        """
-        cursor.execute(create_table_sql)
-        conn.commit()
-        
-        # 初始化基础分类数据
-        initial_categories = [
-        ]
-        
-        insert_sql = f"""
-        INSERT IGNORE INTO {table_name} (question_id, category, subcategory, thirdCategory)
-        VALUES (%s, %s, %s, %s)
-        """
-        cursor.executemany(insert_sql, initial_categories)
-        conn.commit()
-    
-    cursor.close()
+    ensure_table(conn, 'category', table_name)
     return table_name
 
 def load_categories_from_db(conn, table_name, question_id):
@@ -160,8 +194,8 @@ def load_categories_from_db(conn, table_name, question_id):
         print(f"从数据库加载分类失败: {e}")
         return []
 
-def load_system_prompt(system_prompt_path, conn, category_table_name, question_id):
-    """加载系统提示词"""
+def load_system_prompt(system_prompt_path, conn, category_table_name, question_id, usage=None):
+    """加载系统提示词，传入usage时记录插入的分类体系字符数"""
     try:
         with open(system_prompt_path, 'r', encoding='utf-8') as f:
             system_prompt = f.read()
@@ -171,6 +205,8 @@ def load_system_prompt(system_prompt_path, conn, category_table_name, question_i
         categories_text = json.dumps(categories, ensure_ascii=False, indent=2)
         
         # 在系统提示词中插入分类信息
+        if usage is not None:
+            usage['taxonomy_chars'] += len(categories_text)
         if "已有的错误分类体系将从数据库中动态加载。" in system_prompt:
             system_prompt = system_prompt.replace(
                 "已有的错误分类体系将从数据库中动态加载。",
@@ -187,69 +223,8 @@ def connect_to_database(db_config):
     return mysql.connector.connect(**db_config)
 
 def create_ai_table(conn, table_name):
-    """创建AI分析结果表"""
-    cursor = conn.cursor()
-    
-    # 检查表是否存在
-    cursor.execute(f"SHOW TABLES LIKE '{table_name}'")
-    table_exists = cursor.fetchone() is not None
-    
-    if not table_exists:
-        create_table_sql = f"""
-        CREATE TABLE {table_name} (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            answer_hash VARCHAR(255) NOT NULL,
-            question_id BIGINT NOT NULL,
-            category VARCHAR(255),
-            subcategory VARCHAR(255),
-            thirdCategory VARCHAR(255),
-            specific_reason VARCHAR(300),
-            mark_code LONGTEXT,
-            standard_code LONGTEXT,
-            answer_code LONGTEXT,
-            error_info TEXT,
-            response JSON,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            INDEX idx_answer_hash (answer_hash),
-            INDEX idx_question_id (question_id)
-        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-        """
-        cursor.execute(create_table_sql)
-        conn.commit()
-    else:
-        # 检查并添加缺失的字段
-        cursor.execute(f"DESCRIBE {table_name}")
-        columns = [row[0] for row in cursor.fetchall()]
-        
-        if 'question_id' not in columns:
-            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN question_id BIGINT NOT NULL")
-            cursor.execute(f"ALTER TABLE {table_name} ADD INDEX idx_question_id (question_id)")
-        if 'category' not in columns:
-            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN category VARCHAR(255)")
-        if 'subcategory' not in columns:
-            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN subcategory VARCHAR(255)")
-        if 'thirdCategory' not in columns:
-            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN thirdCategory VARCHAR(255)")
-        if 'specific_reason' not in columns:
-            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN specific_reason VARCHAR(300)")
-        if 'mark_code' not in columns:
-            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN mark_code LONGTEXT")
-        if 'standard_code' not in columns:
-            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN standard_code LONGTEXT")
-        if 'answer_code' not in columns:
-            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN answer_code LONGTEXT")
-        if 'error_info' not in columns:
-            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN error_info TEXT")
-        if 'response' not in columns:
-            if 'analysis_result' in columns:
-                # 重命名现有的analysis_result列为response
-                cursor.execute(f"ALTER TABLE {table_name} CHANGE COLUMN analysis_result response JSON")
-            else:
-                cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN response JSON")
-        
-        conn.commit()
-    
-    cursor.close()
+    """创建AI分析结果表，旧表按schemaMigration中的迁移步骤升级"""
+    ensure_table(conn, 'ai', table_name)
 
 def get_question_info(conn, term_id, question_id):
     """从question_info表中获取题目信息"""
@@ -312,47 +287,172 @@ def check_answer_exists(conn, table_name, answer_hash, question_id):
     except Exception:
         return False
 
-def call_ai_api(api_config, system_prompt, user_prompt):
-    """调用AI API进行分析"""
-    headers = {
-        'Authorization': f'Bearer {api_config["api_key"]}',
-        'Content-Type': 'application/json'
-    }
-    
+def fetch_existing_hashes(conn, table_name, question_id, answer_hashes, chunk_size=1000):
+    """批量查询已有分析结果的answer_hash，替代逐条存在性检查"""
+    existing = set()
+    answer_hashes = list(answer_hashes)
+    cursor = conn.cursor()
+    for i in range(0, len(answer_hashes), chunk_size):
+        chunk = answer_hashes[i:i + chunk_size]
+        placeholders = ', '.join(['%s'] * len(chunk))
+        cursor.execute(
+            f"SELECT answer_hash FROM {table_name} WHERE question_id = %s AND answer_hash IN ({placeholders})",
+            (question_id, *chunk)
+        )
+        existing.update(row[0] for row in cursor.fetchall())
+    cursor.close()
+    return existing
+
+def record_api_usage(api_usage, usage=None):
+    """记录API响应中的usage（prompt_tokens/completion_tokens）"""
+    if not api_usage:
+        return
+    prompt_tokens = int(api_usage.get('prompt_tokens') or 0)
+    completion_tokens = int(api_usage.get('completion_tokens') or 0)
+    metrics.increment('llm_prompt_tokens', prompt_tokens)
+    metrics.increment('llm_completion_tokens', completion_tokens)
+    if usage is not None:
+        usage['prompt_tokens'] += prompt_tokens
+        usage['completion_tokens'] += completion_tokens
+
+def call_ai_api(api_config, system_prompt, user_prompt, usage=None, required_fields=REQUIRED_FIELDS, deadline=None,
+                route=None):
+    """
+    调用AI API进行分析，传入usage时累加每次请求（含重试）的token用量
+    响应经过本地提取/修复并校验必需字段（required_fields），只有无法使用的响应才重新调用
+    deadline: 截止时间，每次请求的超时不超过剩余时间，到达后不再重试
+    每次请求由llmRouter选择端点，传入route（dict）时写入返回结果的端点名称和模型
+    慢请求按 [Hedge] 配置发送对冲请求（对冲请求同样经过端点选择），见hedgedRequest
+    熔断打开时（见circuitBreaker）不发起请求，直接返回None
+    """
+    global response_format_unsupported
     data = {
-        'model': api_config['model'],
         'messages': [
             {'role': 'system', 'content': system_prompt},
             {'role': 'user', 'content': user_prompt}
         ],
         'temperature': api_config['temperature']
     }
+    response_format = build_response_format(api_config.get('response_format', 'none'), required_fields)
+    if response_format and not response_format_unsupported:
+        data['response_format'] = response_format
+    
+    hedger = get_hedger()
+    router = get_router(api_config['endpoints'])
+    breaker = get_breaker()
+    
+    def send(timeout):
+        endpoint = router.acquire(deadline, run_cancel)
+        # 降级模型（超出运行预算）和级联的便宜模型在所有端点上使用
+        model = api_config['model'] if api_config.get('force_model') else endpoint['model']
+        headers = {
+            'Authorization': f'Bearer {endpoint["api_key"]}',
+            'Content-Type': 'application/json'
+        }
+        start = time.time()
+        try:
+            response = requests.post(endpoint['api_url'], headers=headers, json=dict(data, model=model), timeout=timeout)
+        except requests.exceptions.RequestException as e:
+            router.release(endpoint, failed=True)
+            # 按截止时间缩短了超时的请求超时不算上游故障
+            if not isinstance(e, requests.exceptions.Timeout) or timeout >= api_config['timeout']:
+                breaker.record(True)
+            else:
+                breaker.record(None)
+            raise
+        failed = response.status_code == 429 or response.status_code >= 500
+        router.release(endpoint, None if failed else time.time() - start, failed)
+        # HTTP 429是限流而不是上游故障，不计入失败率
+        breaker.record(None if response.status_code == 429 else response.status_code >= 500)
+        response.endpoint = (endpoint['name'], model)
+        return response
+    
+    def record_discarded(response):
+        """对冲时未被采用的请求同样计费，计入指标和运行预算"""
+        discarded = new_usage()
+        record_api_usage(response.json().get('usage'), discarded)
+        if run_budget is not None:
+            run_budget.record(discarded)
     
     last_error = None
-    for attempt in range(api_config['max_retry']):
+    short_circuited = False
+    attempt = 0
+    while attempt < api_config['max_retry']:
+        if run_cancel.is_set():
+            metrics.increment('llm_cancelled')
+            break
+        # 熔断打开期间等待进入半开状态，等待不占用重试次数
+        while not breaker.allow():
+            if not breaker.wait_ready(deadline, run_cancel, TASK_POLL_SECONDS):
+                short_circuited = True
+                break
+        if short_circuited:
+            break
+        timeout = api_config['timeout']
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.time())
+            if timeout <= 0:
+                metrics.increment('llm_deadline')
+                break
+        if attempt > 0:
+            metrics.increment('llm_retry')
         try:
-            response = requests.post(
-                api_config['api_url'],
-                headers=headers,
-                json=data,
-                timeout=api_config['timeout']
-            )
+            metrics.increment('llm_request')
+            if usage is not None:
+                usage['calls'] += 1
+                usage['prompt_chars'] += len(system_prompt) + len(user_prompt)
+            with metrics.timer('llm'):
+                response = hedger.post(send, timeout, on_discard=record_discarded)
             
             if response.status_code == 200:
                 result = response.json()
-                content = result['choices'][0]['message']['content']
-                try:
-                    return json.loads(content)
-                except json.JSONDecodeError as e:
-                    print(f"AI响应JSON解析失败 (尝试 {attempt + 1}/{api_config['max_retry']}): {e}")
-                    print(f"原始响应内容: {content[:500]}...")
-                    last_error = f"JSON解析失败: {e}"
+                record_api_usage(result.get('usage'), usage)
+                if route is not None:
+                    route['endpoint'], route['model'] = response.endpoint
+                choice = result['choices'][0]
+                content = choice['message']['content']
+                if choice.get('finish_reason') == 'length':
+                    # 达到max_tokens被截断的输出即使能修复成JSON，字段内容也不完整
+                    metrics.increment('llm_truncated')
+                    print(f"AI响应被截断 (尝试 {attempt + 1}/{api_config['max_retry']})")
+                    last_error = "AI响应被截断（finish_reason=length）"
+                else:
+                    try:
+                        with metrics.timer('json_parse'):
+                            ai_response, parsed_by = parse_json_content(content, api_config.get('json_repair', True))
+                            missing_fields = validate_response(ai_response, required_fields)
+                        if parsed_by != 'direct':
+                            metrics.increment(f'llm_json_{parsed_by}')
+                        if not missing_fields:
+                            return ai_response
+                        metrics.increment('llm_json_incomplete')
+                        print(f"AI响应缺少必要字段 {missing_fields} (尝试 {attempt + 1}/{api_config['max_retry']})")
+                        last_error = f"AI响应缺少必要字段: {missing_fields}"
+                    except ValueError as e:
+                        metrics.increment('llm_json_error')
+                        print(f"AI响应JSON解析失败 (尝试 {attempt + 1}/{api_config['max_retry']}): {e}")
+                        print(f"原始响应内容: {content[:500]}...")
+                        last_error = f"JSON解析失败: {e}"
+            elif response.status_code == 400 and 'response_format' in data:
+                # 接口不支持结构化输出参数时去掉该参数立即重发，不占用重试次数，之后的请求也不再发送
+                response_format_unsupported = True
+                del data['response_format']
+                print(f"AI接口不支持response_format参数，改为普通输出: {response.text[:200]}")
+                last_error = f"HTTP 400: {response.text[:200]}"
+                continue
             else:
+                metrics.increment('llm_http_429' if response.status_code == 429 else 'llm_http_error')
                 print(f"AI API调用失败 (尝试 {attempt + 1}/{api_config['max_retry']}): HTTP {response.status_code}")
                 print(f"响应内容: {response.text[:500]}...")
                 last_error = f"HTTP {response.status_code}: {response.text[:200]}"
             
+        except AcquireAborted as e:
+            # 等待端点并发名额时到达截止时间或被取消，由下面的检查返回对应状态
+            metrics.increment('llm_cancelled' if e.status == 'cancelled' else 'llm_deadline')
+            last_error = f"等待端点并发名额时停止: {e.status}"
+            break
         except requests.exceptions.Timeout as e:
+            metrics.increment('llm_timeout')
             print(f"AI API调用超时 (尝试 {attempt + 1}/{api_config['max_retry']}): {e}")
             last_error = f"请求超时: {e}"
         except requests.exceptions.RequestException as e:
@@ -364,7 +464,19 @@ def call_ai_api(api_config, system_prompt, user_prompt):
         
         if attempt < api_config['max_retry'] - 1:
             time.sleep(1)
+        attempt += 1
     
+    if run_cancel.is_set():
+        print(f"分析已取消，停止重试LLM请求（最后错误: {last_error}）")
+        return None
+    if deadline is not None and time.time() >= deadline:
+        print(f"已到达截止时间，停止重试LLM请求（最后错误: {last_error}）")
+        return None
+    if short_circuited:
+        if last_error:
+            print(f"LLM熔断打开，停止重试（最后错误: {last_error}）")
+        return None
+    metrics.increment('llm_failed')
     print(f"AI API调用最终失败，已重试 {api_config['max_retry']} 次，最后错误: {last_error}")
     return None
 
@@ -385,9 +497,10 @@ def is_similar_subcategory(new_subcategory, existing_subcategories):
     
     return None
 
-def update_reusable_category_db(conn, category_table_name, ai_response, question_id):
+def update_reusable_category_db(conn, category_table_name, ai_response, question_id, category_updates=None):
     """更新可复用类别数据库表（带相似性检查和强制刷新）"""
-    global category_updates
+    if category_updates is None:
+        category_updates = globals()['category_updates']
     
     with file_lock:
         try:
@@ -465,14 +578,25 @@ def update_reusable_category_db(conn, category_table_name, ai_response, question
                 pass
 
 def insert_ai_result(conn, table_name, data):
-    """插入AI分析结果到数据库"""
+    """
+    写入AI分析结果，同一 (question_id, answer_hash) 已有结果时覆盖为本次结果
+    依赖uk_question_answer唯一键，并发或重试的运行不会产生重复行
+    """
     try:
         cursor = conn.cursor()
         insert_sql = f"""
         INSERT INTO {table_name} (
             answer_hash, question_id, category, subcategory, thirdCategory, specific_reason, mark_code,
-            standard_code, answer_code, error_info, response
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            standard_code, answer_code, error_info, response, user_count, prompt_tokens, completion_tokens, model,
+            endpoint, cascade_route
+        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            category = VALUES(category), subcategory = VALUES(subcategory), thirdCategory = VALUES(thirdCategory),
+            specific_reason = VALUES(specific_reason), mark_code = VALUES(mark_code),
+            standard_code = VALUES(standard_code), answer_code = VALUES(answer_code), error_info = VALUES(error_info),
+            response = VALUES(response), user_count = VALUES(user_count), prompt_tokens = VALUES(prompt_tokens),
+            completion_tokens = VALUES(completion_tokens), model = VALUES(model), endpoint = VALUES(endpoint),
+            cascade_route = VALUES(cascade_route)
         """
         cursor.execute(insert_sql, (
             data['answer_hash'],
@@ -485,8 +609,17 @@ def insert_ai_result(conn, table_name, data):
             data['standard_code'],
             data['answer_code'],
             data['error_info'],
-            json.dumps(data['response'], ensure_ascii=False)
+            json.dumps(data['response'], ensure_ascii=False),
+            data.get('user_count', 0),
+            data.get('prompt_tokens', 0),
+            data.get('completion_tokens', 0),
+            data.get('model'),
+            data.get('endpoint'),
+            data.get('cascade_route')
         ))
+        # MySQL对ON DUPLICATE KEY UPDATE: 1表示新插入，2表示覆盖了已有结果
+        if cursor.rowcount == 2:
+            metrics.increment('db_upsert_update')
         conn.commit()
         cursor.close()
         return True
@@ -498,22 +631,39 @@ def insert_ai_result(conn, table_name, data):
         return False
 
 def process_single_record(args):
-    """处理单条记录"""
-    (index, row, db_config, api_config, prompt_config, thread_config, template_config,
-     question_info, system_prompt_path, ai_table_name, category_table_name, question_id) = args
-    
-    conn = None
-    try:
-        conn = connect_to_database(db_config)
-        
-        # 检查是否已存在（按question_id筛选）
-        if check_answer_exists(conn, ai_table_name, row['answer_hash'], question_id):
-            return "skip", 'skip'
-        
+    """处理单条记录，返回 (结果, 状态, token用量)"""
+    usage = new_usage()
+    result, status = analyze_record(args, usage)
+    return result, status, usage
+
+def classify_locally(classifier, conn, row, category_table_name, question_id):
+    """本地分类器（localClassifier）的置信度足够时返回 (ai_response, route)，否则返回 (None, None)"""
+    prediction, confidence, similarity = classifier.predict(
+        row.get('answer_code', '') if pd.notna(row.get('answer_code')) else '',
+        row.get('error_info', '') if pd.notna(row.get('error_info')) else '',
+        question_id
+    )
+    # global模型可能给出其他题目的分类，只接受本题分类库中已有的分类；
+    # 题目模型的分类都来自本题（可能是以前学期的结果，新学期的分类库中还没有，写入结果时加入分类库）
+    if (prediction is None or not classifier.accept(confidence, similarity)
+            or classifier.include_question and not category_exists(conn, category_table_name, question_id, prediction)):
+        metrics.increment('local_reject')
+        return None, None
+    metrics.increment('local_accept')
+    prediction['confidence'] = round(confidence, 3)
+    return prediction, {'endpoint': None, 'model': LOCAL_MODEL, 'cascade': ROUTE_LOCAL}
+
+def classify_with_llm(conn, row, api_config, prompt_config, question_info, system_prompt_path,
+                      category_table_name, question_id, usage):
+    """
+    构建提示词并调用LLM（开启 [Cascade] 时先尝试便宜模型），返回 (ai_response, route, 失败状态)
+    route: 实际返回结果的端点、模型和级联路由
+    """
+    with metrics.timer('prompt_build'):
         # 每次都重新加载系统提示词，确保获取最新的分类数据（按question_id筛选）
-        system_prompt = load_system_prompt(system_prompt_path, conn, category_table_name, question_id)
+        system_prompt = load_system_prompt(system_prompt_path, conn, category_table_name, question_id, usage)
         if not system_prompt:
-            return "error", 'system_prompt_load_failed'
+            return None, None, 'system_prompt_load_failed'
         
         # 构建用户提示词
         user_prompt = prompt_config['user_prompt'].format(
@@ -522,65 +672,798 @@ def process_single_record(args):
             answer_code=row.get('answer_code', '') if pd.notna(row.get('answer_code')) else '',
             error_info=row.get('error_info', '') if pd.notna(row.get('error_info')) else ''
         )
+    
+    # 已到达运行截止时间的任务不再调用LLM，记为未分析（可续跑）
+    deadline = run_deadline
+    if deadline is not None and time.time() >= deadline:
+        return None, None, 'deadline_exceeded'
+    if run_cancel.is_set():
+        return None, None, 'cancelled'
+    
+    # 超出运行预算时停止调用或改用降级模型
+    budget = run_budget
+    if budget is not None:
+        api_config = budget.api_config_for_call(api_config)
+        if api_config is None:
+            metrics.increment('budget_skip')
+            return None, None, 'budget_exceeded'
+    
+    # 调用AI API
+    semaphore = llm_semaphore
+    if semaphore is not None:
+        with metrics.timer('llm_queue_wait'):
+            semaphore.acquire()
+    try:
+        required_fields = CLASSIFY_FIELDS if prompt_config['mark_code'] == 'lazy' else REQUIRED_FIELDS
+        route = {'endpoint': None, 'model': api_config['model'], 'cascade': None}
+        ai_response = None
+        cascade_config = api_config.get('cascade')
+        if cascade_enabled(cascade_config):
+            # 先用便宜模型，结果不可用、提出新分类或置信度低时再调用配置的模型
+            cheap_system_prompt, cheap_fields = cheap_prompt(system_prompt, required_fields, cascade_config)
+            cheap_response = call_ai_api(cheap_api_config(api_config, cascade_config), cheap_system_prompt,
+                                         user_prompt, usage, cheap_fields, deadline, route)
+            reason = escalation_reason(conn, category_table_name, question_id, cheap_response, cascade_config)
+            if reason is None:
+                ai_response = cheap_response
+                route['cascade'] = ROUTE_CHEAP
+                metrics.increment('cascade_accept')
+            else:
+                route['cascade'] = f"escalated:{reason}"
+                metrics.increment(f'cascade_escalate_{reason}')
+        if ai_response is None:
+            ai_response = call_ai_api(api_config, system_prompt, user_prompt, usage, required_fields, deadline, route)
+    finally:
+        if semaphore is not None:
+            semaphore.release()
+        if budget is not None:
+            budget.record(usage)
+    
+    if ai_response:
+        return ai_response, route, None
+    if run_cancel.is_set():
+        return None, route, 'cancelled'
+    if deadline is not None and time.time() >= deadline:
+        return None, route, 'deadline_exceeded'
+    if get_breaker().state != STATE_CLOSED:
+        return None, route, 'circuit_open'
+    print(f"AI API调用失败: {row['answer_hash']}")
+    return None, route, 'api_call_failed'
+
+def analyze_record(args, usage):
+    """分析单条记录并写入结果，LLM用量累加到usage"""
+    (index, row, db_config, api_config, prompt_config, thread_config, template_config,
+     question_info, system_prompt_path, ai_table_name, category_table_name, question_id,
+     job_category_updates, lease, classifier) = args
+    
+    # 熔断打开期间先暂停，不连接数据库和准备提示词；到达截止时间、取消或等待超过pause_seconds时记为未分析（可续跑）
+    if not get_breaker().wait_ready(run_deadline, run_cancel, TASK_POLL_SECONDS):
+        if run_cancel.is_set():
+            return "error", 'cancelled'
+        if run_deadline is not None and time.time() >= run_deadline:
+            return "error", 'deadline_exceeded'
+        return "error", 'circuit_open'
+    
+    conn = None
+    claimed, succeeded = False, False
+    try:
+        conn = connect_to_database(db_config)
         
-        # 调用AI API
-        ai_response = call_ai_api(api_config, system_prompt, user_prompt)
+        # 检查是否已存在（按question_id筛选）
+        with metrics.timer('existing_check'):
+            exists = check_answer_exists(conn, ai_table_name, row['answer_hash'], question_id)
+        if exists:
+            metrics.increment('skip_existing')
+            return "skip", 'skip'
         
-        if ai_response:
-            # 验证AI响应的完整性
-            required_fields = ['category', 'subcategory', 'thirdCategory', 'specific_reason', 'mark_code']
-            missing_fields = [field for field in required_fields if not ai_response.get(field)]
-            
-            if missing_fields:
-                print(f"AI响应缺少必要字段 {missing_fields}: {row['answer_hash']}")
-                return "error", f'ai_response_incomplete: missing {missing_fields}'
-            
-            # 更新类别库（包含question_id）
-            update_reusable_category_db(conn, category_table_name, ai_response, question_id)
-            
-            # 插入结果到数据库
-            data = {
-                'answer_hash': row['answer_hash'],
-                'question_id': question_id,
-                'category': ai_response.get('category', ''),
-                'subcategory': ai_response.get('subcategory', ''),
-                'thirdCategory': ai_response.get('thirdCategory', ''),
-                'specific_reason': ai_response.get('specific_reason', ''),
-                'mark_code': ai_response.get('mark_code', ''),
-                'standard_code': question_info.get('standard_code', ''),
-                'answer_code': row.get('answer_code', '') if pd.notna(row.get('answer_code')) else '',
-                'error_info': row.get('error_info', '') if pd.notna(row.get('error_info')) else '',
-                'response': ai_response
-            }
-            
-            if insert_ai_result(conn, ai_table_name, data):
+        # 多进程协同时先认领，其他进程正在处理或已完成的记录不再调用LLM
+        if lease is not None:
+            with metrics.timer('claim'):
+                claimed = claim_answer(conn, lease, question_id, row['answer_hash'])
+            if not claimed:
+                metrics.increment('skip_claimed')
+                return "skip", 'claimed'
+        
+        # 本地分类器置信度足够时不调用LLM
+        ai_response = None
+        if classifier is not None:
+            with metrics.timer('local_classify'):
+                ai_response, route = classify_locally(classifier, conn, row, category_table_name, question_id)
+        if ai_response is None:
+            ai_response, route, error_status = classify_with_llm(
+                conn, row, api_config, prompt_config, question_info, system_prompt_path,
+                category_table_name, question_id, usage
+            )
+            if error_status:
+                return "error", error_status
+        
+        # call_ai_api只返回包含全部必要字段的响应，本地分类器只使用分类库中已有的分类
+        # 更新类别库（包含question_id）
+        with metrics.timer('taxonomy_update'):
+            update_reusable_category_db(conn, category_table_name, ai_response, question_id, job_category_updates)
+        
+        # 插入结果到数据库
+        data = {
+            'answer_hash': row['answer_hash'],
+            'question_id': question_id,
+            'category': ai_response.get('category', ''),
+            'subcategory': ai_response.get('subcategory', ''),
+            'thirdCategory': ai_response.get('thirdCategory', ''),
+            'specific_reason': ai_response.get('specific_reason', ''),
+            # lazy模式和本地分类的结果为NULL，查看时由 markCode.generate_mark_code 生成
+            'mark_code': ai_response.get('mark_code') if prompt_config['mark_code'] == 'eager' else None,
+            'standard_code': question_info.get('standard_code', ''),
+            'answer_code': row.get('answer_code', '') if pd.notna(row.get('answer_code')) else '',
+            'error_info': row.get('error_info', '') if pd.notna(row.get('error_info')) else '',
+            'response': ai_response,
+            'user_count': int(row.get('user_count', 0)),
+            'prompt_tokens': usage['prompt_tokens'],
+            'completion_tokens': usage['completion_tokens'],
+            'model': route['model'],
+            'endpoint': route['endpoint'],
+            'cascade_route': route['cascade']
+        }
+        
+        with metrics.timer('db_insert'):
+            inserted = insert_ai_result(conn, ai_table_name, data)
+        if inserted:
+            succeeded = True
+            if route['cascade'] != ROUTE_LOCAL:
                 time.sleep(thread_config['request_delay'])
-                return "success", 'success'
-            else:
-                print(f"数据库插入失败: {row['answer_hash']}")
-                return "error", 'database_insert_failed'
+            return ai_response, 'success'
         else:
-            print(f"AI API调用失败: {row['answer_hash']}")
-            return "error", 'api_call_failed'
+            print(f"数据库插入失败: {row['answer_hash']}")
+            return "error", 'database_insert_failed'
             
     except Exception as e:
         print(f"处理记录异常 {row['answer_hash']}: {e}")
         return "error", f'exception: {str(e)}'
     finally:
+        if claimed:
+            # 成功时标记完成，失败时释放认领；释放失败时等待租约过期
+            try:
+                (complete_claim if succeeded else release_claim)(conn, lease, question_id, row['answer_hash'])
+            except Exception as e:
+                print(f"更新认领状态失败 {row['answer_hash']}: {e}")
         if conn:
             try:
                 conn.close()
             except:
                 pass
 
-def process_ai_analysis(term_id, question_id):
-    """主处理函数"""
-    global category_updates
-    category_updates = {
+def new_category_updates():
+    """创建一次分析的分类库更新记录"""
+    return {
         'new_subcategories': [],
         'similar_rejections': [],
         'category_stats': {}
     }
+
+def get_records_table():
+    """从config.ini读取records表名"""
+    config = configparser.ConfigParser()
+    encodings = ['utf-8', 'gbk', 'gb2312', 'utf-8-sig']
+    config_read = False
+    
+    for encoding in encodings:
+        try:
+            config.read('config.ini', encoding=encoding)
+            config_read = True
+            break
+        except UnicodeDecodeError:
+            continue
+    
+    records_table = "code_clustering_user_answer_record"  # 默认值
+    if config_read and 'DataTable' in config:
+        table_section = config['DataTable']
+        records_table = table_section.get('records_table', 'code_clustering_user_answer_record')
+    return records_table
+
+def fetch_records(conn, records_table, term_id, question_ids, watermark_column=None, since=None):
+    """
+    从数据库读取一个或多个题目的答题记录
+    指定watermark_column时一并读取该列；指定since时只读取该列不小于since的记录：
+    与水位相同的值可能在上次运行之后才写入（例如event_time相同），重新读取的记录由answer_hash去重
+    """
+    placeholders = ', '.join(['%s'] * len(question_ids))
+    columns = ['term_id', 'question_id', 'user_id', 'answer_url', 'error_info', 'answer_code', 'answer_hash']
+    if watermark_column and watermark_column not in columns:
+        columns.append(watermark_column)
+    params = [term_id, *question_ids]
+    
+    cursor = conn.cursor(dictionary=True)
+    query = f"""
+    SELECT {', '.join(columns)}
+    FROM {records_table}
+    WHERE term_id = %s AND question_id IN ({placeholders}) AND answer_hash IS NOT NULL
+    """
+    if watermark_column and since is not None:
+        query += f" AND {watermark_column} >= %s"
+        params.append(since)
+    cursor.execute(query, tuple(params))
+    records = cursor.fetchall()
+    cursor.close()
+    return records
+
+def get_incremental_config():
+    """从config.ini读取增量分析配置"""
+    config = configparser.ConfigParser()
+    config.read('config.ini', encoding='utf-8')
+    
+    return {
+        # 水位列：records表中单调递增的列，有自增id时建议使用id
+        'watermark_column': config.get('Incremental', 'watermark_column', fallback='event_time'),
+        'interval': config.getint('Incremental', 'interval', fallback=300)
+    }
+
+def create_watermark_table(conn, term_id):
+    """创建增量分析水位表，每个题目记录已分析到的水位"""
+    table_name = f"analysisWatermark_{term_id}"
+    ensure_table(conn, 'watermark', table_name)
+    return table_name
+
+def load_watermark(conn, table_name, question_id, watermark_column):
+    """读取题目的水位，水位列变更时视为没有水位"""
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT watermark_column, watermark FROM {table_name} WHERE question_id = %s", (question_id,))
+    row = cursor.fetchone()
+    cursor.close()
+    if row and row[0] == watermark_column:
+        return row[1]
+    return None
+
+def save_watermark(conn, table_name, question_id, watermark_column, watermark):
+    """保存题目的水位"""
+    cursor = conn.cursor()
+    cursor.execute(f"""
+    INSERT INTO {table_name} (question_id, watermark_column, watermark) VALUES (%s, %s, %s)
+    ON DUPLICATE KEY UPDATE watermark_column = VALUES(watermark_column), watermark = VALUES(watermark)
+    """, (question_id, watermark_column, str(watermark)))
+    conn.commit()
+    cursor.close()
+
+def count_hash_users(conn, records_table, term_id, question_id, answer_hashes, chunk_size=1000):
+    """统计指定answer_hash在records表中的总人数"""
+    counts = {}
+    answer_hashes = list(answer_hashes)
+    cursor = conn.cursor()
+    for i in range(0, len(answer_hashes), chunk_size):
+        chunk = answer_hashes[i:i + chunk_size]
+        placeholders = ', '.join(['%s'] * len(chunk))
+        cursor.execute(f"""
+        SELECT answer_hash, COUNT(*) FROM {records_table}
+        WHERE term_id = %s AND question_id = %s AND answer_hash IN ({placeholders})
+        GROUP BY answer_hash
+        """, (term_id, question_id, *chunk))
+        counts.update({row[0]: row[1] for row in cursor.fetchall()})
+    cursor.close()
+    return counts
+
+def update_user_counts(conn, table_name, question_id, user_counts, chunk_size=500):
+    """更新已有分析结果的user_count：只更新人数有变化的行，每块一条 UPDATE ... CASE"""
+    if not user_counts:
+        return
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT answer_hash, user_count FROM {table_name} WHERE question_id = %s", (question_id,))
+    current = dict(cursor.fetchall())
+    changed = [(answer_hash, int(count)) for answer_hash, count in user_counts.items()
+               if answer_hash in current and current[answer_hash] != int(count)]
+    for i in range(0, len(changed), chunk_size):
+        chunk = changed[i:i + chunk_size]
+        cases = ' '.join(['WHEN %s THEN %s'] * len(chunk))
+        placeholders = ', '.join(['%s'] * len(chunk))
+        cursor.execute(
+            f"UPDATE {table_name} SET user_count = CASE answer_hash {cases} END "
+            f"WHERE question_id = %s AND answer_hash IN ({placeholders})",
+            (*[value for item in chunk for value in item], question_id, *[answer_hash for answer_hash, _ in chunk])
+        )
+    conn.commit()
+    cursor.close()
+
+def prepare_analysis_job(conn, term_id, question_id, records, category_table_name, ai_table_name,
+                         journal_config=None, journal_mode='new', sample_size=None):
+    """
+    准备单个题目的分析任务：读取题目信息并聚合答题记录
+    journal_config不为None时打开运行日志，journal_mode:
+      new:          清空旧日志重新开始
+      resume:       回放旧日志，已完成和已失败的answer_hash不再检查和提交
+      retry_failed: 只重新提交旧日志中失败的answer_hash，使用单独的重试策略
+    sample_size不为None时为抽样模式（见stratifiedSample），只提交样本中的answer_hash，0表示使用 [Sampling] sample_size
+    返回job字典，数据或题目信息缺失时返回None
+    """
+    # 获取题目信息
+    question_info = get_question_info(conn, term_id, question_id)
+    if not question_info:
+        print(f"未找到题目信息 [term_id={term_id}, question_id={question_id}]")
+        return None
+    
+    if not records:
+        print(f"数据库中没有找到符合条件的数据 [term_id={term_id}, question_id={question_id}]")
+        return None
+    
+    # 转换为DataFrame并按answer_hash聚合
+    with metrics.timer('aggregation'):
+        df = aggregate_records(pd.DataFrame(records))
+    print(f"从数据库读取并聚合到 {len(df)} 条数据 [term_id={term_id}, question_id={question_id}]")
+    
+    # 代码归一化、分词和报错签名提取（CPU密集，数据量大时使用进程池）
+    preprocess_config = get_preprocess_config()
+    if preprocess_config['enabled']:
+        with metrics.timer('preprocess'):
+            df = preprocess_dataframe(df, preprocess_config)
+    
+    # 回放运行日志，日志中已有最终状态的answer_hash不再重新检查
+    journal = None
+    journal_skipped, retry_hashes, done_hashes = set(), set(), set()
+    if journal_config is not None:
+        journal = RunJournal(journal_path(journal_config['journal_dir'], term_id, question_id),
+                             fsync=journal_config['fsync'])
+        if journal_mode in ('resume', 'retry_failed'):
+            previous_tasks = journal.load()['tasks']
+            done_hashes = {h for h, task in previous_tasks.items() if task['state'] == STATE_DONE}
+            retry_hashes = {h for h, task in previous_tasks.items() if task['state'] == STATE_FAILED}
+            if journal_mode == 'resume':
+                journal_skipped = done_hashes | retry_hashes
+            else:
+                journal_skipped = set(df['answer_hash']) - retry_hashes
+            print(f"运行日志: 已完成 {len(done_hashes)} 条, 失败 {len(retry_hashes)} 条 [{journal_mode}]")
+        journal.open(resume=journal_mode != 'new')
+    
+    # 抽样模式：样本以外的answer_hash不提交任务，本次也不检查
+    sampled_out = set()
+    if sample_size is not None:
+        sample_rows = draw_sample(df, term_id, question_id, get_sampling_config(), sample_size)
+        save_sample(conn, create_sample_table(conn, term_id), question_id, sample_rows)
+        sampled_out = set(df['answer_hash']) - {row['answer_hash'] for row in sample_rows}
+        print(f"抽样分析: 从 {len(df)} 条中按报错签名分层抽取 {len(sample_rows)} 条")
+    
+    # 一次查询出已分析过的answer_hash，这些记录不再提交任务
+    pending_hashes = [h for h in df['answer_hash'] if h not in journal_skipped and h not in sampled_out]
+    with metrics.timer('existing_check'):
+        existing_hashes = fetch_existing_hashes(conn, ai_table_name, question_id, pending_hashes)
+    metrics.increment('skip_existing', len(existing_hashes))
+    metrics.increment('skip_journal', len(journal_skipped))
+    
+    if journal:
+        journal.log_skipped(existing_hashes)
+        journal.start_segment(journal_mode, len(pending_hashes) - len(existing_hashes))
+        journal.close()
+    
+    # 多进程协同处理时使用租约表认领记录
+    worker_config = get_worker_config()
+    lease = None
+    if worker_config['enabled']:
+        lease = {
+            'table': create_lease_table(conn, term_id),
+            'worker_id': worker_config['worker_id'],
+            'lease_seconds': worker_config['lease_seconds']
+        }
+    
+    # 已有结果覆盖的学生数，用于发布部分结果
+    covered_hashes = existing_hashes | done_hashes
+    covered_users = int(df.loc[df['answer_hash'].isin(covered_hashes), 'user_count'].sum())
+    
+    return {
+        'term_id': term_id,
+        'question_id': question_id,
+        'question_info': question_info,
+        'df': df,
+        'ai_table_name': ai_table_name,
+        'category_table_name': category_table_name,
+        'counters': {
+            'processed': Counter(),
+            'skipped': Counter(len(existing_hashes)),
+            'error': Counter()
+        },
+        'existing_hashes': existing_hashes | journal_skipped | sampled_out,
+        'failed_records': [],  # 记录失败的详细信息
+        'category_updates': new_category_updates(),
+        'token_usage': new_usage(),
+        'usage_by_category': {},
+        'completed': len(df) - len(pending_hashes) + len(existing_hashes),
+        'total_users': int(df['user_count'].sum()),
+        'covered_users': covered_users,
+        'deferred': 0,  # 因时间预算未调度的记录数
+        'circuit_deferred': 0,  # 因LLM熔断未分析的记录数
+        'cancel_reason': None,  # 分析被取消时的原因（taskSchedule.CANCEL_REASONS）
+        'sampled_out': len(sampled_out),  # 抽样模式下不在样本中的记录数
+        'lease': lease,
+        # 本地分类器（[Classifier]），未开启或未训练时为None
+        'classifier': load_classifier(question_id),
+        'claimed_elsewhere': 0,  # 由其他进程认领的记录数
+        'published_partial': False,
+        'journal': journal,
+        'journal_config': journal_config,
+        'retry_hashes': retry_hashes if journal_mode == 'retry_failed' else set()
+    }
+
+def build_job_tasks(job, db_config, api_config, prompt_config, thread_config, template_config):
+    """构建题目的任务参数列表，重试失败记录时使用[Journal]中的重试策略"""
+    retry_api_config = api_config
+    if job['retry_hashes']:
+        retry_api_config = dict(api_config,
+                                max_retry=job['journal_config']['retry_max_retry'],
+                                timeout=job['journal_config']['retry_timeout'])
+    
+    tasks = []
+    for index, row in job['df'].iterrows():
+        if row['answer_hash'] in job['existing_hashes']:
+            continue
+        task_api_config = retry_api_config if row['answer_hash'] in job['retry_hashes'] else api_config
+        task_args = (index, row, db_config, task_api_config, prompt_config, thread_config, template_config,
+                     job['question_info'], prompt_config['system_prompt_path'], job['ai_table_name'],
+                     job['category_table_name'], job['question_id'], job['category_updates'], job['lease'],
+                     job['classifier'])
+        tasks.append(task_args)
+    return tasks
+
+def run_journaled_task(journal, task):
+    """在工作线程中执行任务，开始前记录in_flight状态"""
+    if journal:
+        journal.log_task(task[1]['answer_hash'], STATE_IN_FLIGHT)
+    return process_single_record(task)
+
+def submit_tasks(executor, job_tasks, priority='user_count'):
+    """按优先级提交任务 [(job, task)]，返回 {future: (job, task)}"""
+    future_to_task = {}
+    for job, task in order_tasks(job_tasks, priority):
+        journal = job['journal']
+        if journal:
+            journal.log_task(task[1]['answer_hash'], STATE_QUEUED, index=task[0])
+        future_to_task[executor.submit(run_journaled_task, journal, task)] = (job, task)
+    for job in {id(job): job for job, _ in job_tasks}.values():
+        if job['journal']:
+            job['journal'].close()
+    return future_to_task
+
+def iter_task_results(future_to_task, deadline=None, cancel_file=None, drain_seconds=10.0):
+    """
+    按完成顺序返回 (job, task, future)
+    到达deadline后取消尚未开始的任务，被取消的记录计入job['deferred']，
+    运行日志中保持queued状态，之后可用 --resume 继续
+    cancel_file存在或收到SIGTERM时同样取消尚未开始的任务，进行中的任务不再重试LLM请求；
+    drain_seconds秒后仍未结束的任务不再等待（同样计入deferred并保持queued），由调用方直接写报告
+    """
+    pending = set(future_to_task)
+    expired = False
+    abandon_at = None
+    while pending:
+        done, pending = wait(pending, timeout=TASK_POLL_SECONDS, return_when=FIRST_COMPLETED)
+        for future in done:
+            job, task = future_to_task[future]
+            if future.cancelled():
+                job['deferred'] += 1
+                metrics.increment('task_deferred')
+                continue
+            yield job, task, future
+        
+        now = time.time()
+        if abandon_at is None:
+            reason = 'terminated' if run_terminate.is_set() else cancel_requested(cancel_file)
+            if reason:
+                run_cancel.set()
+                abandon_at = now + drain_seconds
+                metrics.increment('run_cancelled')
+                for job, _ in future_to_task.values():
+                    job['cancel_reason'] = reason
+                cancelled = sum(1 for future in pending if future.cancel())
+                print(f"⏹️ 分析已取消（{CANCEL_REASONS.get(reason, reason)}），剩余 {cancelled} 条记录不再调度，"
+                      f"最多等待进行中的请求 {drain_seconds:.0f} 秒（可使用 --resume 继续）")
+        elif now >= abandon_at and pending:
+            # 已取消但工作线程还没有取出的任务不会出现在done中，与进行中的任务一起计入deferred
+            abandoned = 0
+            for future in pending:
+                job, task = future_to_task[future]
+                job['deferred'] += 1
+                if future.cancelled():
+                    metrics.increment('task_deferred')
+                    continue
+                abandoned += 1
+                metrics.increment('task_abandoned')
+                if job['journal']:
+                    job['journal'].log_task(task[1]['answer_hash'], STATE_QUEUED, index=task[0], status='cancelled')
+            print(f"⏹️ {abandoned} 条进行中的记录不再等待")
+            return
+        if deadline is not None and not expired and now >= deadline:
+            expired = True
+            cancelled = sum(1 for future in pending if future.cancel())
+            if cancelled:
+                print(f"⏱️ 已达到时间预算，剩余 {cancelled} 条记录不再调度（可使用 --resume 继续）")
+
+def journal_category_updates(job):
+    """把本次新增的分类库更新写入运行日志"""
+    journal = job['journal']
+    logged = job.setdefault('journal_logged', {'new_subcategories': 0, 'similar_rejections': 0})
+    for kind in ('new_subcategories', 'similar_rejections'):
+        items = job['category_updates'][kind]
+        for item in items[logged[kind]:]:
+            journal.log_category_update(kind, item)
+        logged[kind] = len(items)
+
+def record_task_result(job, task, future):
+    """统计单个任务的执行结果"""
+    with file_lock:
+        job['completed'] += 1
+        completed = job['completed']
+    total = len(job['df'])
+    counters = job['counters']
+    journal = job['journal']
+    answer_hash = task[1]['answer_hash']
+    
+    try:
+        result, status, usage = future.result()
+        with file_lock:
+            add_usage(job['token_usage'], usage)
+            if status == 'success' and result.get('category'):
+                add_usage(job['usage_by_category'].setdefault(result['category'], new_usage()), usage)
+        
+        if status not in ('deadline_exceeded', 'cancelled', 'circuit_open'):
+            metrics.increment(f'task_{status}' if status in ('success', 'skip', 'claimed') else 'task_error')
+        if status == 'success':
+            counters['processed'].increment()
+            job['covered_users'] += int(task[1].get('user_count', 0))
+            if journal:
+                journal.log_task(answer_hash, STATE_DONE, index=task[0], status=status,
+                                 category=result.get('category'), usage=usage)
+        elif status == 'skip':
+            counters['skipped'].increment()
+            if journal:
+                journal.log_task(answer_hash, STATE_DONE, index=task[0], status=status, usage=usage)
+        elif status == 'claimed':
+            # 其他进程正在处理，日志中不记录最终状态，续跑时重新检查
+            counters['skipped'].increment()
+            job['claimed_elsewhere'] += 1
+        elif status in ('deadline_exceeded', 'cancelled'):
+            # 到达截止时间或取消时正在执行的任务，与未调度的任务一样计为未分析，可用 --resume 继续
+            job['deferred'] += 1
+            metrics.increment('task_deferred')
+            if journal:
+                journal.log_task(answer_hash, STATE_QUEUED, index=task[0], status=status, usage=usage)
+        elif status == 'circuit_open':
+            # 熔断期间跳过的任务没有调用LLM，同样保持queued，上游恢复后 --resume 继续
+            job['circuit_deferred'] += 1
+            metrics.increment('task_deferred')
+            if journal:
+                journal.log_task(answer_hash, STATE_QUEUED, index=task[0], status=status, usage=usage)
+        else:
+            counters['error'].increment()
+            # 记录失败的详细信息
+            failed_record = {
+                'index': task[0],
+                'answer_hash': answer_hash,
+                'status': status,
+                'error': status
+            }
+            job['failed_records'].append(failed_record)
+            if journal:
+                journal.log_task(answer_hash, STATE_FAILED, index=task[0], status=status, usage=usage)
+            print(f"记录 {completed} (hash: {failed_record['answer_hash']}) 处理失败: {status}")
+        
+    except Exception as e:
+        metrics.increment('task_error')
+        counters['error'].increment()
+        failed_record = {
+            'index': task[0],
+            'answer_hash': answer_hash,
+            'status': 'exception',
+            'error': str(e)
+        }
+        job['failed_records'].append(failed_record)
+        if journal:
+            journal.log_task(answer_hash, STATE_FAILED, index=task[0], status=f'exception: {e}')
+        print(f"记录 {completed} (hash: {failed_record['answer_hash']}) 处理异常: {e}")
+    
+    if journal:
+        with file_lock:
+            journal_category_updates(job)
+    
+    # 每处理5个任务显示一次进度
+    if completed % 5 == 0 or completed == total:
+        print(f"进度 [question_id={job['question_id']}]: {completed}/{total} ({completed/total*100:.1f}%), "
+              f"学生覆盖率 {coverage(job)*100:.1f}%")
+    
+    publish_coverage = job.get('publish_coverage', 0)
+    if publish_coverage and not job['published_partial'] and completed < total and coverage(job) >= publish_coverage:
+        publish_partial_results(job)
+
+def publish_partial_results(job):
+    """
+    结果覆盖的学生达到 [Schedule] publish_coverage 时发布部分结果
+    结果已逐条写入ai表，API可直接查询；这里另外保存一份部分结果报告
+    """
+    job['published_partial'] = True
+    elapsed_time = time.time() - job.get('started_at', time.time())
+    print(f"📢 学生覆盖率已达 {coverage(job)*100:.1f}% [term_id={job['term_id']}, question_id={job['question_id']}]，"
+          f"发布部分结果")
+    os.makedirs('data', exist_ok=True)
+    report_filename = f"data/report_{job['term_id']}_{job['question_id']}_partial.txt"
+    try:
+        report_lines = [f"（部分结果，分析仍在进行，耗时 {elapsed_time:.1f}秒）"] + build_report_lines(job, elapsed_time)
+        with open(report_filename, 'w', encoding='utf-8') as f:
+            f.write("\n".join(report_lines))
+        print(f"部分结果报告已保存: {report_filename}")
+    except Exception as e:
+        print(f"部分结果报告保存失败: {e}")
+
+def finish_journal(job, elapsed_time):
+    """
+    结束本次运行分段并关闭日志
+    用日志回放结果替换job中的统计，使报告覆盖所有续跑分段
+    """
+    journal = job['journal']
+    if not journal:
+        return
+    counters = job['counters']
+    journal.end_segment(elapsed_time, counters['processed'].value,
+                        counters['skipped'].value, counters['error'].value)
+    journal.close()
+    
+    summary = journal.load()
+    processed, skipped, failed_records, category_stats = summarize_tasks(summary['tasks'])
+    job['run_counters'] = {name: counter.value for name, counter in counters.items()}
+    job['counters'] = {
+        'processed': Counter(processed),
+        'skipped': Counter(skipped),
+        'error': Counter(len(failed_records))
+    }
+    job['failed_records'] = failed_records
+    job['category_updates'] = {
+        'new_subcategories': summary['new_subcategories'],
+        'similar_rejections': summary['similar_rejections'],
+        'category_stats': category_stats
+    }
+    job['segments'] = summary['segments']
+    job['token_usage'], job['usage_by_category'] = summarize_usage(summary['tasks'])
+
+def build_report_lines(job, elapsed_time):
+    """生成单个题目的分析报告内容"""
+    df = job['df']
+    counters = job['counters']
+    failed_records = job['failed_records']
+    category_updates = job['category_updates']
+    category_table_name = job['category_table_name']
+    success_rate = counters['processed'].value/len(df)*100 if len(df) > 0 else 0
+    
+    report_lines = [
+        f"AI分析报告 - {time.strftime('%Y-%m-%d %H:%M:%S')}",
+        f"题目ID: {job['question_id']}, 学期ID: {job['term_id']}",
+        f"数据来源: 数据库真实数据表",
+        f"分类表: {category_table_name}",
+        "",
+        "=== 处理统计 ===",
+        f"总记录数: {len(df)}",
+        f"成功分析: {counters['processed'].value}",
+        f"跳过记录: {counters['skipped'].value}",
+        f"失败记录: {counters['error'].value}",
+        f"成功率: {success_rate:.1f}%",
+        f"学生覆盖率: {coverage(job)*100:.1f}% ({job['covered_users']}/{job['total_users']}人)",
+        f"处理耗时: {elapsed_time:.2f}秒",
+        ""
+    ]
+    if job['cancel_reason']:
+        report_lines.insert(-1, f"分析已取消: {CANCEL_REASONS.get(job['cancel_reason'], job['cancel_reason'])}")
+    if job['deferred']:
+        report_lines.insert(-1, f"{'取消后' if job['cancel_reason'] else '超出时间预算'}未分析: {job['deferred']}")
+    if job['circuit_deferred']:
+        report_lines.insert(-1, f"LLM熔断未分析: {job['circuit_deferred']}")
+    if job['claimed_elsewhere']:
+        report_lines.insert(-1, f"由其他进程处理: {job['claimed_elsewhere']}")
+    if job['sampled_out']:
+        report_lines.insert(-1, f"抽样模式未分析: {job['sampled_out']}")
+    
+    # 有运行日志时统计为所有续跑分段的合并结果
+    segments = job.get('segments')
+    if segments:
+        unfinished = len(df) - counters['processed'].value - counters['skipped'].value - counters['error'].value
+        report_lines.insert(-1, f"未完成记录: {max(unfinished, 0)}")
+        report_lines.extend([f"=== 运行分段 ({len(segments)}个) ===", ""])
+        for i, segment in enumerate(segments, 1):
+            started_at = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(segment['started_at']))
+            if 'elapsed_time' in segment:
+                report_lines.append(
+                    f"  {i}. [{segment['mode']}] {started_at} 待处理={segment['total']} "
+                    f"成功={segment['processed']} 跳过={segment['skipped']} 失败={segment['error']} "
+                    f"耗时={segment['elapsed_time']:.1f}秒"
+                )
+            else:
+                report_lines.append(f"  {i}. [{segment['mode']}] {started_at} 待处理={segment['total']} 未正常结束")
+        report_lines.append("")
+    
+    report_lines.extend(build_preprocess_report_lines(df))
+    
+    # token用量（有运行日志时为所有续跑分段的合计）
+    report_lines.extend(build_usage_report_lines(job['token_usage'], get_usage_config(),
+                                                 job['usage_by_category'], run_budget))
+    
+    # 添加失败记录的详细信息
+    if failed_records:
+        report_lines.extend([
+            f"=== 失败记录详情 ({len(failed_records)}个) ===",
+            ""
+        ])
+        for record in failed_records:
+            report_lines.append(f"❌ {record['answer_hash']}")
+            report_lines.append(f"   索引: {record['index']}")
+            report_lines.append(f"   状态: {record['status']}")
+            report_lines.append(f"   错误: {record['error']}")
+            report_lines.append("")
+    else:
+        report_lines.extend([
+            "=== 失败记录详情 ===",
+            "无失败记录",
+            ""
+        ])
+    
+    # 添加分类库更新记录
+    report_lines.extend([
+        f"=== {category_table_name} 更新记录 ===",
+        ""
+    ])
+    
+    # 主类别使用统计
+    if category_updates['category_stats']:
+        report_lines.append("主类别使用统计:")
+        for category, count in sorted(category_updates['category_stats'].items()):
+            report_lines.append(f"  {category}: {count}次")
+        report_lines.append("")
+    
+    # 新增子类别记录
+    if category_updates['new_subcategories']:
+        report_lines.append(f"新增分类记录 ({len(category_updates['new_subcategories'])}个):")
+        for item in category_updates['new_subcategories']:
+            report_lines.append(f"  ✓ {item['category']} -> {item['subcategory']} -> {item['thirdCategory']}")
+        report_lines.append("")
+    else:
+        report_lines.append("新增分类记录: 无")
+        report_lines.append("")
+    
+    # 相似性拒绝记录
+    if category_updates['similar_rejections']:
+        report_lines.append(f"拒绝的相似子类别 ({len(category_updates['similar_rejections'])}个):")
+        for item in category_updates['similar_rejections']:
+            report_lines.append(f"  ✗ {item['category']} -> {item['rejected_subcategory']}")
+            report_lines.append(f"    原因: {item['reason']}")
+            report_lines.append(f"    已有相似: {item['similar_existing']}")
+        report_lines.append("")
+    else:
+        report_lines.append("拒绝的相似子类别: 无")
+        report_lines.append("")
+    
+    # 分类库优化建议
+    total_new = len(category_updates['new_subcategories'])
+    total_rejected = len(category_updates['similar_rejections'])
+    if total_rejected > 0:
+        optimization_rate = (total_rejected / (total_new + total_rejected)) * 100
+        report_lines.extend([
+            "=== 分类库优化效果 ===",
+            f"避免重复率: {optimization_rate:.1f}%",
+            f"说明: 通过相似性检查，避免了{total_rejected}个重复或相似的子类别",
+            ""
+        ])
+    
+    return report_lines
+
+def estimate_sample(conn, term_id, question_id, ai_table_name):
+    """用样本的分析结果估计各分类覆盖的学生比例（见stratifiedSample.estimate_shares）"""
+    sample_rows = load_sample(conn, f"analysisSample_{term_id}", question_id)
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT answer_hash, category FROM {ai_table_name} WHERE question_id = %s", (question_id,))
+    categories = dict(cursor.fetchall())
+    cursor.close()
+    return estimate_shares(sample_rows, categories, get_sampling_config()['confidence'])
+
+def process_ai_analysis(term_id, question_id, incremental=False, journal_mode='new', time_budget=None,
+                        sample_size=None):
+    """
+    主处理函数
+    incremental=True时只读取水位之后的新记录，已有answer_hash只更新人数，新的answer_hash才调用AI
+    journal_mode: new / resume / retry_failed，见prepare_analysis_job
+    time_budget: 时间预算（秒），None时读取 [Schedule] time_budget；按优先级先分析作答人数多的记录
+    sample_size: 不为None时只分析分层样本并估计各分类的学生比例，0表示使用 [Sampling] sample_size
+    运行中出现取消文件（[Schedule] cancel_dir，API超时或客户端断开时写入）或收到SIGTERM时停止调度，
+    已完成的结果、运行日志、指标和报告照常写入
+    """
+    global category_updates, run_budget, run_deadline
     
     # 加载配置
     db_config, api_config, prompt_config, thread_config, template_config = get_config()
@@ -592,7 +1475,16 @@ def process_ai_analysis(term_id, question_id):
     thread_config['max_workers'] = 1  # 改为单线程处理，避免数据库竞争
     thread_config['request_delay'] = 0.5  # 适当减少延迟
     
+    metrics.reset()
+    run_budget = RunBudget(get_usage_config())
+    schedule_config = get_schedule_config()
+    # 上一次运行留下的取消文件和取消标记不影响本次运行，已收到SIGTERM时直接按已取消处理
+    cancel_file = cancel_path(schedule_config['cancel_dir'], term_id, question_id)
+    clear_cancel(cancel_file)
+    if not run_terminate.is_set():
+        run_cancel.clear()
     conn = connect_to_database(db_config)
+    job = None
     
     try:
         # 创建可复用分类表（不包含question_id后缀）
@@ -604,143 +1496,92 @@ def process_ai_analysis(term_id, question_id):
             print("系统提示词加载失败")
             return
         
-        # 获取题目信息
-        question_info = get_question_info(conn, term_id, question_id)
-        if not question_info:
-            print(f"未找到题目信息 [term_id={term_id}, question_id={question_id}]")
-            return
-        
         # 创建AI分析表（不包含question_id后缀）
         ai_table_name = f"ai_{term_id}"
         create_ai_table(conn, ai_table_name)
         
         # 直接从数据库读取数据，而不是从Excel文件
-        print("直接从数据库读取聚合数据...")
-        
-        # 从配置中获取表名
-        config = configparser.ConfigParser()
-        encodings = ['utf-8', 'gbk', 'gb2312', 'utf-8-sig']
-        config_read = False
-        
-        for encoding in encodings:
-            try:
-                config.read('config.ini', encoding=encoding)
-                config_read = True
-                break
-            except UnicodeDecodeError:
-                continue
-        
-        # 获取records表名
-        records_table = "code_clustering_user_answer_record"  # 默认值
-        if config_read and 'DataTable' in config:
-            table_section = config['DataTable']
-            records_table = table_section.get('records_table', 'code_clustering_user_answer_record')
+        records_table = get_records_table()
+        incremental_config = get_incremental_config()
+        watermark_column = incremental_config['watermark_column']
+        watermark_table = create_watermark_table(conn, term_id)
+        since = load_watermark(conn, watermark_table, question_id, watermark_column) if incremental else None
         
-        # 直接从数据库查询并聚合数据
-        cursor = conn.cursor(dictionary=True)
-        query = f"""
-        SELECT term_id, question_id, user_id, answer_url, error_info, answer_code, answer_hash
-        FROM {records_table}
-        WHERE term_id = %s AND question_id = %s AND answer_hash IS NOT NULL
-        """
-        cursor.execute(query, (term_id, question_id))
-        records = cursor.fetchall()
-        cursor.close()
+        if since is not None:
+            print(f"增量分析: 只读取 {watermark_column} >= {since} 的新记录")
+        else:
+            print("直接从数据库读取聚合数据...")
+        with metrics.timer('records_fetch'):
+            records = fetch_records(conn, records_table, term_id, [question_id],
+                                    watermark_column=watermark_column if incremental else None, since=since)
         
-        if not records:
-            print(f"数据库中没有找到符合条件的数据 [term_id={term_id}, question_id={question_id}]")
+        if since is not None and not records:
+            print(f"没有新的提交记录 [term_id={term_id}, question_id={question_id}]")
             return
         
-        # 转换为DataFrame并按answer_hash聚合
-        import pandas as pd
-        df_raw = pd.DataFrame(records)
-        
-        # 按answer_hash聚合数据
-        processed_data = []
-        for answer_hash, group in df_raw.groupby('answer_hash'):
-            user_list = group['user_id'].tolist()
-            first_record = group.iloc[0]
-            
-            user_list_str = ', '.join(str(user_id) for user_id in user_list)
-            
-            processed_data.append({
-                'answer_hash': answer_hash,
-                'user_count': len(user_list),
-                'user_list': user_list_str,
-                'error_info': first_record['error_info'],
-                'answer_code': first_record['answer_code'],
-                'term_id': first_record['term_id'],
-                'question_id': first_record['question_id']
-            })
-        
-        df = pd.DataFrame(processed_data)
-        print(f"从数据库读取并聚合到 {len(df)} 条数据 [term_id={term_id}, question_id={question_id}]")
+        journal_config = get_journal_config()
+        job = prepare_analysis_job(conn, term_id, question_id, records, category_table_name, ai_table_name,
+                                   journal_config=journal_config if journal_config['enabled'] else None,
+                                   journal_mode=journal_mode, sample_size=sample_size)
+        if job is None:
+            return
+        category_updates = job['category_updates']
+        df = job['df']
+        counters = job['counters']
         
         # 准备多线程处理
-        counters = {
-            'processed': Counter(),
-            'skipped': Counter(),
-            'error': Counter()
-        }
-        
-        # 记录失败的详细信息
-        failed_records = []
-        
-        tasks = []
-        for index, row in df.iterrows():
-            task_args = (index, row, db_config, api_config, prompt_config, thread_config, template_config,
-                        question_info, prompt_config['system_prompt_path'], ai_table_name, category_table_name, question_id)
-            tasks.append(task_args)
+        tasks = build_job_tasks(job, db_config, api_config, prompt_config, thread_config, template_config)
+        if time_budget is None:
+            time_budget = schedule_config['time_budget']
+        job['publish_coverage'] = schedule_config['publish_coverage']
         
         start_time = time.time()
+        job['started_at'] = start_time
+        deadline = start_time + time_budget if time_budget else None
+        run_deadline = deadline
         
-        with ThreadPoolExecutor(max_workers=thread_config['max_workers']) as executor:
-            future_to_index = {executor.submit(process_single_record, task): i for i, task in enumerate(tasks)}
+        executor = ThreadPoolExecutor(max_workers=thread_config['max_workers'])
+        try:
+            future_to_task = submit_tasks(executor, [(job, task) for task in tasks], schedule_config['priority'])
             
-            completed = 0
-            for future in as_completed(future_to_index):
-                completed += 1
-                task_index = future_to_index[future]
-                try:
-                    result, status = future.result()
-                    
-                    if status == 'success':
-                        counters['processed'].increment()
-                    elif status == 'skip':
-                        counters['skipped'].increment()
-                    else:
-                        counters['error'].increment()
-                        # 记录失败的详细信息
-                        failed_record = {
-                            'index': task_index,
-                            'answer_hash': tasks[task_index][1]['answer_hash'],
-                            'status': status,
-                            'error': status
-                        }
-                        failed_records.append(failed_record)
-                        print(f"记录 {completed} (hash: {failed_record['answer_hash']}) 处理失败: {status}")
-                    
-                    # 每处理5个任务显示一次进度
-                    if completed % 5 == 0 or completed == len(tasks):
-                        print(f"进度: {completed}/{len(tasks)} ({completed/len(tasks)*100:.1f}%)")
-                    
-                except Exception as e:
-                    counters['error'].increment()
-                    failed_record = {
-                        'index': task_index,
-                        'answer_hash': tasks[task_index][1]['answer_hash'],
-                        'status': 'exception',
-                        'error': str(e)
-                    }
-                    failed_records.append(failed_record)
-                    print(f"记录 {completed} (hash: {failed_record['answer_hash']}) 处理异常: {e}")
+            for job, task, future in iter_task_results(future_to_task, deadline, cancel_file,
+                                                       schedule_config['cancel_drain']):
+                record_task_result(job, task, future)
+        finally:
+            # 取消后不再等待的请求在后台结束，不阻塞写报告
+            executor.shutdown(wait=not run_cancel.is_set())
         
         elapsed_time = time.time() - start_time
         
+        # 更新已有结果的人数：全量模式直接使用聚合结果，增量模式重新统计涉及的answer_hash
+        if since is None:
+            user_counts = dict(zip(df['answer_hash'], df['user_count']))
+        else:
+            user_counts = count_hash_users(conn, records_table, term_id, question_id, df['answer_hash'])
+        update_user_counts(conn, ai_table_name, question_id, user_counts)
+        
+        # 增量模式全部成功时推进水位；有失败或未调度的记录时保留原水位，下次运行重新读取这段记录并只处理未完成的answer_hash
+        if incremental:
+            new_watermark = max((record[watermark_column] for record in records
+                                 if record[watermark_column] is not None), default=None)
+            if (counters['error'].value == 0 and job['deferred'] == 0 and job['circuit_deferred'] == 0
+                    and job['claimed_elsewhere'] == 0 and job['sampled_out'] == 0):
+                if new_watermark is not None:
+                    save_watermark(conn, watermark_table, question_id, watermark_column, new_watermark)
+            else:
+                print("存在失败或未分析的记录，水位保持不变，下次运行将重试")
+        
+        # 合并所有续跑分段的统计
+        finish_journal(job, elapsed_time)
+        category_updates = job['category_updates']
+        counters = job['counters']
+        
         # 简化的结果输出
         success_rate = counters['processed'].value/len(df)*100 if len(df) > 0 else 0
         print(f"\nAI分析完成 [term_id={term_id}, question_id={question_id}]: {counters['processed'].value}/{len(df)} ({success_rate:.1f}%)")
-        print(f"耗时: {elapsed_time:.1f}秒")
+        print(f"耗时: {elapsed_time:.1f}秒, 学生覆盖率: {coverage(job)*100:.1f}%")
+        token_usage = job['token_usage']
+        print(f"Token用量: 输入 {token_usage['prompt_tokens']} / 输出 {token_usage['completion_tokens']}")
         
         # 显示分类库更新信息
         if category_updates['new_subcategories']:
@@ -752,88 +1593,20 @@ def process_ai_analysis(term_id, question_id):
         os.makedirs('data', exist_ok=True)
         timestamp = time.strftime('%Y%m%d_%H%M%S')
         report_filename = f"data/report_{term_id}_{question_id}_{timestamp}.txt"
+        report_lines = build_report_lines(job, elapsed_time)
+        if sample_size is not None:
+            estimate = estimate_sample(conn, term_id, question_id, ai_table_name)
+            print("\n".join(build_sample_report_lines(estimate)))
+            report_lines.extend(build_sample_report_lines(estimate))
         
-        report_lines = [
-            f"AI分析报告 - {time.strftime('%Y-%m-%d %H:%M:%S')}",
-            f"题目ID: {question_id}, 学期ID: {term_id}",
-            f"数据来源: 数据库真实数据表",
-            f"分类表: {category_table_name}",
-            "",
-            "=== 处理统计 ===",
-            f"总记录数: {len(df)}",
-            f"成功分析: {counters['processed'].value}",
-            f"跳过记录: {counters['skipped'].value}",
-            f"失败记录: {counters['error'].value}",
-            f"成功率: {success_rate:.1f}%",
-            f"处理耗时: {elapsed_time:.2f}秒",
-            ""
-        ]
-        
-        # 添加失败记录的详细信息
-        if failed_records:
-            report_lines.extend([
-                f"=== 失败记录详情 ({len(failed_records)}个) ===",
-                ""
-            ])
-            for record in failed_records:
-                report_lines.append(f"❌ {record['answer_hash']}")
-                report_lines.append(f"   索引: {record['index']}")
-                report_lines.append(f"   状态: {record['status']}")
-                report_lines.append(f"   错误: {record['error']}")
-                report_lines.append("")
-        else:
-            report_lines.extend([
-                "=== 失败记录详情 ===",
-                "无失败记录",
-                ""
-            ])
-        
-        # 添加分类库更新记录
-        report_lines.extend([
-            f"=== {category_table_name} 更新记录 ===",
-            ""
-        ])
-        
-        # 主类别使用统计
-        if category_updates['category_stats']:
-            report_lines.append("主类别使用统计:")
-            for category, count in sorted(category_updates['category_stats'].items()):
-                report_lines.append(f"  {category}: {count}次")
-            report_lines.append("")
-        
-        # 新增子类别记录
-        if category_updates['new_subcategories']:
-            report_lines.append(f"新增分类记录 ({len(category_updates['new_subcategories'])}个):")
-            for item in category_updates['new_subcategories']:
-                report_lines.append(f"  ✓ {item['category']} -> {item['subcategory']} -> {item['thirdCategory']}")
-            report_lines.append("")
-        else:
-            report_lines.append("新增分类记录: 无")
-            report_lines.append("")
-        
-        # 相似性拒绝记录
-        if category_updates['similar_rejections']:
-            report_lines.append(f"拒绝的相似子类别 ({len(category_updates['similar_rejections'])}个):")
-            for item in category_updates['similar_rejections']:
-                report_lines.append(f"  ✗ {item['category']} -> {item['rejected_subcategory']}")
-                report_lines.append(f"    原因: {item['reason']}")
-                report_lines.append(f"    已有相似: {item['similar_existing']}")
-            report_lines.append("")
-        else:
-            report_lines.append("拒绝的相似子类别: 无")
-            report_lines.append("")
-        
-        # 分类库优化建议
-        total_new = len(category_updates['new_subcategories'])
-        total_rejected = len(category_updates['similar_rejections'])
-        if total_rejected > 0:
-            optimization_rate = (total_rejected / (total_new + total_rejected)) * 100
-            report_lines.extend([
-                "=== 分类库优化效果 ===",
-                f"避免重复率: {optimization_rate:.1f}%",
-                f"说明: 通过相似性检查，避免了{total_rejected}个重复或相似的子类别",
-                ""
-            ])
+        # 阶段耗时和事件计数，同时保存供API /metrics 读取
+        snapshot = metrics.snapshot()
+        report_lines.extend(build_metrics_report_lines(snapshot))
+        try:
+            save_run_metrics(snapshot, f"{term_id}_{question_id}",
+                             {'term_id': term_id, 'question_id': question_id}, elapsed_time)
+        except Exception as e:
+            print(f"运行指标保存失败: {e}")
         
         try:
             with open(report_filename, 'w', encoding='utf-8') as f:
@@ -845,18 +1618,54 @@ def process_ai_analysis(term_id, question_id):
     except Exception as e:
         print(f"处理过程中发生错误: {e}")
     finally:
+        if job and job['journal']:
+            job['journal'].close()
+        run_budget = None
+        run_deadline = None
+        clear_cancel(cancel_file)
         conn.close()
 
 def main():
     """主函数"""
-    if len(sys.argv) != 3:
-        print("用法: python AI_process.py <term_id> <question_id>")
-        sys.exit(1)
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='AI错误分析')
+    parser.add_argument('term_id')
+    parser.add_argument('question_id')
+    parser.add_argument('--incremental', action='store_true', help='只分析上次运行之后的新提交')
+    parser.add_argument('--continuous', action='store_true', help='持续运行，定期执行增量分析')
+    parser.add_argument('--interval', type=int, help='持续运行的间隔（秒），默认读取config.ini [Incremental] interval')
+    parser.add_argument('--resume', action='store_true', help='根据运行日志续跑上次中断的分析')
+    parser.add_argument('--retry-failed', action='store_true', help='只重试运行日志中失败的记录')
+    parser.add_argument('--time-budget', type=float,
+                        help='时间预算（秒），到达后不再调度新记录，默认读取config.ini [Schedule] time_budget')
+    parser.add_argument('--sample', type=int, nargs='?', const=0, metavar='N',
+                        help='只分析按报错签名分层抽取的N条作答并估计各分类的学生比例，不指定N时读取 [Sampling] sample_size')
+    args = parser.parse_args()
     
-    term_id = sys.argv[1]
-    question_id = sys.argv[2]
+    def handle_terminate(signum, frame):
+        # 与API的取消文件相同：停止调度，写完报告后退出
+        print("收到终止信号，停止调度新记录")
+        run_terminate.set()
+        run_cancel.set()
     
-    process_ai_analysis(term_id, question_id)
+    signal.signal(signal.SIGTERM, handle_terminate)
+    
+    journal_mode = 'retry_failed' if args.retry_failed else 'resume' if args.resume else 'new'
+    if not args.continuous:
+        process_ai_analysis(args.term_id, args.question_id, incremental=args.incremental, journal_mode=journal_mode,
+                            time_budget=args.time_budget, sample_size=args.sample)
+        return
+    
+    interval = args.interval or get_incremental_config()['interval']
+    print(f"持续增量分析模式 [term_id={args.term_id}, question_id={args.question_id}]，间隔 {interval} 秒，Ctrl+C 退出")
+    try:
+        while not run_terminate.is_set():
+            process_ai_analysis(args.term_id, args.question_id, incremental=True, time_budget=args.time_budget)
+            run_terminate.wait(interval)
+    except KeyboardInterrupt:
+        pass
+    print("持续增量分析已停止")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,153 @@
+"""
+作答预处理：代码归一化、分词、报错信息签名提取
+这些步骤是CPU密集型的，数据量大时按块分发到进程池，避免受GIL限制只用到一个核
+"""
+
+import atexit
+import configparser
+import hashlib
+import io
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+# 预处理输出的列
+FEATURE_COLUMNS = ('code_signature', 'token_count', 'error_signature')
+
+_LINE_COMMENT = re.compile(r'//[^\n]*|#(?!include|define)[^\n]*')
+_BLOCK_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+_STRING_LITERAL = re.compile(r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'')
+_WHITESPACE = re.compile(r'\s+')
+_TOKEN = re.compile(r'[A-Za-z_]\w*|\d+(?:\.\d+)?|==|!=|<=|>=|&&|\|\||<<|>>|\+\+|--|->|::|\S')
+
+# 报错信息中与具体作答无关的部分：文件路径、行列号、数字、引号中的内容
+_ERROR_PATH = re.compile(r'(?:[\w.-]+[/\\])*[\w.-]+\.(?:cpp|cc|c|h|hpp|py|java|js)\b')
+_ERROR_QUOTED = re.compile(r"'[^']*'|\"[^\"]*\"|‘[^’]*’|“[^”]*”")
+_ERROR_NUMBER = re.compile(r'\d+')
+
+def get_preprocess_config():
+    """从config.ini读取预处理配置"""
+    config = configparser.ConfigParser()
+    config.read('config.ini', encoding='utf-8')
+
+    return {
+        'enabled': config.getboolean('Preprocess', 'enabled', fallback=True),
+        # 进程数，0表示使用全部CPU核
+        'workers': config.getint('Preprocess', 'workers', fallback=0) or os.cpu_count() or 1,
+        # 每个任务块的作答数量
+        'chunk_size': config.getint('Preprocess', 'chunk_size', fallback=2000),
+        # 少于该数量时在当前进程处理，进程池的启动和数据传输开销大于收益
+        'min_rows_for_pool': config.getint('Preprocess', 'min_rows_for_pool', fallback=5000)
+    }
+
+def normalize_code(code):
+    """去掉注释和字符串内容、合并空白，格式不同但实质相同的代码得到相同结果"""
+    # 先替换字符串，避免字符串中的 // 被当作注释
+    code = _STRING_LITERAL.sub('""', code or '')
+    code = _BLOCK_COMMENT.sub(' ', code)
+    code = _LINE_COMMENT.sub(' ', code)
+    return _WHITESPACE.sub(' ', code).strip()
+
+def tokenize_code(code):
+    return _TOKEN.findall(code)
+
+def error_signature(error_info):
+    """提取报错信息签名，去掉文件名、行列号和具体标识符，同类报错得到相同签名"""
+    # 只有空白的报错信息没有可用的第一行
+    error_info = (error_info or '').strip()
+    if not error_info:
+        return ''
+    signature = _ERROR_PATH.sub('<file>', error_info.splitlines()[0])
+    signature = _ERROR_QUOTED.sub('<name>', signature)
+    signature = _ERROR_NUMBER.sub('<n>', signature)
+    return _WHITESPACE.sub(' ', signature)[:200]
+
+def preprocess_answers(codes, error_infos):
+    """在当前进程中预处理一块作答，返回 {列名: 列表}"""
+    features = {column: [] for column in FEATURE_COLUMNS}
+    for code, error_info in zip(codes, error_infos):
+        normalized = normalize_code(code)
+        features['code_signature'].append(hashlib.md5(normalized.encode('utf-8')).hexdigest())
+        features['token_count'].append(len(tokenize_code(normalized)))
+        features['error_signature'].append(error_signature(error_info))
+    return features
+
+def _preprocess_chunk(chunk):
+    """
+    进程池任务：输入只包含代码和报错信息两列，结果以Arrow IPC格式返回
+    列式二进制缓冲区比逐行pickle体积小，主进程可直接读取为Arrow表
+    """
+    import pyarrow as pa
+
+    codes, error_infos = chunk
+    batch = pa.RecordBatch.from_pydict(preprocess_answers(codes, error_infos))
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, batch.schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue()
+
+_pool = None
+_pool_workers = 0
+
+def _get_pool(workers):
+    """进程池在批量模式下被多个题目复用，进程退出时关闭"""
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        shutdown_pool()
+        _pool = ProcessPoolExecutor(max_workers=workers)
+        _pool_workers = workers
+    return _pool
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+atexit.register(shutdown_pool)
+
+def preprocess_dataframe(df, preprocess_config=None):
+    """
+    为聚合后的作答添加预处理特征列（FEATURE_COLUMNS）
+    数据量达到min_rows_for_pool且workers>1时分块交给进程池，否则在当前进程处理
+    """
+    preprocess_config = preprocess_config or get_preprocess_config()
+    codes = df['answer_code'].fillna('').astype(str).tolist()
+    error_infos = df['error_info'].fillna('').astype(str).tolist()
+
+    if len(df) < preprocess_config['min_rows_for_pool'] or preprocess_config['workers'] <= 1:
+        features = preprocess_answers(codes, error_infos)
+        for column in FEATURE_COLUMNS:
+            df[column] = features[column]
+        return df
+
+    import pyarrow as pa
+
+    chunk_size = max(preprocess_config['chunk_size'], 1)
+    chunks = [(codes[start:start + chunk_size], error_infos[start:start + chunk_size])
+              for start in range(0, len(codes), chunk_size)]
+    pool = _get_pool(preprocess_config['workers'])
+    # map保持块的顺序，结果与df逐行对应
+    tables = [pa.ipc.open_stream(buffer).read_all() for buffer in pool.map(_preprocess_chunk, chunks)]
+    features = pa.concat_tables(tables).to_pandas()
+    for column in FEATURE_COLUMNS:
+        df[column] = features[column].to_numpy()
+    return df
+
+def build_preprocess_report_lines(df):
+    """生成报告中的预处理统计"""
+    if 'error_signature' not in df.columns or df.empty:
+        return []
+    signatures = df.groupby('error_signature')['user_count'].sum().sort_values(ascending=False)
+    report_lines = [
+        "=== 作答预处理 ===",
+        "",
+        f"作答数: {len(df)}",
+        f"归一化后不同代码: {df['code_signature'].nunique()}",
+        f"平均token数: {df['token_count'].mean():.0f}",
+        f"报错签名: {len(signatures)}种",
+    ]
+    for signature, users in signatures.head(5).items():
+        report_lines.append(f"  {signature or '(无报错信息)'}: {users}人")
+    report_lines.append("")
+    return report_lines
@@ -0,0 +1,305 @@
+import argparse
+import configparser
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore
+
+import requests
+
+import AI_process
+from AI_process import (
+    build_job_tasks, build_report_lines, connect_to_database, create_ai_table,
+    create_reusable_category_table, fetch_records, finish_journal, get_config, get_records_table,
+    iter_task_results, prepare_analysis_job, record_task_result, submit_tasks
+)
+from runJournal import get_journal_config
+from runMetrics import build_metrics_report_lines, metrics, save_run_metrics
+from taskSchedule import coverage, get_schedule_config
+from tokenUsage import RunBudget, add_usage, build_usage_report_lines, get_usage_config, new_usage
+
+# 每次查询的题目数量上限，避免IN列表过长
+QUESTION_CHUNK_SIZE = 200
+
+def get_batch_config(thread_config):
+    """从config.ini读取批量模式配置"""
+    config = configparser.ConfigParser()
+    config.read('config.ini', encoding='utf-8')
+
+    max_workers = config.getint('Batch', 'max_workers', fallback=thread_config['max_workers'])
+    return {
+        'max_workers': max_workers,
+        # 所有题目共享的LLM并发上限
+        'llm_concurrency': config.getint('Batch', 'llm_concurrency', fallback=max_workers),
+        'request_delay': config.getfloat('Batch', 'request_delay', fallback=thread_config['request_delay'])
+    }
+
+def list_term_questions(conn, records_table, term_id):
+    """列出学期下所有题目及作答人数，按人数降序"""
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(f"""
+        SELECT question_id, COUNT(DISTINCT user_id) AS user_count
+        FROM {records_table}
+        WHERE term_id = %s AND answer_hash IS NOT NULL
+        GROUP BY question_id
+        ORDER BY user_count DESC
+    """, (term_id,))
+    rows = cursor.fetchall()
+    cursor.close()
+    return [(str(term_id), str(row['question_id']), int(row['user_count'])) for row in rows]
+
+def load_overview(source):
+    """读取 /domain/api/overview 的输出（文件路径或URL），返回 [(term_id, question_id, user_count)]"""
+    if source.startswith('http://') or source.startswith('https://'):
+        response = requests.get(source, timeout=300)
+        response.raise_for_status()
+        overview = response.json()
+    else:
+        with open(source, 'r', encoding='utf-8') as f:
+            overview = json.load(f)
+
+    # 同一题目可能因单元信息不同出现多行，合并人数
+    questions = {}
+    for row in overview.get('data', []):
+        key = (str(row['term_id']), str(row['question_id']))
+        questions[key] = questions.get(key, 0) + int(row.get('user_count') or 0)
+    return [(term_id, question_id, user_count) for (term_id, question_id), user_count in questions.items()]
+
+def prepare_term_jobs(conn, term_id, questions, records_table, journal_config=None, journal_mode='new'):
+    """为一个学期创建结果表并准备所有题目的任务，只建表一次、按批读取记录"""
+    category_table_name = create_reusable_category_table(conn, term_id, None)
+    ai_table_name = f"ai_{term_id}"
+    create_ai_table(conn, ai_table_name)
+
+    jobs = []
+    question_ids = [question_id for _, question_id, _ in questions]
+    user_counts = {question_id: user_count for _, question_id, user_count in questions}
+
+    for i in range(0, len(question_ids), QUESTION_CHUNK_SIZE):
+        chunk = question_ids[i:i + QUESTION_CHUNK_SIZE]
+        records_by_question = {}
+        with metrics.timer('records_fetch'):
+            records = fetch_records(conn, records_table, term_id, chunk)
+        for record in records:
+            records_by_question.setdefault(str(record['question_id']), []).append(record)
+
+        for question_id in chunk:
+            job = prepare_analysis_job(conn, term_id, question_id, records_by_question.get(question_id, []),
+                                       category_table_name, ai_table_name,
+                                       journal_config=journal_config, journal_mode=journal_mode)
+            if job is None:
+                continue
+            job['user_count'] = user_counts.get(question_id) or int(job['df']['user_count'].sum())
+            jobs.append(job)
+    return jobs
+
+def write_batch_report(jobs, elapsed_time, label, budget=None):
+    """生成合并的批量分析报告"""
+    os.makedirs('data', exist_ok=True)
+    timestamp = time.strftime('%Y%m%d_%H%M%S')
+    report_filename = f"data/batch_report_{label}_{timestamp}.txt"
+
+    total_records = sum(len(job['df']) for job in jobs)
+    total_processed = sum(job['counters']['processed'].value for job in jobs)
+    total_skipped = sum(job['counters']['skipped'].value for job in jobs)
+    total_error = sum(job['counters']['error'].value for job in jobs)
+    total_users = sum(job['total_users'] for job in jobs)
+    total_covered = sum(job['covered_users'] for job in jobs)
+
+    report_lines = [
+        f"AI批量分析报告 - {time.strftime('%Y-%m-%d %H:%M:%S')}",
+        f"题目数: {len(jobs)}",
+        "",
+        "=== 总体统计 ===",
+        f"总记录数: {total_records}",
+        f"成功分析: {total_processed}",
+        f"跳过记录: {total_skipped}",
+        f"失败记录: {total_error}",
+        f"学生覆盖率: {total_covered / total_users * 100 if total_users else 100:.1f}% ({total_covered}/{total_users}人)",
+        f"总耗时: {elapsed_time:.2f}秒",
+        f"吞吐量: {(total_processed + total_skipped + total_error) / elapsed_time:.2f} 条/秒" if elapsed_time > 0 else "吞吐量: -",
+        "",
+        "=== 各题目统计（按作答人数排序） ===",
+    ]
+    total_deferred = sum(job['deferred'] for job in jobs)
+    if total_deferred:
+        report_lines.insert(report_lines.index(f"总耗时: {elapsed_time:.2f}秒"), f"超出时间预算未分析: {total_deferred}")
+    total_circuit_deferred = sum(job['circuit_deferred'] for job in jobs)
+    if total_circuit_deferred:
+        report_lines.insert(report_lines.index(f"总耗时: {elapsed_time:.2f}秒"), f"LLM熔断未分析: {total_circuit_deferred}")
+    for job in jobs:
+        counters = job['counters']
+        report_lines.append(
+            f"  term_id={job['term_id']} question_id={job['question_id']} 人数={job['user_count']} "
+            f"记录={len(job['df'])} 成功={counters['processed'].value} 跳过={counters['skipped'].value} "
+            f"失败={counters['error'].value} 覆盖率={coverage(job)*100:.1f}% "
+            f"完成于={job.get('elapsed_time', elapsed_time):.1f}秒"
+        )
+    report_lines.append("")
+
+    # 所有题目的token用量合计，预算按整个批量运行计算
+    total_usage = new_usage()
+    usage_by_category = {}
+    for job in jobs:
+        add_usage(total_usage, job['token_usage'])
+        for category, usage in job['usage_by_category'].items():
+            add_usage(usage_by_category.setdefault(category, new_usage()), usage)
+    report_lines.extend(build_usage_report_lines(total_usage, get_usage_config(), usage_by_category, budget))
+
+    snapshot = metrics.snapshot()
+    report_lines.extend(build_metrics_report_lines(snapshot))
+    try:
+        save_run_metrics(snapshot, f"batch_{label}", {'batch': label}, elapsed_time)
+    except Exception as e:
+        print(f"运行指标保存失败: {e}")
+
+    for job in jobs:
+        report_lines.append("-" * 60)
+        report_lines.extend(build_report_lines(job, job.get('elapsed_time', elapsed_time)))
+
+    try:
+        with open(report_filename, 'w', encoding='utf-8') as f:
+            f.write("\n".join(report_lines))
+        print(f"批量报告已保存: {report_filename}")
+    except Exception as e:
+        print(f"批量报告保存失败: {e}")
+    return report_filename
+
+def process_batch(questions, label, journal_mode='new', time_budget=None):
+    """
+    批量分析多个题目
+    questions: [(term_id, question_id, user_count)]，user_count为None时按聚合结果计算
+    所有题目共享一个线程池和LLM并发预算，所有题目的记录按 [Schedule] priority 统一排序调度
+    journal_mode: new / resume / retry_failed，每个题目使用各自的运行日志
+    time_budget: 整个批量运行的时间预算（秒），None时读取 [Schedule] time_budget
+    """
+    db_config, api_config, prompt_config, thread_config, template_config = get_config()
+    batch_config = get_batch_config(thread_config)
+    thread_config['request_delay'] = batch_config['request_delay']
+    records_table = get_records_table()
+    journal_config = get_journal_config()
+    if not journal_config['enabled']:
+        journal_config = None
+
+    if not os.path.exists(prompt_config['system_prompt_path']):
+        print(f"系统提示词文件不存在: {prompt_config['system_prompt_path']}")
+        return
+
+    print(f"AI批量分析开始 [{label}]: {len(questions)} 个题目, "
+          f"线程数={batch_config['max_workers']}, LLM并发={batch_config['llm_concurrency']}")
+
+    metrics.reset()
+    conn = connect_to_database(db_config)
+    try:
+        jobs = []
+        terms = {}
+        for term_id, question_id, user_count in questions:
+            terms.setdefault(term_id, []).append((term_id, question_id, user_count))
+        for term_id, term_questions in terms.items():
+            jobs.extend(prepare_term_jobs(conn, term_id, term_questions, records_table,
+                                          journal_config=journal_config, journal_mode=journal_mode))
+    finally:
+        conn.close()
+
+    if not jobs:
+        print("没有可分析的题目")
+        return
+
+    # 作答人数多的题目优先调度
+    jobs.sort(key=lambda job: job['user_count'], reverse=True)
+
+    AI_process.llm_semaphore = BoundedSemaphore(batch_config['llm_concurrency'])
+    budget = RunBudget(get_usage_config())
+    AI_process.run_budget = budget
+    schedule_config = get_schedule_config()
+    if time_budget is None:
+        time_budget = schedule_config['time_budget']
+    start_time = time.time()
+    deadline = start_time + time_budget if time_budget else None
+    # 到达截止时间后正在执行的任务也不再重试LLM请求
+    AI_process.run_deadline = deadline
+
+    try:
+        with ThreadPoolExecutor(max_workers=batch_config['max_workers']) as executor:
+            job_tasks = []
+            for job in jobs:
+                job['started_at'] = start_time
+                job['publish_coverage'] = schedule_config['publish_coverage']
+                tasks = build_job_tasks(job, db_config, api_config, prompt_config, thread_config, template_config)
+                job_tasks.extend((job, task) for task in tasks)
+            future_to_job = submit_tasks(executor, job_tasks, schedule_config['priority'])
+
+            total_tasks = len(future_to_job)
+            finished_tasks = 0
+            for job, task, future in iter_task_results(future_to_job, deadline):
+                record_task_result(job, task, future)
+                finished_tasks += 1
+
+                if job['completed'] == len(job['df']):
+                    job['elapsed_time'] = time.time() - start_time
+                    if job['journal']:
+                        job['journal'].close()
+                    print(f"✅ 题目完成 [term_id={job['term_id']}, question_id={job['question_id']}]: "
+                          f"{job['counters']['processed'].value}/{len(job['df'])} "
+                          f"(总进度 {finished_tasks}/{total_tasks})")
+    finally:
+        AI_process.llm_semaphore = None
+        AI_process.run_budget = None
+        AI_process.run_deadline = None
+        elapsed_time = time.time() - start_time
+        # 合并各题目所有续跑分段的统计
+        for job in jobs:
+            finish_journal(job, job.get('elapsed_time', elapsed_time))
+
+    total_processed = sum(job['counters']['processed'].value for job in jobs)
+    total_records = sum(len(job['df']) for job in jobs)
+    print(f"\nAI批量分析完成 [{label}]: {len(jobs)} 个题目, {total_processed}/{total_records}")
+    print(f"耗时: {elapsed_time:.1f}秒")
+    print(f"Token用量: 输入 {budget.usage['prompt_tokens']} / 输出 {budget.usage['completion_tokens']}")
+
+    write_batch_report(jobs, elapsed_time, label, budget)
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='批量分析一个学期的多个题目')
+    parser.add_argument('term_id', nargs='?', help='学期ID，不指定--questions时分析该学期所有题目')
+    parser.add_argument('--questions', help='逗号分隔的题目ID列表')
+    parser.add_argument('--overview', help='/domain/api/overview 的输出文件或URL')
+    parser.add_argument('--min-users', type=int, default=0, help='只分析作答人数不少于该值的题目')
+    parser.add_argument('--resume', action='store_true', help='根据运行日志续跑上次中断的分析')
+    parser.add_argument('--retry-failed', action='store_true', help='只重试运行日志中失败的记录')
+    parser.add_argument('--time-budget', type=float,
+                        help='整个批量运行的时间预算（秒），默认读取config.ini [Schedule] time_budget')
+    args = parser.parse_args()
+
+    if args.overview:
+        questions = load_overview(args.overview)
+        if args.term_id:
+            questions = [q for q in questions if q[0] == str(args.term_id)]
+        label = f"overview_{args.term_id}" if args.term_id else "overview"
+    elif args.term_id and args.questions:
+        questions = [(str(args.term_id), question_id.strip(), None)
+                     for question_id in args.questions.split(',') if question_id.strip()]
+        label = str(args.term_id)
+    elif args.term_id:
+        db_config = get_config()[0]
+        conn = connect_to_database(db_config)
+        try:
+            questions = list_term_questions(conn, get_records_table(), args.term_id)
+        finally:
+            conn.close()
+        label = str(args.term_id)
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+    if args.min_users:
+        questions = [q for q in questions if q[2] is None or q[2] >= args.min_users]
+
+    journal_mode = 'retry_failed' if args.retry_failed else 'resume' if args.resume else 'new'
+    process_batch(questions, label, journal_mode=journal_mode, time_budget=args.time_budget)
+
+if __name__ == "__main__":
+    main()
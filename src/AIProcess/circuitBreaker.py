@@ -0,0 +1,166 @@
+"""
+LLM调用熔断
+上游不可用时，每条剩余记录仍会重试 max_retry 次、每次等待到超时，整次运行要拖到 analysis_timeout 才失败。
+所有分析线程共享一个熔断器：最近 window 次请求中失败（超时、连接错误、HTTP 5xx）的比例达到 failure_rate 时打开，
+打开期间分析线程暂停调度，等待进入半开状态（仍然响应截止时间和取消）；
+open_seconds 秒后进入半开状态，放行 probe_requests 个探测请求，成功则恢复，失败则继续打开；
+从第一次打开起 pause_seconds 秒内没有恢复时不再等待，剩余记录直接计为未分析（运行日志中保持queued，可 --resume）；
+探测请求没有得到结论（HTTP 429、因截止时间缩短的超时）时归还名额，open_seconds 内没有结论的探测名额同样收回
+"""
+
+import configparser
+import threading
+import time
+from collections import deque
+
+from runMetrics import metrics
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+def get_breaker_config():
+    """从config.ini读取熔断配置"""
+    config = configparser.ConfigParser()
+    config.read('config.ini', encoding='utf-8')
+
+    return {
+        'enabled': config.getboolean('Breaker', 'enabled', fallback=True),
+        # 统计失败率的最近请求数
+        'window': config.getint('Breaker', 'window', fallback=20),
+        # 样本少于min_requests时不打开
+        'min_requests': config.getint('Breaker', 'min_requests', fallback=10),
+        'failure_rate': config.getfloat('Breaker', 'failure_rate', fallback=0.5),
+        # 打开后多少秒进入半开状态
+        'open_seconds': config.getfloat('Breaker', 'open_seconds', fallback=30.0),
+        # 半开状态放行的探测请求数
+        'probe_requests': config.getint('Breaker', 'probe_requests', fallback=1),
+        # 打开后最多暂停调度多少秒等待恢复，0表示不等待
+        'pause_seconds': config.getfloat('Breaker', 'pause_seconds', fallback=300.0)
+    }
+
+class CircuitBreaker:
+    """在多个分析线程间共享的熔断器"""
+
+    def __init__(self, breaker_config):
+        self.config = breaker_config
+        self.state = STATE_CLOSED
+        self._outcomes = deque(maxlen=max(breaker_config['window'], 1))
+        self._open_until = 0.0
+        self._outage_start = 0.0
+        self._probes = 0
+        self._probe_at = 0.0
+        self._lock = threading.Lock()
+
+    def _open(self, reason):
+        if self.state == STATE_CLOSED:
+            # 探测失败重新打开时仍从第一次打开算起
+            self._outage_start = time.time()
+        self.state = STATE_OPEN
+        self._open_until = time.time() + self.config['open_seconds']
+        self._outcomes.clear()
+        metrics.increment('breaker_open')
+        print(f"⚠️ LLM熔断打开（{reason}），{self.config['open_seconds']:.0f} 秒内不再发起请求，暂停调度等待恢复")
+
+    def _ready(self):
+        return (self.state == STATE_CLOSED
+                or (self.state == STATE_HALF_OPEN and self._probes < self.config['probe_requests']))
+
+    def _refresh(self):
+        now = time.time()
+        if self.state == STATE_OPEN and now >= self._open_until:
+            self.state = STATE_HALF_OPEN
+            self._probes = 0
+        elif (self.state == STATE_HALF_OPEN and self._probes
+              and now - self._probe_at >= self.config['open_seconds']):
+            # 探测请求的结果没有记录（例如请求线程异常退出），不能一直停在半开状态
+            self._probes = 0
+
+    def is_open(self):
+        """熔断打开（且未到半开时间）时返回True，用于在准备提示词等工作之前跳过任务"""
+        if not self.config['enabled']:
+            return False
+        with self._lock:
+            self._refresh()
+            return self.state == STATE_OPEN
+
+    def wait_ready(self, deadline=None, cancel_event=None, poll_seconds=1.0):
+        """
+        熔断打开或半开状态的探测名额用完时等待，可以发起请求时返回True
+        到达deadline、cancel_event被设置或超过pause_seconds仍未恢复时返回False，不占用探测名额
+        """
+        if not self.config['enabled']:
+            return True
+        while True:
+            with self._lock:
+                self._refresh()
+                if self._ready():
+                    return True
+                give_up_at = self._outage_start + self.config['pause_seconds']
+            now = time.time()
+            if deadline is not None:
+                give_up_at = min(give_up_at, deadline)
+            if now >= give_up_at or (cancel_event is not None and cancel_event.is_set()):
+                return False
+            timeout = min(poll_seconds, give_up_at - now)
+            if cancel_event is not None:
+                cancel_event.wait(timeout)
+            else:
+                time.sleep(timeout)
+
+    def allow(self):
+        """是否允许发起一次请求；半开状态只放行probe_requests个探测请求"""
+        if not self.config['enabled']:
+            return True
+        with self._lock:
+            self._refresh()
+            if self.state == STATE_CLOSED:
+                return True
+            if self.state == STATE_HALF_OPEN and self._probes < self.config['probe_requests']:
+                self._probes += 1
+                self._probe_at = time.time()
+                metrics.increment('breaker_probe')
+                return True
+        metrics.increment('breaker_short_circuit')
+        return False
+
+    def record(self, failed):
+        """
+        记录一次请求的结果
+        failed为None表示请求没有得到结论（HTTP 429、因截止时间缩短的超时），不计入失败率，半开状态下归还探测名额
+        """
+        if not self.config['enabled']:
+            return
+        with self._lock:
+            if failed is None:
+                if self.state == STATE_HALF_OPEN and self._probes:
+                    self._probes -= 1
+                return
+            if self.state == STATE_HALF_OPEN:
+                if failed:
+                    self._open("探测请求失败")
+                else:
+                    self.state = STATE_CLOSED
+                    self._outcomes.clear()
+                    metrics.increment('breaker_close')
+                    print("LLM熔断恢复，继续分析")
+                return
+            if self.state == STATE_OPEN:
+                # 打开之前发出的请求，结果不再影响状态
+                return
+            self._outcomes.append(failed)
+            failures = sum(self._outcomes)
+            if (len(self._outcomes) >= self.config['min_requests']
+                    and failures >= len(self._outcomes) * self.config['failure_rate']):
+                self._open(f"最近 {len(self._outcomes)} 次请求失败 {failures} 次")
+
+_breaker = None
+_breaker_lock = threading.Lock()
+
+def get_breaker():
+    """进程内共享的CircuitBreaker，第一次使用时读取配置"""
+    global _breaker
+    with _breaker_lock:
+        if _breaker is None:
+            _breaker = CircuitBreaker(get_breaker_config())
+        return _breaker
@@ -0,0 +1,291 @@
+import configparser
+import os
+import sys
+import time
+
+from dataProcess import get_database_config
+
+# 可导出的数据集
+# inputs:  按answer_hash聚合后的学生作答（与dataProcess输出一致）
+# results: ai_{term_id} 中的AI分类结果
+DATASETS = ('inputs', 'results')
+
+# 支持的导出格式及文件后缀
+# parquet: 列式压缩存储，体积小，适合归档和分析工具读取
+# arrow:   Arrow IPC文件（不压缩），可通过内存映射零拷贝读取
+# excel:   仅适合小数据量，超过excel_max_rows时拒绝导出
+EXPORT_FORMATS = {
+    'parquet': '.parquet',
+    'arrow': '.arrow',
+    'excel': '.xlsx',
+}
+
+BATCH_SIZE = 10000
+
+def get_export_config(config=None):
+    """从config.ini读取导出配置，可传入已加载的ConfigParser"""
+    if config is None:
+        config = configparser.ConfigParser()
+        config.read('config.ini', encoding='utf-8')
+
+    return {
+        'format': config.get('Export', 'format', fallback='parquet'),
+        'output_dir': config.get('Export', 'output_dir', fallback='data/export'),
+        'partition': config.getboolean('Export', 'partition', fallback=False),
+        'compression': config.get('Export', 'compression', fallback='zstd'),
+        'excel_max_rows': config.getint('Export', 'excel_max_rows', fallback=50000),
+        'records_table': config.get('DataTable', 'records_table', fallback='code_clustering_user_answer_record'),
+    }
+
+def _import_pyarrow():
+    """按需导入pyarrow（parquet/arrow格式需要）"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise Exception("导出parquet/arrow格式需要安装pyarrow: pip install pyarrow")
+    return pa, pq
+
+def get_schema(pa, dataset):
+    """数据集对应的Arrow schema，分类等重复度高的列使用字典编码"""
+    text = pa.large_string()
+    category = pa.dictionary(pa.int32(), pa.string())
+    if dataset == 'inputs':
+        return pa.schema([
+            ('term_id', pa.int64()),
+            ('question_id', pa.int64()),
+            ('answer_hash', pa.string()),
+            ('user_count', pa.int64()),
+            ('user_list', text),
+            ('error_info', text),
+            ('answer_code', text),
+        ])
+    return pa.schema([
+        ('term_id', pa.int64()),
+        ('question_id', pa.int64()),
+        ('answer_hash', pa.string()),
+        ('category', category),
+        ('subcategory', category),
+        ('thirdCategory', category),
+        ('specific_reason', pa.string()),
+        ('mark_code', text),
+        ('standard_code', pa.dictionary(pa.int32(), text)),
+        ('answer_code', text),
+        ('error_info', text),
+        ('created_at', pa.timestamp('s')),
+    ])
+
+def build_query(dataset, term_id, question_id, records_table):
+    """构建导出查询，结果按question_id排序以便按题目分区流式写出"""
+    if dataset == 'inputs':
+        # 在数据库中完成聚合，user_list格式与dataProcess输出一致
+        query = f"""
+        SELECT term_id, question_id, answer_hash,
+               COUNT(*) AS user_count,
+               GROUP_CONCAT(user_id ORDER BY user_id SEPARATOR ', ') AS user_list,
+               ANY_VALUE(error_info) AS error_info,
+               ANY_VALUE(answer_code) AS answer_code
+        FROM {records_table}
+        WHERE term_id = %s AND answer_hash IS NOT NULL
+        """
+        params = [term_id]
+        if question_id is not None:
+            query += " AND question_id = %s"
+            params.append(question_id)
+        query += " GROUP BY term_id, question_id, answer_hash ORDER BY question_id, answer_hash"
+        return query, tuple(params)
+
+    query = f"""
+    SELECT {int(term_id)} AS term_id, question_id, answer_hash, category, subcategory, thirdCategory,
+           specific_reason, mark_code, standard_code, answer_code, error_info, created_at
+    FROM ai_{term_id}
+    """
+    params = []
+    if question_id is not None:
+        query += " WHERE question_id = %s"
+        params.append(question_id)
+    query += " ORDER BY question_id, id"
+    return query, tuple(params)
+
+def iter_question_batches(conn, query, params, batch_size=BATCH_SIZE):
+    """流式读取查询结果，按question_id切分批次，返回 (question_id, rows)"""
+    cursor = conn.cursor(dictionary=True)
+    try:
+        if 'GROUP_CONCAT' in query:
+            # 默认1024字节会截断用户列表
+            cursor.execute("SET SESSION group_concat_max_len = 67108864")
+        cursor.execute(query, params)
+
+        current_question, buffer = None, []
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                if row['question_id'] != current_question and buffer:
+                    yield current_question, buffer
+                    buffer = []
+                current_question = row['question_id']
+                buffer.append(row)
+                if len(buffer) >= batch_size:
+                    yield current_question, buffer
+                    buffer = []
+        if buffer:
+            yield current_question, buffer
+    finally:
+        cursor.close()
+
+def _output_path(output_dir, dataset, term_id, question_id, fmt):
+    """不分区时的输出文件路径"""
+    suffix = f"_{question_id}" if question_id is not None else ""
+    return os.path.join(output_dir, f"{dataset}_{term_id}{suffix}{EXPORT_FORMATS[fmt]}")
+
+def _partition_path(output_dir, dataset, term_id, question_id, fmt):
+    """分区输出路径（Hive风格: term_id=.../question_id=...），分析工具可直接按目录读取整个数据集"""
+    return os.path.join(output_dir, dataset, f"term_id={term_id}", f"question_id={question_id}",
+                        f"part-0{EXPORT_FORMATS[fmt]}")
+
+class _ColumnarWriter:
+    """按目标文件管理parquet/arrow写入器"""
+
+    def __init__(self, pa, pq, schema, fmt, compression):
+        self.pa, self.pq = pa, pq
+        self.schema = schema
+        self.fmt = fmt
+        self.compression = compression
+        self.path = None
+        self.writer = None
+        self.arrow_batches = []
+
+    def open(self, path):
+        self.close()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        if self.fmt == 'parquet':
+            self.writer = self.pq.ParquetWriter(path, self.schema, compression=self.compression)
+
+    def write(self, batch):
+        if self.fmt == 'parquet':
+            self.writer.write_batch(batch)
+        else:
+            # IPC文件格式不支持批次间替换字典，先缓存批次，关闭时统一字典后一次写出
+            self.arrow_batches.append(batch)
+
+    def close(self):
+        if self.path is None:
+            return
+        if self.fmt == 'parquet':
+            self.writer.close()
+        else:
+            table = self.pa.Table.from_batches(self.arrow_batches, schema=self.schema).unify_dictionaries()
+            with self.pa.OSFile(self.path, 'wb') as sink:
+                with self.pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+        self.path, self.writer, self.arrow_batches = None, None, []
+
+def _export_excel(conn, query, params, output_path, excel_max_rows):
+    """导出Excel（仅小数据量），返回 (输出路径, 行数)"""
+    import pandas as pd
+
+    rows = []
+    for _, batch in iter_question_batches(conn, query, params):
+        rows.extend(batch)
+        if len(rows) > excel_max_rows:
+            raise Exception(f"数据量超过 {excel_max_rows} 行，Excel格式仅适用于小数据量，请使用parquet或arrow格式")
+
+    if not rows:
+        return None, 0
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    pd.DataFrame(rows).to_excel(output_path, index=False)
+    return output_path, len(rows)
+
+def export_dataset(conn, term_id, dataset='results', question_id=None, fmt=None,
+                   output_dir=None, partition=None, export_config=None):
+    """
+    导出数据集到列式文件
+    返回 (输出路径, 行数)；分区导出时输出路径为数据集根目录
+    """
+    export_config = export_config or get_export_config()
+    fmt = fmt or export_config['format']
+    output_dir = output_dir or export_config['output_dir']
+    partition = export_config['partition'] if partition is None else partition
+
+    if dataset not in DATASETS:
+        raise ValueError(f"不支持的数据集: {dataset}，可选: {', '.join(DATASETS)}")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"不支持的导出格式: {fmt}，可选: {', '.join(EXPORT_FORMATS)}")
+
+    query, params = build_query(dataset, term_id, question_id, export_config['records_table'])
+
+    if fmt == 'excel':
+        output_path = _output_path(output_dir, dataset, term_id, question_id, fmt)
+        return _export_excel(conn, query, params, output_path, export_config['excel_max_rows'])
+
+    pa, pq = _import_pyarrow()
+    schema = get_schema(pa, dataset)
+    if partition:
+        # 分区列由目录名提供，不再重复写入文件
+        for name in ('term_id', 'question_id'):
+            schema = schema.remove(schema.get_field_index(name))
+    writer = _ColumnarWriter(pa, pq, schema, fmt, export_config['compression'])
+
+    total_rows = 0
+    current_question = None
+    try:
+        for batch_question, rows in iter_question_batches(conn, query, params):
+            if partition and batch_question != current_question:
+                writer.open(_partition_path(output_dir, dataset, term_id, batch_question, fmt))
+            elif writer.path is None:
+                writer.open(_output_path(output_dir, dataset, term_id, question_id, fmt))
+            current_question = batch_question
+
+            writer.write(pa.RecordBatch.from_pylist(rows, schema=schema))
+            total_rows += len(rows)
+    finally:
+        writer.close()
+
+    if total_rows == 0:
+        return None, 0
+    if partition:
+        return os.path.join(output_dir, dataset), total_rows
+    return _output_path(output_dir, dataset, term_id, question_id, fmt), total_rows
+
+def main():
+    """主函数"""
+    import argparse
+    import mysql.connector
+
+    parser = argparse.ArgumentParser(description='导出聚合数据和AI分类结果到Parquet/Arrow')
+    parser.add_argument('term_id')
+    parser.add_argument('question_id', nargs='?', help='不指定时导出整个学期')
+    parser.add_argument('--dataset', choices=DATASETS + ('all',), default='all')
+    parser.add_argument('--format', dest='fmt', choices=tuple(EXPORT_FORMATS), help='默认读取config.ini [Export] format')
+    parser.add_argument('--output-dir', help='默认读取config.ini [Export] output_dir')
+    parser.add_argument('--partition', action='store_true', help='按term_id/question_id分区写出')
+    args = parser.parse_args()
+
+    db_config = get_database_config()
+    db_config['charset'] = 'utf8mb4'
+    db_config['use_unicode'] = True
+    conn = mysql.connector.connect(**db_config)
+
+    datasets = DATASETS if args.dataset == 'all' else (args.dataset,)
+    try:
+        for dataset in datasets:
+            start_time = time.time()
+            output_path, row_count = export_dataset(
+                conn, args.term_id, dataset, question_id=args.question_id, fmt=args.fmt,
+                output_dir=args.output_dir, partition=args.partition or None
+            )
+            if output_path is None:
+                print(f"没有可导出的数据 [{dataset}]: term_id={args.term_id}, question_id={args.question_id}")
+                continue
+            print(f"导出完成 [{dataset}]: {row_count} 行 -> {output_path} ({time.time() - start_time:.2f}秒)")
+    except Exception as e:
+        print(f"导出失败: {e}")
+        sys.exit(1)
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -63,6 +63,46 @@ def get_data_table_config():
     
     return table_config
 
+def get_output_config():
+    """从config.ini读取聚合数据的输出格式配置"""
+    config = configparser.ConfigParser()
+    config.read('config.ini', encoding='utf-8')
+    
+    return {
+        'format': config.get('Export', 'format', fallback='parquet'),
+        'compression': config.get('Export', 'compression', fallback='zstd'),
+        'excel_max_rows': config.getint('Export', 'excel_max_rows', fallback=50000)
+    }
+
+def aggregate_records(df):
+    """按answer_hash聚合数据，每个answer_hash保留第一条记录的代码和报错信息"""
+    first_records = df.drop_duplicates('answer_hash').set_index('answer_hash')
+    users = df.groupby('answer_hash', sort=True)['user_id'].agg(
+        user_count='size',
+        # 将user_list转换为不带单引号的字符串格式
+        user_list=lambda user_ids: ', '.join(str(user_id) for user_id in user_ids)
+    )
+    result_df = users.join(first_records[['error_info', 'answer_code', 'term_id', 'question_id']])
+    return result_df.reset_index()
+
+def save_aggregated_data(result_df, term_id, question_id):
+    """保存聚合数据，默认parquet格式，Excel仅用于小数据量"""
+    output_config = get_output_config()
+    output_format = output_config['format']
+    
+    if output_format == 'excel' and len(result_df) > output_config['excel_max_rows']:
+        print(f"聚合记录数 {len(result_df)} 超过 excel_max_rows={output_config['excel_max_rows']}，改为保存parquet格式")
+        output_format = 'parquet'
+    
+    if output_format == 'excel':
+        output_filename = f"data/data_{term_id}_{question_id}.xlsx"
+        result_df.to_excel(output_filename, index=False)
+    else:
+        output_filename = f"data/data_{term_id}_{question_id}.parquet"
+        result_df.to_parquet(output_filename, index=False, compression=output_config['compression'])
+    
+    return output_filename
+
 def process_data(term_id, question_id):
     """直接从数据库中的真实数据表读取记录"""
     db_config = get_database_config()
@@ -113,35 +153,14 @@ def process_data(term_id, question_id):
         df = pd.DataFrame(records, columns=column_names)
         
         # 按answer_hash聚合数据
-        processed_data = []
         total_users = len(df)
-        
-        for answer_hash, group in df.groupby('answer_hash'):
-            user_list = group['user_id'].tolist()
-            first_record = group.iloc[0]
-            
-            # 将user_list转换为不带单引号的字符串格式
-            user_list_str = ', '.join(str(user_id) for user_id in user_list)
-            
-            processed_data.append({
-                'answer_hash': answer_hash,
-                'user_count': len(user_list),
-                'user_list': user_list_str,  # 使用字符串格式而不是列表
-                'error_info': first_record['error_info'],
-                'answer_code': first_record['answer_code'],
-                'term_id': first_record['term_id'],
-                'question_id': first_record['question_id']
-            })
-        
-        result_df = pd.DataFrame(processed_data)
+        result_df = aggregate_records(df)
         
         # 确保data目录存在
         import os
         os.makedirs('data', exist_ok=True)
         
-        # 保存到Excel文件
-        output_filename = f"data/data_{term_id}_{question_id}.xlsx"
-        result_df.to_excel(output_filename, index=False)
+        output_filename = save_aggregated_data(result_df, term_id, question_id)
         
         print(f"数据处理完成 [term_id={term_id}, question_id={question_id}]: {len(result_df)} 条聚合记录, {total_users} 个用户")
         print(f"数据已保存到: {output_filename}")
@@ -0,0 +1,134 @@
+"""
+LLM请求对冲（hedged request）
+单次请求超过近期延迟的分位数（默认p95）仍未返回时，再发送一个相同的请求，使用先返回的可用结果；
+少数很慢的上游请求不再决定整次运行的耗时。对冲请求数不超过普通请求数的 max_ratio，
+上游整体变慢（所有请求都超过p95）时不会成倍放大负载
+普通请求和对冲请求各自在新线程中立即发出，不经过有上限的线程池：并发数由调用方（分析线程、llm_semaphore）控制，
+请求不会排队，对冲等待时间从请求真正发出时开始计算
+"""
+
+import configparser
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+
+from runMetrics import metrics, percentile
+
+def get_hedge_config():
+    """从config.ini读取请求对冲配置"""
+    config = configparser.ConfigParser()
+    config.read('config.ini', encoding='utf-8')
+
+    return {
+        'enabled': config.getboolean('Hedge', 'enabled', fallback=False),
+        # 请求耗时超过近期成功请求的该分位数（0.95即p95）时发送对冲请求
+        'percentile': config.getfloat('Hedge', 'percentile', fallback=0.95),
+        # 对冲等待时间的下限（秒），避免延迟很低时频繁对冲
+        'min_delay': config.getfloat('Hedge', 'min_delay', fallback=1.0),
+        # 延迟样本少于min_samples时使用initial_delay
+        'min_samples': config.getint('Hedge', 'min_samples', fallback=20),
+        'initial_delay': config.getfloat('Hedge', 'initial_delay', fallback=10.0),
+        # 对冲预算：对冲请求数 / 普通请求数 的上限
+        'max_ratio': config.getfloat('Hedge', 'max_ratio', fallback=0.1),
+        # 计算分位数使用的最近样本数
+        'window': config.getint('Hedge', 'window', fallback=200)
+    }
+
+def _start(fn, *args):
+    """在新线程中执行fn(*args)并返回Future"""
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name='llm-hedge', daemon=True).start()
+    return future
+
+def _usable(future):
+    return not future.cancelled() and future.exception() is None and future.result().status_code == 200
+
+class Hedger:
+    """在多个分析线程间共享：记录近期延迟、控制对冲预算"""
+
+    def __init__(self, hedge_config):
+        self.config = hedge_config
+        self._samples = deque(maxlen=max(hedge_config['window'], 1))
+        self._requests = 0
+        self._hedges = 0
+        self._lock = threading.Lock()
+
+    def record_latency(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def hedge_delay(self):
+        """当前的对冲等待时间（秒）"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < self.config['min_samples']:
+            return self.config['initial_delay']
+        return max(percentile(samples, self.config['percentile']), self.config['min_delay'])
+
+    def _take_budget(self):
+        with self._lock:
+            if self._hedges + 1 > self._requests * self.config['max_ratio']:
+                return False
+            self._hedges += 1
+            return True
+
+    def _timed(self, send, timeout):
+        start = time.time()
+        response = send(timeout)
+        if response.status_code == 200:
+            self.record_latency(time.time() - start)
+        return response
+
+    def post(self, send, timeout, on_discard=None):
+        """
+        send(timeout) 发送一次请求并返回response
+        超过对冲等待时间仍未返回时再发送一次，返回先到的可用响应（HTTP 200）；两个都失败时返回/抛出普通请求的结果
+        on_discard(response): 被丢弃的另一个请求之后成功返回时调用（用于记录其token用量）
+        """
+        with self._lock:
+            self._requests += 1
+        if not self.config['enabled']:
+            return self._timed(send, timeout)
+
+        start = time.time()
+        primary = _start(self._timed, send, timeout)
+        delay = self.hedge_delay()
+        if delay >= timeout or wait([primary], timeout=delay).done or not self._take_budget():
+            return primary.result()
+
+        metrics.increment('llm_hedge')
+        hedge = _start(self._timed, send, max(timeout - (time.time() - start), 0.1))
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = next((future for future in done if _usable(future)), None)
+            if winner is None:
+                continue
+            if winner is hedge:
+                metrics.increment('llm_hedge_win')
+            for loser in pending:
+                if on_discard is not None:
+                    loser.add_done_callback(lambda future: _usable(future) and on_discard(future.result()))
+            return winner.result()
+        return primary.result()
+
+_hedger = None
+_hedger_lock = threading.Lock()
+
+def get_hedger():
+    """进程内共享的Hedger，第一次使用时读取配置"""
+    global _hedger
+    with _hedger_lock:
+        if _hedger is None:
+            _hedger = Hedger(get_hedge_config())
+        return _hedger
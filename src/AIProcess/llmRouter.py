@@ -0,0 +1,166 @@
+"""
+多端点LLM路由
+[API] endpoints 配置多个端点（各自的api_url / api_key / model / 权重 / 并发上限）时，每次请求选择一个端点：
+least_outstanding 选择 进行中请求数/权重 最小的端点；latency 选择 近期平均延迟×(进行中请求数+1)/权重 最小的端点。
+连续失败（超时、连接错误、HTTP 429/5xx）达到 eject_failures 次的端点暂停使用 eject_seconds 秒；
+所有端点都被暂停时仍按同样规则选择，不会让分析停下来；
+所有端点都达到并发上限时等待，到达截止时间或运行被取消时抛出 AcquireAborted
+未配置 endpoints 时只有 [API] 中的一个端点，行为与之前相同
+"""
+
+import configparser
+import threading
+import time
+
+from runMetrics import metrics
+
+# [Router] strategy 可选值
+STRATEGIES = ('least_outstanding', 'latency')
+
+# 近期平均延迟（指数加权）中最新样本的权重
+LATENCY_ALPHA = 0.3
+
+class AcquireAborted(Exception):
+    """等待端点并发名额时到达截止时间（status='deadline_exceeded'）或运行被取消（status='cancelled'）"""
+
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+def get_router_config(config=None):
+    """从config.ini读取端点选择和健康检查配置，可传入已加载的ConfigParser"""
+    if config is None:
+        config = configparser.ConfigParser()
+        config.read('config.ini', encoding='utf-8')
+
+    router_config = {
+        'strategy': config.get('Router', 'strategy', fallback='least_outstanding').strip().lower(),
+        # 连续失败多少次后暂停使用该端点
+        'eject_failures': config.getint('Router', 'eject_failures', fallback=3),
+        # 暂停时长（秒），之后重新参与选择
+        'eject_seconds': config.getfloat('Router', 'eject_seconds', fallback=30.0)
+    }
+    if router_config['strategy'] not in STRATEGIES:
+        raise ValueError(f"[Router] strategy 可选: {', '.join(STRATEGIES)}")
+    return router_config
+
+def load_endpoints(config, api_config):
+    """
+    读取 [API] endpoints 列出的端点，每个端点的配置在 [Endpoint.名称] 中，
+    未配置的 api_url / api_key / model 沿用 [API] 中的值（例如同一地址的多个key只需配置api_key）
+    """
+    names = [name.strip() for name in config.get('API', 'endpoints', fallback='').split(',') if name.strip()]
+    if not names:
+        return [{'name': 'default', 'api_url': api_config['api_url'], 'api_key': api_config['api_key'],
+                 'model': api_config['model'], 'weight': 1.0, 'max_concurrency': 0}]
+
+    endpoints = []
+    for name in names:
+        section = f"Endpoint.{name}"
+        if not config.has_section(section):
+            raise ValueError(f"[API] endpoints 中的 {name} 缺少 [{section}] 配置")
+        endpoints.append({
+            'name': name,
+            'api_url': config.get(section, 'api_url', fallback=api_config['api_url']),
+            'api_key': config.get(section, 'api_key', fallback=api_config['api_key']),
+            'model': config.get(section, 'model', fallback=api_config['model']),
+            'weight': max(config.getfloat(section, 'weight', fallback=1.0), 0.01),
+            # 该端点同时进行的请求数上限（key的并发/限流额度），0表示不限制
+            'max_concurrency': config.getint(section, 'max_concurrency', fallback=0)
+        })
+    return endpoints
+
+class LLMRouter:
+    """在多个分析线程间共享：记录各端点进行中的请求数、近期延迟和连续失败次数"""
+
+    def __init__(self, endpoints, router_config):
+        self.endpoints = endpoints
+        self.config = router_config
+        self._states = {endpoint['name']: {'outstanding': 0, 'latency': None, 'failures': 0, 'ejected_until': 0.0}
+                        for endpoint in endpoints}
+        self._condition = threading.Condition()
+
+    def _score(self, endpoint, default_latency):
+        state = self._states[endpoint['name']]
+        load = (state['outstanding'] + 1) / endpoint['weight']
+        if self.config['strategy'] == 'latency':
+            latency = state['latency'] if state['latency'] is not None else default_latency
+            return latency * load
+        return load
+
+    def _saturated(self, endpoint):
+        return 0 < endpoint['max_concurrency'] <= self._states[endpoint['name']]['outstanding']
+
+    def acquire(self, deadline=None, cancel_event=None):
+        """
+        选择一个端点并占用一个并发名额，所有端点都达到并发上限时等待
+        等待期间到达deadline或cancel_event被设置时抛出AcquireAborted
+        """
+        with self._condition:
+            while True:
+                now = time.time()
+                healthy = [endpoint for endpoint in self.endpoints
+                           if self._states[endpoint['name']]['ejected_until'] <= now] or self.endpoints
+                available = [endpoint for endpoint in healthy if not self._saturated(endpoint)]
+                if available:
+                    # 还没有成功样本的端点（包括一直失败的端点）按已知最慢的延迟计算，不会被优先选择
+                    known = [state['latency'] for state in self._states.values() if state['latency'] is not None]
+                    default_latency = max(known) if known else 1.0
+                    endpoint = min(available, key=lambda endpoint: self._score(endpoint, default_latency))
+                    self._states[endpoint['name']]['outstanding'] += 1
+                    return endpoint
+                if cancel_event is not None and cancel_event.is_set():
+                    raise AcquireAborted('cancelled')
+                timeout = 1.0
+                if deadline is not None:
+                    if now >= deadline:
+                        raise AcquireAborted('deadline_exceeded')
+                    timeout = min(timeout, deadline - now)
+                metrics.increment('llm_endpoint_wait')
+                self._condition.wait(timeout=timeout)
+
+    def release(self, endpoint, latency=None, failed=False):
+        """
+        请求结束后释放名额
+        failed: 端点不可用（超时、连接错误、HTTP 429/5xx），连续失败达到阈值时暂停该端点
+        latency: 成功请求的耗时，用于latency策略
+        """
+        name = endpoint['name']
+        with self._condition:
+            state = self._states[name]
+            state['outstanding'] -= 1
+            if failed:
+                state['failures'] += 1
+                now = time.time()
+                # 只有一个端点时暂停没有意义
+                if (len(self.endpoints) > 1 and state['failures'] >= self.config['eject_failures']
+                        and state['ejected_until'] <= now):
+                    state['ejected_until'] = now + self.config['eject_seconds']
+                    state['failures'] = 0
+                    ejected = True
+                else:
+                    ejected = False
+            else:
+                state['failures'] = 0
+                ejected = False
+                if latency is not None:
+                    state['latency'] = (latency if state['latency'] is None
+                                        else LATENCY_ALPHA * latency + (1 - LATENCY_ALPHA) * state['latency'])
+            self._condition.notify_all()
+
+        if len(self.endpoints) > 1:
+            metrics.increment(f"llm_endpoint_{name}_{'error' if failed else 'ok'}")
+        if ejected:
+            metrics.increment('llm_endpoint_eject')
+            print(f"LLM端点 {name} 连续失败 {self.config['eject_failures']} 次，暂停使用 {self.config['eject_seconds']:.0f} 秒")
+
+_router = None
+_router_lock = threading.Lock()
+
+def get_router(endpoints):
+    """进程内共享的LLMRouter，第一次使用时按传入的端点和 [Router] 配置创建"""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = LLMRouter(endpoints, get_router_config())
+        return _router
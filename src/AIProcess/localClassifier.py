@@ -0,0 +1,280 @@
+"""
+本地分类器：用所有学期 ai_{term_id} 中已有的LLM分类结果训练，对新作答直接给出分类
+模型按题目保存（不区分学期），同一题目在之后的学期再次布置时直接使用以前学期的分类结果。
+特征为归一化代码的词和相邻词对、报错签名（answerPreprocess），TF-IDF加权后按余弦相似度取最近的k条已分类作答投票；
+置信度（投票中最高分类的占比）达到 min_confidence 时直接使用，其余仍交给LLM。
+只使用CPU和标准库，模型以gzip压缩的JSON保存在 model_dir，进程内按文件修改时间缓存
+训练: python src/AIProcess/localClassifier.py [77337 ...]（不指定题目时训练所有学期出现过的所有题目）
+"""
+
+import configparser
+import gzip
+import json
+import math
+import os
+import re
+import sys
+import time
+from collections import Counter, defaultdict
+from threading import Lock
+
+from answerPreprocess import error_signature, normalize_code, tokenize_code
+from schemaMigration import ensure_table
+
+# 本地分类器写入结果时的model列，训练时排除这些行，避免用自己的输出训练
+LOCAL_MODEL = 'local-tfidf'
+ROUTE_LOCAL = 'local'
+# v2: specific_reason按训练样本保存（v1只保存每个分类第一条样本的原因）
+MODEL_VERSION = 2
+
+# 分析结果表名 ai_{term_id}
+_RESULT_TABLE = re.compile(r'^ai_(\d+)$')
+
+# 报错信息特征的权重倍数：报错类型对错误分类的区分度远高于单个代码词，不加权时会被大量代码词淹没
+ERROR_FEATURE_WEIGHT = 4.0
+
+def get_classifier_config():
+    """从config.ini读取本地分类器配置"""
+    config = configparser.ConfigParser()
+    config.read('config.ini', encoding='utf-8')
+
+    scope = config.get('Classifier', 'scope', fallback='question').strip().lower()
+    # 旧配置中的term（每个学期一个模型）改为所有学期共用的global模型
+    scope = 'global' if scope == 'term' else scope
+    return {
+        'enabled': config.getboolean('Classifier', 'enabled', fallback=False),
+        'model_dir': config.get('Classifier', 'model_dir', fallback='data/models'),
+        # question: 每个题目一个模型；global: 所有题目一个模型（题目少量作答时可借用其他题目的结果）
+        # 两种模型都使用所有学期的结果训练
+        'scope': scope if scope in ('question', 'global') else 'question',
+        # 最近邻数量
+        'k': config.getint('Classifier', 'k', fallback=5),
+        # 直接使用本地分类结果的最低置信度
+        'min_confidence': config.getfloat('Classifier', 'min_confidence', fallback=0.8),
+        # 最相似的已分类作答低于该相似度时不使用本地结果
+        'min_similarity': config.getfloat('Classifier', 'min_similarity', fallback=0.5),
+        # 已分类作答少于min_samples条时不训练
+        'min_samples': config.getint('Classifier', 'min_samples', fallback=30),
+        # 每个模型最多使用的训练样本数（最近的结果）
+        'max_samples': config.getint('Classifier', 'max_samples', fallback=5000)
+    }
+
+def extract_features(answer_code, error_info, question_id=None):
+    """作答的特征词及出现次数"""
+    tokens = tokenize_code(normalize_code(answer_code or ''))
+    features = Counter(tokens)
+    features.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+    signature = error_signature(error_info or '')
+    if signature:
+        features[f"E:{signature}"] += 1
+        features.update(f"E:{token}" for token in tokenize_code(signature))
+    if question_id is not None:
+        features[f"Q:{question_id}"] += 1
+    return features
+
+def _tfidf(features, idf):
+    vector = {term: (1 + math.log(count)) * idf[term] * (ERROR_FEATURE_WEIGHT if term.startswith('E:') else 1)
+              for term, count in features.items() if term in idf}
+    norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+    return {term: weight / norm for term, weight in vector.items()} if norm else {}
+
+def model_path(model_dir, question_id=None):
+    name = f"classifier_q{question_id}" if question_id is not None else "classifier_global"
+    return os.path.join(model_dir, f"{name}.json.gz")
+
+def list_result_tables(conn):
+    """所有学期的分析结果表，最近的学期（term_id大）在前"""
+    cursor = conn.cursor()
+    cursor.execute("SHOW TABLES LIKE 'ai_%'")
+    tables = [table_name for (table_name,) in cursor.fetchall() if _RESULT_TABLE.match(table_name)]
+    cursor.close()
+    return sorted(tables, key=lambda table_name: int(_RESULT_TABLE.match(table_name).group(1)), reverse=True)
+
+def load_training_rows(conn, question_id=None, max_samples=5000):
+    """读取所有学期中LLM给出的分类结果（不含本地分类器的结果），最近的学期和最近的结果在前"""
+    where, params = "(model IS NULL OR model <> %s) AND category IS NOT NULL AND category <> ''", [LOCAL_MODEL]
+    if question_id is not None:
+        where += " AND question_id = %s"
+        params.append(question_id)
+    rows = []
+    cursor = conn.cursor(dictionary=True)
+    for table_name in list_result_tables(conn):
+        if len(rows) >= max_samples:
+            break
+        # 以前学期的表可能还没有迁移（缺少model等列），查询前升级到最新版本
+        ensure_table(conn, 'ai', table_name)
+        cursor.execute(f"""
+        SELECT question_id, answer_code, error_info, category, subcategory, thirdCategory, specific_reason
+        FROM {table_name} WHERE {where}
+        ORDER BY id DESC LIMIT %s
+        """, (*params, max_samples - len(rows)))
+        rows.extend(cursor.fetchall())
+    cursor.close()
+    return rows
+
+def list_questions(conn):
+    """所有学期中有分析结果的题目"""
+    question_ids = set()
+    cursor = conn.cursor()
+    for table_name in list_result_tables(conn):
+        cursor.execute(f"SELECT DISTINCT question_id FROM {table_name}")
+        question_ids.update(str(row[0]) for row in cursor.fetchall())
+    cursor.close()
+    return sorted(question_ids)
+
+def train(rows, include_question=False):
+    """训练模型，返回可JSON序列化的dict"""
+    samples = [(extract_features(row['answer_code'], row['error_info'],
+                                 row['question_id'] if include_question else None), row) for row in rows]
+    document_frequency = Counter()
+    for features, _ in samples:
+        document_frequency.update(features.keys())
+    # 只出现一次的特征不能帮助找到相似作答
+    idf = {term: math.log((len(samples) + 1) / (count + 1)) + 1
+           for term, count in document_frequency.items() if count > 1}
+
+    labels, label_index, vectors = [], {}, []
+    for features, row in samples:
+        label = (row['category'], row['subcategory'], row['thirdCategory'])
+        if label not in label_index:
+            label_index[label] = len(labels)
+            labels.append(list(label))
+        vector = _tfidf(features, idf)
+        if vector:
+            vectors.append([label_index[label], {term: round(weight, 5) for term, weight in vector.items()},
+                            row['specific_reason'] or ''])
+    return {'version': MODEL_VERSION, 'trained_at': time.time(), 'include_question': include_question,
+            'idf': idf, 'labels': labels, 'vectors': vectors}
+
+def save_model(model, path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        json.dump(model, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+class LocalClassifier:
+    """加载后的模型：倒排索引上的kNN"""
+
+    def __init__(self, model, classifier_config):
+        self.config = classifier_config
+        self.idf = model['idf']
+        self.labels = model['labels']
+        self.include_question = model.get('include_question', False)
+        self.vector_labels = [label for label, _, _ in model['vectors']]
+        self.reasons = [reason for _, _, reason in model['vectors']]
+        self.index = defaultdict(list)
+        for i, (_, vector, _) in enumerate(model['vectors']):
+            for term, weight in vector.items():
+                self.index[term].append((i, weight))
+
+    def predict(self, answer_code, error_info, question_id=None):
+        """
+        返回 (分类dict, 置信度, 最高相似度)，没有相似作答时返回 (None, 0, 0)
+        分类dict包含category/subcategory/thirdCategory和最相似的同类作答（得票分类中相似度最高的近邻）的specific_reason
+        """
+        vector = _tfidf(extract_features(answer_code, error_info, question_id if self.include_question else None),
+                        self.idf)
+        scores = defaultdict(float)
+        for term, weight in vector.items():
+            for i, indexed_weight in self.index.get(term, ()):
+                scores[i] += weight * indexed_weight
+        if not scores:
+            return None, 0.0, 0.0
+
+        neighbours = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:max(self.config['k'], 1)]
+        votes = defaultdict(float)
+        for i, similarity in neighbours:
+            votes[self.vector_labels[i]] += similarity
+        label, vote = max(votes.items(), key=lambda item: item[1])
+        category, subcategory, third_category = self.labels[label]
+        # neighbours按相似度从高到低排列，第一个属于得票分类的近邻即最相似的同类作答
+        nearest = next(i for i, _ in neighbours if self.vector_labels[i] == label)
+        prediction = {'category': category, 'subcategory': subcategory, 'thirdCategory': third_category,
+                      'specific_reason': self.reasons[nearest]}
+        return prediction, vote / sum(votes.values()), neighbours[0][1]
+
+    def accept(self, confidence, similarity):
+        return confidence >= self.config['min_confidence'] and similarity >= self.config['min_similarity']
+
+_models = {}
+_models_lock = Lock()
+
+def load_classifier(question_id, classifier_config=None):
+    """加载题目（或global）的模型，没有开启或没有训练过时返回None；文件未变化时使用进程内缓存"""
+    classifier_config = classifier_config or get_classifier_config()
+    if not classifier_config['enabled']:
+        return None
+    path = model_path(classifier_config['model_dir'],
+                      question_id if classifier_config['scope'] == 'question' else None)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    with _models_lock:
+        cached = _models.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            model = json.load(f)
+        if model.get('version') != MODEL_VERSION:
+            print(f"本地分类器模型版本不匹配，请重新训练: {path}")
+            return None
+        classifier = LocalClassifier(model, classifier_config)
+        _models[path] = (mtime, classifier)
+        return classifier
+
+def evaluate(rows, classifier_config, include_question=False):
+    """按时间留出最近20%的样本评估：返回 (留出样本数, 本地分类的比例, 本地分类的准确率)"""
+    holdout = max(len(rows) // 5, 1)
+    classifier = LocalClassifier(train(rows[holdout:], include_question), classifier_config)
+    accepted = correct = 0
+    for row in rows[:holdout]:
+        prediction, confidence, similarity = classifier.predict(row['answer_code'], row['error_info'],
+                                                                row['question_id'])
+        if prediction and classifier.accept(confidence, similarity):
+            accepted += 1
+            correct += (prediction['category'], prediction['subcategory'], prediction['thirdCategory']) == \
+                (row['category'], row['subcategory'], row['thirdCategory'])
+    return holdout, accepted / holdout, (correct / accepted if accepted else 0.0)
+
+def train_and_save(conn, question_id, classifier_config):
+    """训练并保存一个模型（scope为global时忽略question_id），样本不足时返回None"""
+    scope_question = question_id if classifier_config['scope'] == 'question' else None
+    rows = load_training_rows(conn, scope_question, classifier_config['max_samples'])
+    label = f"question_id={question_id}" if scope_question is not None else "global"
+    if len(rows) < classifier_config['min_samples']:
+        print(f"{label}: 已分类作答 {len(rows)} 条，少于 min_samples={classifier_config['min_samples']}，跳过")
+        return None
+
+    include_question = scope_question is None
+    holdout, coverage, accuracy = evaluate(rows, classifier_config, include_question)
+    path = model_path(classifier_config['model_dir'], scope_question)
+    save_model(train(rows, include_question), path)
+    print(f"{label}: 训练样本 {len(rows)} 条，留出 {holdout} 条中本地分类 {coverage * 100:.1f}%，"
+          f"准确率 {accuracy * 100:.1f}% -> {path}")
+    return path
+
+def main():
+    import mysql.connector
+    from dataProcess import get_database_config
+
+    if any(not arg.isdigit() for arg in sys.argv[1:]):
+        print("用法: python localClassifier.py [question_id ...]")
+        sys.exit(1)
+    classifier_config = get_classifier_config()
+
+    conn = mysql.connector.connect(**get_database_config())
+    try:
+        question_ids = sys.argv[1:]
+        if classifier_config['scope'] == 'global':
+            question_ids = [None]
+        elif not question_ids:
+            question_ids = list_questions(conn)
+        for question_id in question_ids:
+            train_and_save(conn, question_id, classifier_config)
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+按需生成标记代码（mark_code）
+[Prompt] mark_code = lazy 时批量分析只输出分类和错误原因，标记代码在查看某条结果时生成，
+结果和token用量写回 ai_{term_id} 表，之后直接返回缓存
+"""
+
+import os
+
+from AI_process import call_ai_api
+from responseParse import MARK_CODE_FIELDS
+from tokenUsage import new_usage
+
+def load_result_row(conn, ai_table_name, question_id, answer_hash):
+    """读取一条分析结果，不存在时返回None"""
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(f"""
+    SELECT answer_hash, question_id, category, subcategory, thirdCategory, specific_reason,
+           mark_code, standard_code, answer_code, error_info
+    FROM {ai_table_name}
+    WHERE question_id = %s AND answer_hash = %s
+    """, (question_id, answer_hash))
+    row = cursor.fetchone()
+    cursor.close()
+    return row
+
+def load_question_requirements(conn, question_info_table, question_id):
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT requirements FROM {question_info_table} WHERE question_id = %s", (question_id,))
+    row = cursor.fetchone()
+    cursor.close()
+    return row[0] if row and row[0] is not None else ''
+
+def build_mark_code_prompt(user_prompt_template, requirements, row):
+    """在批量分析的用户提示词后附加已确定的分类和错误原因"""
+    user_prompt = user_prompt_template.format(
+        question_info=requirements,
+        standard_code=row.get('standard_code') or '',
+        answer_code=row.get('answer_code') or '',
+        error_info=row.get('error_info') or ''
+    )
+    return (f"{user_prompt}\n\n错误分类：{row['category']} -> {row['subcategory']} -> {row['thirdCategory']}"
+            f"\n\n错误原因：{row['specific_reason']}")
+
+def save_mark_code(conn, ai_table_name, question_id, answer_hash, mark_code, usage):
+    """写入标记代码并累加token用量；已有标记代码时不覆盖"""
+    cursor = conn.cursor()
+    cursor.execute(f"""
+    UPDATE {ai_table_name}
+    SET mark_code = %s,
+        prompt_tokens = COALESCE(prompt_tokens, 0) + %s,
+        completion_tokens = COALESCE(completion_tokens, 0) + %s
+    WHERE question_id = %s AND answer_hash = %s AND (mark_code IS NULL OR mark_code = '')
+    """, (mark_code, usage['prompt_tokens'], usage['completion_tokens'], question_id, answer_hash))
+    conn.commit()
+    cursor.close()
+
+def generate_mark_code(conn, term_id, question_id, answer_hash, api_config, prompt_config,
+                       question_info_table, base_dir='.'):
+    """
+    返回 (mark_code, 是否本次生成)，结果不存在时返回 (None, False)
+    已有标记代码时直接返回；LLM调用失败时抛出RuntimeError
+    """
+    ai_table_name = f"ai_{term_id}"
+    row = load_result_row(conn, ai_table_name, question_id, answer_hash)
+    if row is None:
+        return None, False
+    if row.get('mark_code'):
+        return row['mark_code'], False
+
+    prompt_path = prompt_config['mark_code_prompt_path']
+    with open(os.path.join(base_dir, prompt_path), 'r', encoding='utf-8') as f:
+        system_prompt = f.read()
+    requirements = load_question_requirements(conn, question_info_table, question_id)
+    user_prompt = build_mark_code_prompt(prompt_config['user_prompt'], requirements, row)
+
+    usage = new_usage()
+    response = call_ai_api(api_config, system_prompt, user_prompt, usage, MARK_CODE_FIELDS)
+    if not response:
+        raise RuntimeError("标记代码生成失败，请稍后重试")
+    save_mark_code(conn, ai_table_name, question_id, answer_hash, response['mark_code'], usage)
+    return response['mark_code'], True
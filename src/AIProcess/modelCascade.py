@@ -0,0 +1,78 @@
+"""
+模型级联
+大部分错误是简单的语法或拼写问题，[Cascade] enabled 时每条记录先交给便宜、快速的模型分类，
+只有以下情况才升级到 [API] 配置的模型重新分析：
+- invalid: 便宜模型的输出无法解析、缺少必需字段或请求失败
+- new_category: 提出了分类库（reusableCategory_{term_id}）中不存在的分类
+- low_confidence: 自评置信度低于 min_confidence
+每条结果的 cascade_route 列记录路由结果（cheap / escalated:原因）
+"""
+
+import configparser
+
+# 要求便宜模型额外输出的置信度字段
+CONFIDENCE_FIELD = 'confidence'
+CONFIDENCE_INSTRUCTION = (
+    '\n\n##置信度\n在输出的JSON中额外增加 "confidence" 字段：你对本次分类结果的把握程度，0到1之间的小数。'
+    '分类体系中没有合适的分类或无法确定错误原因时给出较低的值。'
+)
+
+ROUTE_CHEAP = 'cheap'
+
+def get_cascade_config(config=None):
+    """从config.ini读取模型级联配置，可传入已加载的ConfigParser"""
+    if config is None:
+        config = configparser.ConfigParser()
+        config.read('config.ini', encoding='utf-8')
+
+    return {
+        'enabled': config.getboolean('Cascade', 'enabled', fallback=False),
+        # 先尝试的便宜模型（经过同样的端点路由）
+        'model': config.get('Cascade', 'model', fallback='').strip(),
+        # 便宜模型的请求次数，失败时直接升级而不是重试
+        'max_retry': config.getint('Cascade', 'max_retry', fallback=1),
+        # 便宜模型提出分类库中不存在的分类时升级
+        'escalate_new_category': config.getboolean('Cascade', 'escalate_new_category', fallback=True),
+        # 低于该置信度时升级，0表示不要求输出置信度
+        'min_confidence': config.getfloat('Cascade', 'min_confidence', fallback=0.7)
+    }
+
+def cascade_enabled(cascade_config):
+    return bool(cascade_config and cascade_config['enabled'] and cascade_config['model'])
+
+def cheap_api_config(api_config, cascade_config):
+    """便宜模型使用的api_config：所有端点都使用级联模型"""
+    return dict(api_config, model=cascade_config['model'], force_model=True,
+                max_retry=max(cascade_config['max_retry'], 1))
+
+def cheap_prompt(system_prompt, required_fields, cascade_config):
+    """便宜模型的系统提示词和必需字段（需要置信度时追加说明和字段）"""
+    if cascade_config['min_confidence'] > 0:
+        return system_prompt + CONFIDENCE_INSTRUCTION, tuple(required_fields) + (CONFIDENCE_FIELD,)
+    return system_prompt, tuple(required_fields)
+
+def category_exists(conn, category_table_name, question_id, response):
+    cursor = conn.cursor()
+    cursor.execute(f"""
+    SELECT 1 FROM {category_table_name}
+    WHERE question_id = %s AND category = %s AND subcategory = %s AND thirdCategory = %s
+    LIMIT 1
+    """, (question_id, response['category'], response['subcategory'], response['thirdCategory']))
+    exists = cursor.fetchone() is not None
+    cursor.close()
+    return exists
+
+def escalation_reason(conn, category_table_name, question_id, response, cascade_config):
+    """便宜模型的结果需要升级时返回原因，可以直接使用时返回None"""
+    if not response:
+        return 'invalid'
+    if cascade_config['min_confidence'] > 0:
+        try:
+            confidence = float(response.get(CONFIDENCE_FIELD))
+        except (TypeError, ValueError):
+            return 'invalid'
+        if confidence < cascade_config['min_confidence']:
+            return 'low_confidence'
+    if cascade_config['escalate_new_category'] and not category_exists(conn, category_table_name, question_id, response):
+        return 'new_category'
+    return None
@@ -0,0 +1,169 @@
+"""
+LLM响应解析
+模型经常把JSON包在 ```json 代码块中、在前后附加说明文字，或者输出尾逗号、未转义换行等小错误；
+这些情况在本地提取和修复，只有完全无法使用的响应才重新调用LLM（重新调用需要再次支付整个提示词的费用）。
+被截断的输出（字符串或括号未闭合）不修复：补全后的mark_code等字段内容不完整，同样重新调用
+"""
+
+import ast
+import json
+import re
+
+# 分析结果必须包含且不能为空的字段（与system_prompt中的输出格式一致）
+REQUIRED_FIELDS = ('category', 'subcategory', 'thirdCategory', 'specific_reason', 'mark_code')
+# [Prompt] mark_code = lazy 时批量分析只输出分类和错误原因（system_prompt_classify）
+CLASSIFY_FIELDS = ('category', 'subcategory', 'thirdCategory', 'specific_reason')
+# 按需生成标记代码（mark_code_prompt）
+MARK_CODE_FIELDS = ('mark_code',)
+
+# [API] response_format 可选值
+RESPONSE_FORMATS = ('none', 'json_object', 'json_schema')
+
+_CODE_FENCE = re.compile(r'```[\w-]*[ \t]*\n?(.*?)```', re.S)
+_CONTROL_ESCAPES = {'\n': '\\n', '\r': '\\r', '\t': '\\t'}
+
+def response_schema(required_fields=REQUIRED_FIELDS):
+    return {
+        'type': 'object',
+        'properties': {field: {'type': 'string'} for field in required_fields},
+        'required': list(required_fields),
+        'additionalProperties': False
+    }
+
+def build_response_format(response_format, required_fields=REQUIRED_FIELDS):
+    """请求体中的response_format参数（OpenAI兼容接口），none时返回None"""
+    if response_format == 'json_object':
+        return {'type': 'json_object'}
+    if response_format == 'json_schema':
+        return {
+            'type': 'json_schema',
+            'json_schema': {'name': 'error_analysis', 'strict': True, 'schema': response_schema(required_fields)}
+        }
+    return None
+
+def strip_code_fence(text):
+    """响应以 ``` 代码块开头时取出代码块中的内容，否则原样返回（字段值中的代码块不能当作响应的代码块）"""
+    match = _CODE_FENCE.match(text)
+    return match.group(1).strip() if match else text
+
+def extract_json_object(text):
+    """
+    从第一个 { 开始截取括号配平的JSON对象（跳过字符串中的括号）
+    没有找到 { 时返回None；括号未闭合（输出被截断）时返回 { 之后的全部内容
+    """
+    start = text.find('{')
+    if start < 0:
+        return None
+    depth, in_string, escaped = 0, False, False
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return text[start:]
+
+def repair_json(text):
+    """
+    修复常见的JSON格式错误：
+    - 字符串中未转义的换行和制表符（mark_code中的多行代码）
+    - 对象和数组末尾多余的逗号
+    字符串或括号未闭合（输出被截断）时抛出ValueError，不补全
+    """
+    output, closers = [], []
+    in_string, escaped = False, False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+            elif char in _CONTROL_ESCAPES:
+                char = _CONTROL_ESCAPES[char]
+            output.append(char)
+            continue
+        if char == '"':
+            in_string = True
+        elif char in '{[':
+            closers.append('}' if char == '{' else ']')
+        elif char in '}]':
+            # 去掉右括号前多余的逗号
+            while output and output[-1].isspace():
+                output.pop()
+            if output and output[-1] == ',':
+                output.pop()
+            if closers:
+                closers.pop()
+        output.append(char)
+
+    if in_string or closers:
+        raise ValueError("输出被截断：字符串或括号未闭合")
+    return ''.join(output)
+
+def _loads_object(text):
+    value = json.loads(text)
+    if not isinstance(value, dict):
+        raise ValueError(f"响应不是JSON对象: {type(value).__name__}")
+    return value
+
+def parse_json_content(content, repair=True):
+    """
+    解析LLM返回的内容，返回 (对象, 解析方式)
+    解析方式: direct 直接解析 / extracted 去掉代码块或前后文字后解析 / repaired 本地修复后解析
+    无法得到JSON对象时抛出ValueError
+    """
+    text = (content or '').strip().lstrip('﻿')
+    try:
+        return _loads_object(text), 'direct'
+    except ValueError:
+        pass
+
+    # 先在原文中查找（前后有说明文字、字段值中含有代码块时），只有以代码块开头的响应才取出代码块
+    candidate = extract_json_object(strip_code_fence(text) if text.startswith('```') else text)
+    if candidate is None:
+        raise ValueError(f"响应中没有JSON对象: {text[:100]}")
+    try:
+        return _loads_object(candidate), 'extracted'
+    except ValueError as e:
+        if not repair:
+            raise ValueError(f"JSON解析失败: {e}")
+
+    try:
+        return _loads_object(repair_json(candidate)), 'repaired'
+    except ValueError as e:
+        error = e
+        if str(e).startswith("输出被截断"):
+            raise ValueError(f"JSON修复失败: {e}")
+    # 单引号、True/None等Python字面量形式的输出
+    try:
+        value = ast.literal_eval(candidate)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        raise ValueError(f"JSON修复失败: {error}")
+    if not isinstance(value, dict):
+        raise ValueError(f"响应不是JSON对象: {type(value).__name__}")
+    return value, 'repaired'
+
+def validate_response(response, required_fields=REQUIRED_FIELDS):
+    """检查必需字段，返回缺失或为空的字段列表；非字符串的字段值转换为字符串"""
+    missing = []
+    for field in required_fields:
+        value = response.get(field)
+        if value is not None and not isinstance(value, str):
+            value = json.dumps(value, ensure_ascii=False) if isinstance(value, (dict, list)) else str(value)
+            response[field] = value
+        if not value or not value.strip():
+            missing.append(field)
+    return missing
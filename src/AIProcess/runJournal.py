@@ -0,0 +1,257 @@
+import configparser
+import json
+import os
+import time
+from threading import Lock
+
+from tokenUsage import add_usage, new_usage
+
+# 任务状态
+STATE_QUEUED = 'queued'
+STATE_IN_FLIGHT = 'in_flight'
+STATE_DONE = 'done'
+STATE_FAILED = 'failed'
+
+def get_journal_config():
+    """从config.ini读取运行日志配置"""
+    config = configparser.ConfigParser()
+    config.read('config.ini', encoding='utf-8')
+
+    return {
+        'enabled': config.getboolean('Journal', 'enabled', fallback=True),
+        'journal_dir': config.get('Journal', 'journal_dir', fallback='data/journal'),
+        # 每条记录写入后是否fsync，开启后断电也不丢失，但写入更慢
+        'fsync': config.getboolean('Journal', 'fsync', fallback=False),
+        # 重试失败记录时使用的重试策略
+        'retry_max_retry': config.getint('Journal', 'retry_max_retry', fallback=5),
+        'retry_timeout': config.getint('Journal', 'retry_timeout', fallback=60)
+    }
+
+def journal_path(journal_dir, term_id, question_id):
+    # ID拼接到文件名中，只接受数字，避免读写 journal_dir 以外的文件
+    for value in (term_id, question_id):
+        if not (str(value).isascii() and str(value).isdigit()):
+            raise ValueError(f"无效的ID: {value!r}")
+    return os.path.join(journal_dir, f"journal_{term_id}_{question_id}.jsonl")
+
+class RunJournal:
+    """
+    分析运行日志（追加写入的JSONL文件）
+    记录每个answer_hash的任务状态、分类库更新和运行分段，进程被终止后可据此续跑并合并报告
+    """
+
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        self._lock = Lock()
+        self._file = None
+
+    def open(self, resume=False):
+        """准备日志文件，resume=False时清空旧日志重新开始"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if not resume:
+            open(self.path, 'w', encoding='utf-8').close()
+        return self
+
+    def close(self):
+        """释放文件句柄，之后再写入时会重新打开（批量模式下避免同时打开大量文件）"""
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def _write(self, event):
+        event['ts'] = time.time()
+        line = json.dumps(event, ensure_ascii=False, default=str)
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(line + '\n')
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def start_segment(self, mode, total):
+        self._write({'event': 'segment_start', 'mode': mode, 'total': total})
+
+    def end_segment(self, elapsed_time, processed, skipped, error):
+        self._write({'event': 'segment_end', 'elapsed_time': elapsed_time,
+                     'processed': processed, 'skipped': skipped, 'error': error})
+
+    def log_skipped(self, answer_hashes):
+        """批量记录已有结果而跳过的answer_hash"""
+        if answer_hashes:
+            self._write({'event': 'skipped', 'hashes': list(answer_hashes)})
+
+    def log_task(self, answer_hash, state, index=None, status=None, category=None, usage=None):
+        event = {'event': 'task', 'hash': answer_hash, 'state': state}
+        if index is not None:
+            event['index'] = int(index)
+        if status is not None:
+            event['status'] = status
+        if category is not None:
+            event['category'] = category
+        if usage and usage.get('calls'):
+            event['usage'] = usage
+        self._write(event)
+
+    def log_category_update(self, kind, item):
+        """记录分类库更新（kind: new_subcategories / similar_rejections）"""
+        self._write({'event': 'category_update', 'kind': kind, 'item': item})
+
+    def load(self):
+        """
+        回放日志，返回合并后的运行状态:
+        tasks: {answer_hash: {'state', 'status', 'index', 'category', 'usage'}}
+               （取每个hash的最后状态，usage为所有分段的累计用量）
+        segments: 各运行分段的统计
+        new_subcategories / similar_rejections: 所有分段的分类库更新
+        """
+        summary = new_summary()
+        if not os.path.exists(self.path):
+            return summary
+
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    # 进程被终止时最后一行可能不完整
+                    continue
+                apply_event(summary, event)
+        return summary
+
+def new_summary():
+    return {
+        'tasks': {},
+        'segments': [],
+        'new_subcategories': [],
+        'similar_rejections': []
+    }
+
+def apply_event(summary, event):
+    """把一条日志事件合并到回放状态中（见RunJournal.load）"""
+    kind = event.get('event')
+    if kind == 'task':
+        task = summary['tasks'].setdefault(event['hash'], {})
+        task['state'] = event['state']
+        for key in ('index', 'status', 'category'):
+            if key in event:
+                task[key] = event[key]
+        if 'usage' in event:
+            add_usage(task.setdefault('usage', new_usage()), event['usage'])
+    elif kind == 'skipped':
+        for answer_hash in event['hashes']:
+            summary['tasks'][answer_hash] = {'state': STATE_DONE, 'status': 'skip'}
+    elif kind == 'category_update':
+        summary[event['kind']].append(event['item'])
+    elif kind == 'segment_start':
+        summary['segments'].append({'mode': event['mode'], 'total': event['total'],
+                                    'started_at': event['ts']})
+    elif kind == 'segment_end' and summary['segments']:
+        summary['segments'][-1].update({
+            'elapsed_time': event['elapsed_time'],
+            'processed': event['processed'],
+            'skipped': event['skipped'],
+            'error': event['error']
+        })
+
+class JournalTail:
+    """
+    跟随正在写入的运行日志（API进度推送），每次poll只解析新增的完整行
+    新运行清空日志重写时（文件变短或第一行变化）从头重新回放
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.summary = new_summary()
+        self.updated_at = 0.0
+        self._offset = 0
+        self._first_line = None
+
+    def poll(self):
+        """读取新增的事件并合并到summary，返回新增事件列表；日志不存在时返回空列表"""
+        try:
+            stat = os.stat(self.path)
+            with open(self.path, 'rb') as f:
+                first_line = f.readline()
+                if stat.st_size < self._offset or (self._first_line is not None and first_line != self._first_line):
+                    self.summary = new_summary()
+                    self._offset = 0
+                f.seek(self._offset)
+                data = f.read()
+        except OSError:
+            return []
+
+        end = data.rfind(b'\n') + 1
+        if not end:
+            return []
+        self._offset += end
+        self._first_line = first_line
+        self.updated_at = stat.st_mtime
+        events = []
+        for line in data[:end].splitlines():
+            try:
+                event = json.loads(line.decode('utf-8'))
+            except (UnicodeDecodeError, json.JSONDecodeError):
+                continue
+            apply_event(self.summary, event)
+            events.append(event)
+        return events
+
+    def counts(self):
+        """当前的任务统计：total为本次运行涉及的记录数（含已有结果而跳过的）"""
+        counts = {'total': len(self.summary['tasks']), 'processed': 0, 'skipped': 0, 'error': 0, 'in_flight': 0}
+        for task in self.summary['tasks'].values():
+            state = task.get('state')
+            if state == STATE_DONE:
+                counts['skipped' if task.get('status') == 'skip' else 'processed'] += 1
+            elif state == STATE_FAILED:
+                counts['error'] += 1
+            elif state == STATE_IN_FLIGHT:
+                counts['in_flight'] += 1
+        counts['completed'] = counts['processed'] + counts['skipped'] + counts['error']
+        return counts
+
+    def running(self, stale_seconds):
+        """最后一个运行分段尚未结束，且stale_seconds内仍有写入"""
+        segments = self.summary['segments']
+        return (bool(segments) and 'elapsed_time' not in segments[-1]
+                and time.time() - self.updated_at < stale_seconds)
+
+def summarize_tasks(tasks):
+    """根据任务最终状态统计成功/跳过/失败数量、失败详情和主类别使用次数"""
+    processed, skipped = 0, 0
+    failed_records = []
+    category_stats = {}
+    for answer_hash, task in tasks.items():
+        state, status = task.get('state'), task.get('status')
+        if state == STATE_DONE and status == 'skip':
+            skipped += 1
+        elif state == STATE_DONE:
+            processed += 1
+            category = task.get('category')
+            if category:
+                category_stats[category] = category_stats.get(category, 0) + 1
+        elif state == STATE_FAILED:
+            failed_records.append({
+                'index': task.get('index', ''),
+                'answer_hash': answer_hash,
+                'status': status,
+                'error': status
+            })
+    return processed, skipped, failed_records, category_stats
+
+def summarize_usage(tasks):
+    """汇总所有分段的token用量，返回 (总用量, 按主类别的用量)"""
+    total = new_usage()
+    by_category = {}
+    for task in tasks.values():
+        usage = task.get('usage')
+        if not usage:
+            continue
+        add_usage(total, usage)
+        category = task.get('category')
+        if category:
+            add_usage(by_category.setdefault(category, new_usage()), usage)
+    return total, by_category
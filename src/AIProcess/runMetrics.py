@@ -0,0 +1,208 @@
+import configparser
+import glob
+import json
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock
+
+# 报告和/metrics输出的延迟分位数
+QUANTILES = (0.5, 0.95, 0.99)
+
+# 分析阶段（按处理顺序，报告中按此顺序输出）
+# records_fetch:   从records表读取答题记录
+# aggregation:     按answer_hash聚合
+# existing_check:  查询已有分析结果
+# local_classify:  本地分类器预测（[Classifier]）
+# prompt_build:    加载分类库并构建提示词
+# llm_queue_wait:  等待全局LLM并发预算（仅批量模式）
+# llm:             单次LLM请求耗时（每次重试单独计时）
+# json_parse:      解析LLM返回的JSON
+# taxonomy_update: 更新分类库
+# db_insert:       写入分析结果
+# serialization:   API响应序列化
+# db_query:        API数据库查询
+# data_process / ai_process: API触发的分析子进程
+STAGES = ('records_fetch', 'aggregation', 'preprocess', 'existing_check', 'claim', 'local_classify',
+          'prompt_build', 'llm_queue_wait', 'llm', 'json_parse', 'taxonomy_update', 'db_insert', 'serialization', 'db_query',
+          'data_process', 'ai_process', 'mark_code')
+
+def get_metrics_config(config=None):
+    """从config.ini读取指标配置，可传入已加载的ConfigParser"""
+    if config is None:
+        config = configparser.ConfigParser()
+        config.read('config.ini', encoding='utf-8')
+
+    return {
+        'metrics_dir': config.get('Metrics', 'metrics_dir', fallback='data/metrics'),
+        # 每个阶段保留最近多少个耗时样本用于计算分位数
+        'max_samples': config.getint('Metrics', 'max_samples', fallback=10000)
+    }
+
+def percentile(sorted_values, pct):
+    """计算分位数（输入需已排序）"""
+    if not sorted_values:
+        return 0.0
+    index = min(int(len(sorted_values) * pct), len(sorted_values) - 1)
+    return sorted_values[index]
+
+class MetricsRegistry:
+    """
+    线程安全的阶段耗时和事件计数
+    每个阶段记录次数、总耗时、最大值和最近max_samples个样本（用于分位数）
+    """
+
+    def __init__(self, max_samples=10000):
+        self.max_samples = max_samples
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._stages = {}
+            self._counters = {}
+            self.started_at = time.time()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            entry = self._stages.get(stage)
+            if entry is None:
+                entry = self._stages[stage] = {'count': 0, 'sum': 0.0, 'max': 0.0,
+                                               'samples': deque(maxlen=self.max_samples)}
+            entry['count'] += 1
+            entry['sum'] += seconds
+            entry['max'] = max(entry['max'], seconds)
+            entry['samples'].append(seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def snapshot(self):
+        """当前指标的快照（可JSON序列化）"""
+        with self._lock:
+            stages = {stage: (entry['count'], entry['sum'], entry['max'], sorted(entry['samples']))
+                      for stage, entry in self._stages.items()}
+            counters = dict(self._counters)
+
+        result = {'started_at': self.started_at, 'stages': {}, 'counters': counters}
+        for stage, (count, total, maximum, samples) in stages.items():
+            result['stages'][stage] = {
+                'count': count,
+                'sum': total,
+                'max': maximum,
+                'quantiles': {str(q): percentile(samples, q) for q in QUANTILES}
+            }
+        return result
+
+# 进程内的全局指标
+metrics = MetricsRegistry(get_metrics_config()['max_samples'])
+
+def _ordered_stages(stages):
+    return sorted(stages, key=lambda stage: (STAGES.index(stage) if stage in STAGES else len(STAGES), stage))
+
+def build_metrics_report_lines(snapshot):
+    """生成报告中的阶段耗时和事件计数"""
+    report_lines = ["=== 阶段耗时 ===", ""]
+    if not snapshot['stages']:
+        report_lines.append("无")
+    for stage in _ordered_stages(snapshot['stages']):
+        entry = snapshot['stages'][stage]
+        quantiles = entry['quantiles']
+        report_lines.append(
+            f"  {stage}: 次数={entry['count']} 总计={entry['sum']:.2f}秒 "
+            f"平均={entry['sum'] / entry['count'] * 1000:.1f}ms "
+            f"p50={quantiles['0.5'] * 1000:.1f}ms p95={quantiles['0.95'] * 1000:.1f}ms "
+            f"p99={quantiles['0.99'] * 1000:.1f}ms 最大={entry['max'] * 1000:.1f}ms"
+        )
+    report_lines.append("")
+
+    report_lines.append("=== 事件计数 ===")
+    report_lines.append("")
+    if not snapshot['counters']:
+        report_lines.append("无")
+    for name, value in sorted(snapshot['counters'].items()):
+        report_lines.append(f"  {name}: {value}")
+    report_lines.append("")
+    return report_lines
+
+def save_run_metrics(snapshot, run_name, labels, elapsed_time, metrics_dir=None):
+    """
+    保存一次分析运行的指标，供API /metrics 读取
+    run_name决定文件名（同名运行覆盖上一次），labels为/metrics中区分各运行的标签
+    """
+    metrics_dir = metrics_dir or get_metrics_config()['metrics_dir']
+    os.makedirs(metrics_dir, exist_ok=True)
+    snapshot = dict(snapshot, labels={key: str(value) for key, value in labels.items()},
+                    elapsed_time=elapsed_time, finished_at=time.time())
+    path = os.path.join(metrics_dir, f"run_{run_name}.json")
+    # 先写临时文件再替换，避免API读到写了一半的文件
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(snapshot, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return path
+
+def load_run_metrics(metrics_dir):
+    """读取各题目（及批量运行）最近一次分析运行的指标"""
+    snapshots = []
+    for path in sorted(glob.glob(os.path.join(metrics_dir, 'run_*.json'))):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+def format_prometheus(sources, prefix='ai_clustering'):
+    """
+    按Prometheus文本格式输出指标
+    sources: [(labels, snapshot)]，labels用于区分API进程和各次分析运行
+    """
+    stage_lines, counter_lines, run_lines = [], [], []
+    for labels, snapshot in sources:
+        for stage in _ordered_stages(snapshot['stages']):
+            entry = snapshot['stages'][stage]
+            stage_labels = dict(labels, stage=stage)
+            for q, value in entry['quantiles'].items():
+                stage_lines.append(f"{prefix}_stage_seconds{_format_labels(dict(stage_labels, quantile=q))} {value:.6f}")
+            stage_lines.append(f"{prefix}_stage_seconds_sum{_format_labels(stage_labels)} {entry['sum']:.6f}")
+            stage_lines.append(f"{prefix}_stage_seconds_count{_format_labels(stage_labels)} {entry['count']}")
+        for name, value in sorted(snapshot['counters'].items()):
+            counter_lines.append(f"{prefix}_events_total{_format_labels(dict(labels, event=name))} {value}")
+        if 'elapsed_time' in snapshot:
+            run_lines.append(f"{prefix}_run_elapsed_seconds{_format_labels(labels)} {snapshot['elapsed_time']:.3f}")
+            run_lines.append(f"{prefix}_run_finished_timestamp{_format_labels(labels)} {snapshot['finished_at']:.0f}")
+
+    lines = [
+        f"# HELP {prefix}_stage_seconds 各阶段耗时",
+        f"# TYPE {prefix}_stage_seconds summary",
+        *stage_lines,
+        f"# HELP {prefix}_events_total 重试、限流、缓存命中、跳过等事件计数",
+        f"# TYPE {prefix}_events_total counter",
+        *counter_lines,
+    ]
+    if run_lines:
+        lines.extend([
+            f"# HELP {prefix}_run_elapsed_seconds 最近一次分析运行的总耗时",
+            f"# TYPE {prefix}_run_elapsed_seconds gauge",
+            *[line for line in run_lines if '_run_elapsed_seconds' in line],
+            f"# HELP {prefix}_run_finished_timestamp 最近一次分析运行的结束时间",
+            f"# TYPE {prefix}_run_finished_timestamp gauge",
+            *[line for line in run_lines if '_run_finished_timestamp' in line],
+        ])
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,446 @@
+"""
+表结构版本化迁移
+每张表在 schema_version 中记录已应用的迁移版本，只有版本落后时才执行 SHOW TABLES / DESCRIBE / ALTER；
+迁移完成后版本缓存在进程内，之后的调用不再访问数据库
+API只读取版本，不执行迁移；start_api.py 启动时执行 migrate_all，也可手动执行:
+python src/AIProcess/schemaMigration.py 17787 或 --all
+"""
+
+import sys
+from threading import Lock
+
+SCHEMA_VERSION_TABLE = 'schema_version'
+
+# 等待其他进程完成迁移的命名锁：每次最多等待的秒数和尝试次数
+LOCK_TIMEOUT = 60
+LOCK_ATTEMPTS = 3
+
+class SchemaOutdatedError(RuntimeError):
+    """只读访问（create=False）时表结构版本落后，需要先执行迁移"""
+
+def _table_exists(cursor, table_name):
+    cursor.execute(f"SHOW TABLES LIKE '{table_name}'")
+    return cursor.fetchone() is not None
+
+def _ai_create(conn, table_name):
+    """ai_{term_id} v1: 建表，旧表补齐缺失字段"""
+    cursor = conn.cursor()
+
+    if not _table_exists(cursor, table_name):
+        create_table_sql = f"""
+        CREATE TABLE {table_name} (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            answer_hash VARCHAR(255) NOT NULL,
+            question_id BIGINT NOT NULL,
+            category VARCHAR(255),
+            subcategory VARCHAR(255),
+            thirdCategory VARCHAR(255),
+            specific_reason VARCHAR(300),
+            mark_code LONGTEXT,
+            standard_code LONGTEXT,
+            answer_code LONGTEXT,
+            error_info TEXT,
+            response JSON,
+            user_count INT DEFAULT 0,
+            prompt_tokens INT DEFAULT 0,
+            completion_tokens INT DEFAULT 0,
+            model VARCHAR(100),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE KEY uk_question_answer (question_id, answer_hash),
+            INDEX idx_answer_hash (answer_hash),
+            INDEX idx_question_id (question_id)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+        """
+        cursor.execute(create_table_sql)
+        conn.commit()
+    else:
+        # 检查并添加缺失的字段
+        cursor.execute(f"DESCRIBE {table_name}")
+        columns = [row[0] for row in cursor.fetchall()]
+
+        if 'question_id' not in columns:
+            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN question_id BIGINT NOT NULL")
+            cursor.execute(f"ALTER TABLE {table_name} ADD INDEX idx_question_id (question_id)")
+        if 'category' not in columns:
+            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN category VARCHAR(255)")
+        if 'subcategory' not in columns:
+            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN subcategory VARCHAR(255)")
+        if 'thirdCategory' not in columns:
+            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN thirdCategory VARCHAR(255)")
+        if 'specific_reason' not in columns:
+            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN specific_reason VARCHAR(300)")
+        if 'mark_code' not in columns:
+            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN mark_code LONGTEXT")
+        if 'standard_code' not in columns:
+            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN standard_code LONGTEXT")
+        if 'answer_code' not in columns:
+            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN answer_code LONGTEXT")
+        if 'error_info' not in columns:
+            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN error_info TEXT")
+        if 'response' not in columns:
+            if 'analysis_result' in columns:
+                # 重命名现有的analysis_result列为response
+                cursor.execute(f"ALTER TABLE {table_name} CHANGE COLUMN analysis_result response JSON")
+            else:
+                cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN response JSON")
+        if 'user_count' not in columns:
+            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN user_count INT DEFAULT 0")
+        if 'prompt_tokens' not in columns:
+            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN prompt_tokens INT DEFAULT 0")
+        if 'completion_tokens' not in columns:
+            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN completion_tokens INT DEFAULT 0")
+        if 'model' not in columns:
+            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN model VARCHAR(100)")
+
+        conn.commit()
+
+    cursor.close()
+
+def _ai_unique_key(conn, table_name):
+    """
+    ai_{term_id} v2: 删除 (question_id, answer_hash) 重复的结果（保留最新一条），然后添加唯一键
+    并发或重试的运行曾经可能重复写入，重复行会使分类统计偏大
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"SHOW INDEX FROM {table_name}")
+    if 'uk_question_answer' in {row[2] for row in cursor.fetchall()}:
+        cursor.close()
+        return
+
+    cursor.execute(f"""
+    SELECT COUNT(*), COALESCE(SUM(duplicates), 0) FROM (
+        SELECT COUNT(*) - 1 AS duplicates FROM {table_name}
+        GROUP BY question_id, answer_hash HAVING COUNT(*) > 1
+    ) duplicated
+    """)
+    duplicated_hashes, duplicate_rows = cursor.fetchone()
+    if duplicate_rows:
+        print(f"{table_name}: {duplicated_hashes} 个answer_hash存在重复结果，删除 {int(duplicate_rows)} 条旧记录")
+        cursor.execute(f"""
+        DELETE FROM {table_name} WHERE id NOT IN (
+            SELECT id FROM (
+                SELECT MAX(id) AS id FROM {table_name} GROUP BY question_id, answer_hash
+            ) latest
+        )
+        """)
+    cursor.execute(f"ALTER TABLE {table_name} ADD UNIQUE KEY uk_question_answer (question_id, answer_hash)")
+    conn.commit()
+    cursor.close()
+    print(f"{table_name}: 已添加唯一键 uk_question_answer (question_id, answer_hash)")
+
+def _ai_endpoint_column(conn, table_name):
+    """ai_{term_id} v3: 记录返回结果的LLM端点（[API] endpoints）"""
+    cursor = conn.cursor()
+    cursor.execute(f"DESCRIBE {table_name}")
+    if 'endpoint' not in [row[0] for row in cursor.fetchall()]:
+        cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN endpoint VARCHAR(100)")
+        conn.commit()
+    cursor.close()
+
+def _ai_cascade_column(conn, table_name):
+    """ai_{term_id} v4: 记录模型级联的路由结果（[Cascade]）"""
+    cursor = conn.cursor()
+    cursor.execute(f"DESCRIBE {table_name}")
+    if 'cascade_route' not in [row[0] for row in cursor.fetchall()]:
+        cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN cascade_route VARCHAR(64)")
+        conn.commit()
+    cursor.close()
+
+def _ai_updated_at_column(conn, table_name):
+    """
+    ai_{term_id} v5: 记录每行最后修改时间（毫秒精度），API按 MAX(updated_at) 生成ETag和Last-Modified
+    重新分析或更新作答人数时upsert只修改已有行，行数和created_at都不变
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"DESCRIBE {table_name}")
+    if 'updated_at' not in [row[0] for row in cursor.fetchall()]:
+        cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN updated_at TIMESTAMP(3) NOT NULL "
+                       f"DEFAULT CURRENT_TIMESTAMP(3) ON UPDATE CURRENT_TIMESTAMP(3)")
+        cursor.execute(f"ALTER TABLE {table_name} ADD INDEX idx_question_updated (question_id, updated_at)")
+        conn.commit()
+    cursor.close()
+
+def _category_create(conn, table_name):
+    """reusableCategory_{term_id} v1: 建表"""
+    cursor = conn.cursor()
+
+    if not _table_exists(cursor, table_name):
+        create_table_sql = f"""
+        CREATE TABLE {table_name} (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            question_id BIGINT NOT NULL,
+            category VARCHAR(100) NOT NULL,
+            subcategory VARCHAR(150) NOT NULL,
+            thirdCategory VARCHAR(200) NOT NULL,
+            UNIQUE KEY unique_category (question_id, category(50), subcategory(80), thirdCategory(100)),
+            INDEX idx_question_id (question_id),
+            INDEX idx_category (category),
+            INDEX idx_subcategory (subcategory),
+            INDEX idx_thirdCategory (thirdCategory)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+        """
+        cursor.execute(create_table_sql)
+        conn.commit()
+
+        # 初始化基础分类数据
+        initial_categories = [
+        ]
+
+        insert_sql = f"""
+        INSERT IGNORE INTO {table_name} (question_id, category, subcategory, thirdCategory)
+        VALUES (%s, %s, %s, %s)
+        """
+        cursor.executemany(insert_sql, initial_categories)
+        conn.commit()
+
+    cursor.close()
+
+def _watermark_create(conn, table_name):
+    """analysisWatermark_{term_id} v1: 每个题目记录已分析到的水位"""
+    cursor = conn.cursor()
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {table_name} (
+        question_id BIGINT NOT NULL PRIMARY KEY,
+        watermark_column VARCHAR(64) NOT NULL,
+        watermark VARCHAR(64) NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+    conn.commit()
+    cursor.close()
+
+def _lease_create(conn, table_name):
+    """analysisLease_{term_id} v1: 每个 (question_id, answer_hash) 一行认领状态"""
+    cursor = conn.cursor()
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {table_name} (
+        question_id BIGINT NOT NULL,
+        answer_hash VARCHAR(191) NOT NULL,
+        state VARCHAR(20) NOT NULL,
+        worker_id VARCHAR(191),
+        lease_until DATETIME,
+        attempts INT DEFAULT 1,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        PRIMARY KEY (question_id, answer_hash)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+    conn.commit()
+    cursor.close()
+
+def _sample_create(conn, table_name):
+    """analysisSample_{term_id} v1: 抽样分析的样本，每行记录所在层及层的总体规模"""
+    cursor = conn.cursor()
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {table_name} (
+        question_id BIGINT NOT NULL,
+        answer_hash VARCHAR(191) NOT NULL,
+        stratum VARCHAR(255) NOT NULL,
+        stratum_records INT NOT NULL,
+        stratum_users INT NOT NULL,
+        user_count INT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (question_id, answer_hash)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+    conn.commit()
+    cursor.close()
+
+# 各类表的表名前缀和迁移步骤 [(版本号, 迁移函数)]
+# 迁移函数必须可以重复执行；新增表结构变更时在列表末尾追加新版本，不要修改已发布的步骤
+MIGRATIONS = {
+    'ai': ('ai_', [(1, _ai_create), (2, _ai_unique_key), (3, _ai_endpoint_column),
+                   (4, _ai_cascade_column), (5, _ai_updated_at_column)]),
+    'category': ('reusableCategory_', [(1, _category_create)]),
+    'watermark': ('analysisWatermark_', [(1, _watermark_create)]),
+    'lease': ('analysisLease_', [(1, _lease_create)]),
+    'sample': ('analysisSample_', [(1, _sample_create)]),
+}
+
+# 进程内缓存：已确认为最新版本的表
+_known_versions = {}
+_version_table_ready = False
+# 保护 _table_locks；每张表的迁移使用单独的锁，等待一张表的命名锁时不阻塞其他表
+_migration_lock = Lock()
+_table_locks = {}
+
+def latest_version(kind):
+    return MIGRATIONS[kind][1][-1][0]
+
+def is_current(kind, table_name):
+    """表是否已在本进程中确认为最新版本（不访问数据库）"""
+    return _known_versions.get(table_name) == latest_version(kind)
+
+def _ensure_version_table(conn):
+    global _version_table_ready
+    if _version_table_ready:
+        return
+    cursor = conn.cursor()
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {SCHEMA_VERSION_TABLE} (
+        table_name VARCHAR(191) NOT NULL PRIMARY KEY,
+        kind VARCHAR(32) NOT NULL,
+        version INT NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+    """)
+    conn.commit()
+    cursor.close()
+    _version_table_ready = True
+
+def load_table_version(conn, table_name, create=True):
+    """读取表已应用的迁移版本，没有记录时为0；create=False时不创建 schema_version 表"""
+    global _version_table_ready
+    if create:
+        _ensure_version_table(conn)
+    cursor = conn.cursor()
+    if not create and not _version_table_ready:
+        if not _table_exists(cursor, SCHEMA_VERSION_TABLE):
+            cursor.close()
+            return 0
+        # 表一旦存在就不会再被删除，之后的只读检查不再查询
+        _version_table_ready = True
+    cursor.execute(f"SELECT version FROM {SCHEMA_VERSION_TABLE} WHERE table_name = %s", (table_name,))
+    row = cursor.fetchone()
+    cursor.close()
+    return row[0] if row else 0
+
+def _save_table_version(conn, kind, table_name, version):
+    cursor = conn.cursor()
+    cursor.execute(f"""
+    INSERT INTO {SCHEMA_VERSION_TABLE} (table_name, kind, version) VALUES (%s, %s, %s)
+    ON DUPLICATE KEY UPDATE kind = VALUES(kind), version = VALUES(version)
+    """, (table_name, kind, version))
+    conn.commit()
+    cursor.close()
+
+def _table_lock(table_name):
+    with _migration_lock:
+        return _table_locks.setdefault(table_name, Lock())
+
+def _acquire_named_lock(cursor, lock_name):
+    """获取数据库命名锁，超时（其他进程的迁移仍在进行）时重试，仍未获取到则抛出异常，不在锁外迁移"""
+    for attempt in range(LOCK_ATTEMPTS):
+        cursor.execute("SELECT GET_LOCK(%s, %s)", (lock_name, LOCK_TIMEOUT))
+        acquired = cursor.fetchall()[0][0]
+        if acquired == 1:
+            return
+        print(f"等待迁移锁 {lock_name} 超时（{attempt + 1}/{LOCK_ATTEMPTS}）")
+    raise RuntimeError(f"无法获取迁移锁 {lock_name}，其他进程的迁移可能仍在进行")
+
+def ensure_table(conn, kind, table_name, create=True):
+    """
+    保证表结构为最新版本，返回表是否存在
+    进程内已确认的表直接返回，不执行任何查询；版本落后时在数据库命名锁内执行未应用的迁移，
+    多个进程同时启动时只有一个执行迁移
+    create=False时只读取版本，不执行任何DDL（只读场景，例如API查询结果）：
+    表不存在返回False，版本落后抛出SchemaOutdatedError
+    """
+    if is_current(kind, table_name):
+        return True
+    latest = latest_version(kind)
+
+    version = load_table_version(conn, table_name, create)
+    if version >= latest:
+        _known_versions[table_name] = latest
+        return True
+    if not create:
+        cursor = conn.cursor()
+        exists = version > 0 or _table_exists(cursor, table_name)
+        cursor.close()
+        if not exists:
+            return False
+        raise SchemaOutdatedError(f"表 {table_name} 的结构版本为 v{version}，低于 v{latest}，"
+                                  f"请先执行 python src/AIProcess/schemaMigration.py --all")
+
+    with _table_lock(table_name):
+        # 同一进程的其他线程可能已完成迁移
+        if is_current(kind, table_name):
+            return True
+        lock_name = f"schema_{table_name}"
+        cursor = conn.cursor()
+        try:
+            _acquire_named_lock(cursor, lock_name)
+            try:
+                # 等待锁期间其他进程可能已完成迁移
+                version = load_table_version(conn, table_name)
+                for step_version, migrate in MIGRATIONS[kind][1]:
+                    if step_version > version:
+                        migrate(conn, table_name)
+                        _save_table_version(conn, kind, table_name, step_version)
+                        print(f"表结构迁移: {table_name} -> v{step_version}")
+            finally:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (lock_name,))
+                cursor.fetchall()
+        finally:
+            cursor.close()
+        _known_versions[table_name] = latest
+    return True
+
+def table_name_for(kind, term_id):
+    return f"{MIGRATIONS[kind][0]}{term_id}"
+
+def migrate_term(conn, term_id):
+    """迁移一个学期的所有表（部署时执行）"""
+    for kind in MIGRATIONS:
+        ensure_table(conn, kind, table_name_for(kind, term_id))
+
+def migrate_all(conn):
+    """
+    迁移数据库中所有学期的表（部署或API启动时执行），返回学期列表
+    整个过程持有一个命名锁，多个实例同时启动时依次执行，后执行的只读取到已是最新的版本
+    """
+    lock_name = 'schema_migrate_all'
+    cursor = conn.cursor()
+    try:
+        _acquire_named_lock(cursor, lock_name)
+        try:
+            term_ids = list_terms(conn)
+            for term_id in term_ids:
+                migrate_term(conn, term_id)
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (lock_name,))
+            cursor.fetchall()
+    finally:
+        cursor.close()
+    return term_ids
+
+def list_terms(conn):
+    """从已有的ai_*和reusableCategory_*表名中找出所有学期"""
+    cursor = conn.cursor()
+    terms = set()
+    for prefix in ('ai_', 'reusableCategory_'):
+        cursor.execute(f"SHOW TABLES LIKE '{prefix}%'")
+        for (table_name,) in cursor.fetchall():
+            suffix = table_name[len(prefix):]
+            if suffix.isdigit():
+                terms.add(suffix)
+    cursor.close()
+    return sorted(terms)
+
+def main():
+    import argparse
+    import mysql.connector
+    from dataProcess import get_database_config
+
+    parser = argparse.ArgumentParser(description='执行表结构迁移')
+    parser.add_argument('term_ids', nargs='*', help='要迁移的学期ID')
+    parser.add_argument('--all', action='store_true', help='迁移数据库中所有学期的表')
+    args = parser.parse_args()
+    if not args.term_ids and not args.all:
+        parser.print_help()
+        sys.exit(1)
+
+    conn = mysql.connector.connect(**get_database_config())
+    try:
+        if args.all:
+            term_ids = migrate_all(conn)
+        else:
+            term_ids = args.term_ids
+            for term_id in term_ids:
+                migrate_term(conn, term_id)
+        print(f"表结构迁移完成: {len(term_ids)} 个学期")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
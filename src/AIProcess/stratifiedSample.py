@@ -0,0 +1,222 @@
+"""
+分层抽样分析
+不同answer_hash数以万计的题目完整分析需要数小时。抽样模式先把学生数很多的作答全部放入样本（高频作答层，不需要估计），
+其余作答按报错签名分层，各层按学生数（user_count之和）比例分配样本量，层内随机抽取answer_hash
+（随机种子由题目决定，重复运行得到同一样本，已分析的样本不再调用LLM），只分析样本后按层加权估计各分类覆盖的学生比例及置信区间；之后可继续分析剩余记录，结果完整后不再使用估计值
+"""
+
+import configparser
+import math
+import random
+from statistics import NormalDist
+
+from answerPreprocess import error_signature
+from schemaMigration import ensure_table
+
+# 报错签名为空、以及合并进来的小层
+NO_ERROR_STRATUM = '<无报错>'
+OTHER_STRATUM = '<其他>'
+# 全部进入样本的高频作答
+CERTAINTY_STRATUM = '<高频作答>'
+
+def get_sampling_config():
+    """从config.ini读取抽样分析配置"""
+    config = configparser.ConfigParser()
+    config.read('config.ini', encoding='utf-8')
+
+    return {
+        # 样本量（answer_hash数）
+        'sample_size': config.getint('Sampling', 'sample_size', fallback=400),
+        # 每层至少抽取的数量（层内记录不足时全部抽取），至少2条才能估计层内方差
+        'min_per_stratum': config.getint('Sampling', 'min_per_stratum', fallback=2),
+        # 最多的层数，学生数少的报错签名合并为一层
+        'max_strata': config.getint('Sampling', 'max_strata', fallback=30),
+        # 置信区间的置信水平
+        'confidence': config.getfloat('Sampling', 'confidence', fallback=0.95),
+        # API抽样分析后是否在后台继续分析剩余记录
+        'fill_remaining': config.getboolean('Sampling', 'fill_remaining', fallback=False)
+    }
+
+def create_sample_table(conn, term_id):
+    """创建样本表，每个 (question_id, answer_hash) 一行（表结构由schemaMigration管理）"""
+    table_name = f"analysisSample_{term_id}"
+    ensure_table(conn, 'sample', table_name)
+    return table_name
+
+def assign_strata(df, max_strata):
+    """按报错签名分层，返回与df逐行对应的层名列表；学生数排在max_strata-1名之后的签名合并为OTHER_STRATUM"""
+    if 'error_signature' in df.columns:
+        signatures = df['error_signature'].fillna('').astype(str).tolist()
+    else:
+        signatures = [error_signature(str(info)) for info in df['error_info'].fillna('')]
+    signatures = [signature or NO_ERROR_STRATUM for signature in signatures]
+
+    users = {}
+    for signature, user_count in zip(signatures, df['user_count']):
+        users[signature] = users.get(signature, 0) + int(user_count)
+    if len(users) <= max_strata:
+        return signatures
+    kept = set(sorted(users, key=users.get, reverse=True)[:max(max_strata - 1, 1)])
+    return [signature if signature in kept else OTHER_STRATUM for signature in signatures]
+
+def allocate(strata, sample_size, min_per_stratum):
+    """
+    按学生数比例分配各层样本量 {层: n_h}
+    strata: {层: (记录数N_h, 学生数U_h)}；每层至少min(min_per_stratum, N_h)，不超过N_h
+    """
+    total_users = sum(users for _, users in strata.values()) or 1
+    target = {h: sample_size * users / total_users for h, (_, users) in strata.items()}
+    allocation = {h: min(records, max(min_per_stratum, int(target[h])))
+                  for h, (records, _) in strata.items()}
+    # 取整和上限剩下的名额依次给距离目标最远、仍有记录的层
+    while sum(allocation.values()) < sample_size:
+        open_strata = [h for h, (records, _) in strata.items() if allocation[h] < records]
+        if not open_strata:
+            break
+        h = max(open_strata, key=lambda h: target[h] - allocation[h])
+        allocation[h] += 1
+    return allocation
+
+def select_certainty(units, sample_size):
+    """
+    选出必须全部分析的高频作答：按学生数比例抽样时入样概率达到1的作答（user_count >= 剩余学生数/剩余样本量），
+    最多占样本量的一半。作答人数分布很不均匀时，少数作答决定了大部分学生的分类，随机抽样漏掉它们会使估计偏差很大
+    units: [(answer_hash, user_count)]，返回answer_hash集合
+    """
+    remaining_users = sum(users for _, users in units)
+    remaining_size = sample_size
+    certain = set()
+    for answer_hash, users in sorted(units, key=lambda unit: unit[1], reverse=True):
+        if len(certain) >= sample_size // 2 or users * remaining_size < remaining_users:
+            break
+        certain.add(answer_hash)
+        remaining_users -= users
+        remaining_size -= 1
+    return certain
+
+def draw_sample(df, term_id, question_id, sampling_config, sample_size=None):
+    """
+    从聚合后的作答中抽取分层样本，返回写入样本表的行
+    [{answer_hash, stratum, stratum_records, stratum_users, user_count}]
+    """
+    sample_size = sample_size or sampling_config['sample_size']
+    units = [(answer_hash, int(user_count)) for answer_hash, user_count in zip(df['answer_hash'], df['user_count'])]
+    certain = select_certainty(units, sample_size)
+    by_stratum = {}
+    for stratum, (answer_hash, user_count) in zip(assign_strata(df, sampling_config['max_strata']), units):
+        by_stratum.setdefault(CERTAINTY_STRATUM if answer_hash in certain else stratum, []).append(
+            (answer_hash, user_count))
+    strata = {h: (len(members), sum(users for _, users in members)) for h, members in by_stratum.items()}
+    allocation = allocate({h: size for h, size in strata.items() if h != CERTAINTY_STRATUM},
+                          sample_size - len(certain), sampling_config['min_per_stratum'])
+    if certain:
+        allocation[CERTAINTY_STRATUM] = len(certain)
+
+    rng = random.Random(f"{term_id}:{question_id}")
+    sample_rows = []
+    for h in sorted(by_stratum):
+        records, users = strata[h]
+        for answer_hash, user_count in rng.sample(sorted(by_stratum[h]), allocation[h]):
+            sample_rows.append({'answer_hash': answer_hash, 'stratum': h[:255], 'stratum_records': records,
+                                'stratum_users': users, 'user_count': user_count})
+    return sample_rows
+
+def save_sample(conn, table_name, question_id, sample_rows):
+    """替换题目的样本"""
+    cursor = conn.cursor()
+    cursor.execute(f"DELETE FROM {table_name} WHERE question_id = %s", (question_id,))
+    cursor.executemany(f"""
+    INSERT INTO {table_name} (question_id, answer_hash, stratum, stratum_records, stratum_users, user_count)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    """, [(question_id, row['answer_hash'], row['stratum'], row['stratum_records'], row['stratum_users'],
+           row['user_count']) for row in sample_rows])
+    conn.commit()
+    cursor.close()
+
+def load_sample(conn, table_name, question_id):
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(f"""
+    SELECT answer_hash, stratum, stratum_records, stratum_users, user_count
+    FROM {table_name} WHERE question_id = %s
+    """, (question_id,))
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+def _stratum_variance(units, share, records):
+    """层内比值估计的方差，units为 [(user_count, y)]"""
+    n = len(units)
+    finite_correction = max(1 - n / records, 0.0) if records else 0.0
+    if n < 2:
+        # 只分析了一条时无法估计层内方差，按最大方差保守估计
+        return 0.25 * finite_correction
+    mean_users = sum(users for users, _ in units) / n
+    if not mean_users:
+        return 0.0
+    residual = sum((users * (y - share)) ** 2 for users, y in units) / (n - 1)
+    return finite_correction * residual / (n * mean_users ** 2)
+
+def estimate_shares(sample_rows, categories, confidence=0.95):
+    """
+    按层加权估计各分类覆盖的学生比例
+    sample_rows: 样本表的行；categories: {answer_hash: category}（已分析的结果，可以包含样本以外的记录）
+    样本中尚未分析（失败或仍在进行）的记录视为层内随机缺失；没有任何已分析样本的层不参与估计，其学生比例计入unestimated_user_share
+    """
+    strata = {}
+    for row in sample_rows:
+        stratum = strata.setdefault(row['stratum'], {'records': int(row['stratum_records']),
+                                                     'users': int(row['stratum_users']), 'units': []})
+        category = categories.get(row['answer_hash'])
+        if category is not None:
+            stratum['units'].append((int(row['user_count']), category))
+
+    population_users = sum(stratum['users'] for stratum in strata.values())
+    estimated = {h: stratum for h, stratum in strata.items() if stratum['units']}
+    estimated_users = sum(stratum['users'] for stratum in estimated.values())
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+
+    names = sorted({category for stratum in estimated.values() for _, category in stratum['units']})
+    results = {}
+    for name in names:
+        share = variance = 0.0
+        for stratum in estimated.values():
+            units = [(users, 1.0 if category == name else 0.0) for users, category in stratum['units']]
+            sampled_users = sum(users for users, _ in units)
+            stratum_share = sum(users * y for users, y in units) / sampled_users if sampled_users else 0.0
+            weight = stratum['users'] / estimated_users
+            share += weight * stratum_share
+            variance += weight ** 2 * _stratum_variance(units, stratum_share, stratum['records'])
+        margin = z * math.sqrt(variance)
+        results[name] = {
+            'estimated_share': round(share, 4),
+            'ci_low': round(max(share - margin, 0.0), 4),
+            'ci_high': round(min(share + margin, 1.0), 4)
+        }
+
+    return {
+        'categories': results,
+        'confidence': confidence,
+        'sample_size': len(sample_rows),
+        'analyzed_samples': sum(len(stratum['units']) for stratum in strata.values()),
+        'strata': len(strata),
+        'population_records': sum(stratum['records'] for stratum in strata.values()),
+        'population_users': population_users,
+        'unestimated_user_share': round(1 - estimated_users / population_users, 4) if population_users else 0.0
+    }
+
+def build_sample_report_lines(estimate):
+    """生成报告中的抽样估计"""
+    lines = [
+        "=== 抽样估计 ===",
+        f"样本: {estimate['analyzed_samples']}/{estimate['sample_size']} 条已分析，"
+        f"总体 {estimate['population_records']} 条 / {estimate['population_users']} 人，{estimate['strata']} 层",
+    ]
+    if estimate['unestimated_user_share']:
+        lines.append(f"没有已分析样本的层: 学生占比 {estimate['unestimated_user_share'] * 100:.1f}%")
+    for name, result in sorted(estimate['categories'].items(), key=lambda item: item[1]['estimated_share'],
+                               reverse=True):
+        lines.append(f"  {name}: {result['estimated_share'] * 100:.1f}% "
+                     f"({estimate['confidence'] * 100:.0f}%置信区间 {result['ci_low'] * 100:.1f}%"
+                     f" - {result['ci_high'] * 100:.1f}%)")
+    lines.append("")
+    return lines
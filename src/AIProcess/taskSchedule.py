@@ -0,0 +1,97 @@
+import configparser
+import importlib
+import os
+import time
+
+# 调度优先级函数: 输入聚合后的一行记录，返回值越大越先分析
+def priority_user_count(row):
+    """作答人数多的错误优先（最常见的错误对教学最有价值）"""
+    return int(row.get('user_count', 0) or 0)
+
+def priority_none(row):
+    """不排序，按聚合结果的顺序（answer_hash顺序）分析"""
+    return 0
+
+PRIORITY_FUNCTIONS = {
+    'user_count': priority_user_count,
+    'none': priority_none,
+}
+
+def register_priority(name, func):
+    """注册自定义优先级函数，之后可在 [Schedule] priority 中按名称使用"""
+    PRIORITY_FUNCTIONS[name] = func
+
+def get_priority_function(name):
+    """按名称获取优先级函数，也支持 module:function 形式引用自定义函数"""
+    if name in PRIORITY_FUNCTIONS:
+        return PRIORITY_FUNCTIONS[name]
+    if ':' in name:
+        module_name, func_name = name.split(':', 1)
+        return getattr(importlib.import_module(module_name), func_name)
+    raise ValueError(f"未知的调度优先级: {name}，可选: {', '.join(PRIORITY_FUNCTIONS)} 或 module:function")
+
+def get_schedule_config():
+    """从config.ini读取调度配置"""
+    config = configparser.ConfigParser()
+    config.read('config.ini', encoding='utf-8')
+
+    return {
+        'priority': config.get('Schedule', 'priority', fallback='user_count').strip(),
+        # 分析结果覆盖该比例的学生时发布部分结果报告，0表示不发布
+        'publish_coverage': config.getfloat('Schedule', 'publish_coverage', fallback=0.8),
+        # 时间预算（秒），到达后不再调度新记录，0表示不限制
+        'time_budget': config.getfloat('Schedule', 'time_budget', fallback=0),
+        # 取消文件所在目录：文件存在时正在进行的分析停止调度新记录（API超时或客户端断开时写入）
+        'cancel_dir': config.get('Schedule', 'cancel_dir', fallback='data/cancel'),
+        # 取消后等待进行中的LLM请求的秒数，之后不再等待，直接写报告
+        'cancel_drain': config.getfloat('Schedule', 'cancel_drain', fallback=10.0)
+    }
+
+# 取消原因（取消文件的第一行）
+CANCEL_REASONS = {
+    'deadline': '即将超时',
+    'client_disconnected': '客户端已断开',
+    'cancelled': '收到取消请求',
+    'terminated': '收到终止信号',
+}
+
+def cancel_path(cancel_dir, term_id, question_id):
+    # ID拼接到文件名中，只接受数字，避免写到 cancel_dir 以外
+    for value in (term_id, question_id):
+        if not (str(value).isascii() and str(value).isdigit()):
+            raise ValueError(f"无效的ID: {value!r}")
+    return os.path.join(cancel_dir, f"cancel_{term_id}_{question_id}")
+
+def request_cancel(path, reason):
+    """写入取消文件，内容为取消原因"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f"{reason}\n{time.time():.3f}\n")
+
+def cancel_requested(path):
+    """取消文件存在时返回取消原因，否则返回None"""
+    if path is None:
+        return None
+    try:
+        with open(path, encoding='utf-8') as f:
+            return f.readline().strip() or 'cancelled'
+    except OSError:
+        return None
+
+def clear_cancel(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def order_tasks(job_tasks, priority='user_count'):
+    """
+    按优先级排序任务 [(job, task)]，task[1]为聚合后的一行记录
+    批量模式下所有题目的任务一起排序，优先级相同时保持原顺序
+    """
+    priority_func = get_priority_function(priority)
+    return sorted(job_tasks, key=lambda job_task: priority_func(job_task[1][1]), reverse=True)
+
+def coverage(job):
+    """已有分析结果覆盖的学生比例"""
+    return job['covered_users'] / job['total_users'] if job['total_users'] else 1.0
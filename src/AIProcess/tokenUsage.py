@@ -0,0 +1,125 @@
+import configparser
+from threading import Lock
+
+# 用量字段
+# calls:             LLM请求次数（含重试）
+# prompt_tokens / completion_tokens: API返回的usage
+# prompt_chars:      发送的提示词字符数（系统提示词 + 用户提示词）
+# taxonomy_chars:    系统提示词中动态插入的分类体系字符数
+USAGE_FIELDS = ('calls', 'prompt_tokens', 'completion_tokens', 'prompt_chars', 'taxonomy_chars')
+
+def get_usage_config():
+    """从config.ini读取token计费和预算配置"""
+    config = configparser.ConfigParser()
+    config.read('config.ini', encoding='utf-8')
+
+    on_exceed = config.get('Usage', 'on_exceed', fallback='stop').strip().lower()
+    return {
+        # 每千token价格，用于估算费用
+        'prompt_price_per_1k': config.getfloat('Usage', 'prompt_price_per_1k', fallback=0.0),
+        'completion_price_per_1k': config.getfloat('Usage', 'completion_price_per_1k', fallback=0.0),
+        'currency': config.get('Usage', 'currency', fallback='CNY'),
+        # 单次运行的预算，0表示不限制
+        'max_tokens_per_run': config.getint('Usage', 'max_tokens_per_run', fallback=0),
+        'max_cost_per_run': config.getfloat('Usage', 'max_cost_per_run', fallback=0.0),
+        # 超出预算后: stop 不再调用LLM，剩余记录记为失败（可用--retry-failed补跑）；
+        #             degrade 改用degrade_model继续分析（未配置degrade_model时等同stop）
+        'on_exceed': on_exceed if on_exceed in ('stop', 'degrade') else 'stop',
+        'degrade_model': config.get('Usage', 'degrade_model', fallback='').strip()
+    }
+
+def new_usage():
+    return {field: 0 for field in USAGE_FIELDS}
+
+def add_usage(total, usage):
+    for field in USAGE_FIELDS:
+        total[field] = total.get(field, 0) + int(usage.get(field) or 0)
+    return total
+
+def usage_cost(usage, usage_config):
+    """按配置的单价估算费用"""
+    return (usage.get('prompt_tokens', 0) / 1000 * usage_config['prompt_price_per_1k']
+            + usage.get('completion_tokens', 0) / 1000 * usage_config['completion_price_per_1k'])
+
+class RunBudget:
+    """
+    单次运行的token/费用预算（多线程共享）
+    每次调用LLM前通过api_config_for_call决定是否继续调用、使用哪个模型
+    """
+
+    def __init__(self, usage_config):
+        self.config = usage_config
+        self.usage = new_usage()
+        self.exceeded = False
+        self._lock = Lock()
+
+    @property
+    def limited(self):
+        return self.config['max_tokens_per_run'] > 0 or self.config['max_cost_per_run'] > 0
+
+    def record(self, usage):
+        with self._lock:
+            add_usage(self.usage, usage)
+            if self.exceeded or not self.limited:
+                return
+            total_tokens = self.usage['prompt_tokens'] + self.usage['completion_tokens']
+            cost = usage_cost(self.usage, self.config)
+            if ((self.config['max_tokens_per_run'] > 0 and total_tokens >= self.config['max_tokens_per_run'])
+                    or (self.config['max_cost_per_run'] > 0 and cost >= self.config['max_cost_per_run'])):
+                self.exceeded = True
+                action = (f"改用 {self.config['degrade_model']} 继续分析" if self.degrading
+                          else "停止调用LLM，剩余记录可使用 --retry-failed 补跑")
+                print(f"⚠️ 已超出本次运行预算 (tokens={total_tokens}, 费用={cost:.4f} {self.config['currency']})，{action}")
+
+    @property
+    def degrading(self):
+        return self.config['on_exceed'] == 'degrade' and bool(self.config['degrade_model'])
+
+    def api_config_for_call(self, api_config):
+        """返回本次调用使用的api_config，超出预算且不降级时返回None"""
+        if not self.exceeded:
+            return api_config
+        if self.degrading:
+            return dict(api_config, model=self.config['degrade_model'], force_model=True)
+        return None
+
+def build_usage_report_lines(usage, usage_config, by_category=None, budget=None):
+    """生成报告中的token用量统计"""
+    total_tokens = usage['prompt_tokens'] + usage['completion_tokens']
+    report_lines = [
+        "=== Token用量 ===",
+        "",
+        f"LLM请求: {usage['calls']}次",
+        f"输入tokens: {usage['prompt_tokens']}",
+        f"输出tokens: {usage['completion_tokens']}",
+        f"合计tokens: {total_tokens}",
+    ]
+    if usage['calls']:
+        report_lines.append(f"平均每次请求: 输入 {usage['prompt_tokens'] / usage['calls']:.0f} / "
+                            f"输出 {usage['completion_tokens'] / usage['calls']:.0f} tokens")
+    if usage['prompt_chars']:
+        share = usage['taxonomy_chars'] / usage['prompt_chars']
+        report_lines.append(f"分类体系占提示词: {share * 100:.1f}% "
+                            f"(约 {usage['prompt_tokens'] * share:.0f} 输入tokens)")
+    if usage_config['prompt_price_per_1k'] or usage_config['completion_price_per_1k']:
+        report_lines.append(f"估算费用: {usage_cost(usage, usage_config):.4f} {usage_config['currency']}")
+    if budget is not None and budget.limited:
+        limits = []
+        if usage_config['max_tokens_per_run'] > 0:
+            limits.append(f"{usage_config['max_tokens_per_run']} tokens")
+        if usage_config['max_cost_per_run'] > 0:
+            limits.append(f"{usage_config['max_cost_per_run']} {usage_config['currency']}")
+        state = '已超出' if budget.exceeded else '未超出'
+        report_lines.append(f"运行预算: {' / '.join(limits)}（{state}，超出后{usage_config['on_exceed']}）")
+    report_lines.append("")
+
+    if by_category:
+        report_lines.append("按主类别统计:")
+        for category, category_usage in sorted(by_category.items(),
+                                               key=lambda item: -(item[1]['prompt_tokens'] + item[1]['completion_tokens'])):
+            report_lines.append(
+                f"  {category}: 请求={category_usage['calls']} 输入={category_usage['prompt_tokens']} "
+                f"输出={category_usage['completion_tokens']}"
+            )
+        report_lines.append("")
+    return report_lines
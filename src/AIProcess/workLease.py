@@ -0,0 +1,81 @@
+"""
+多个分析进程（可在不同机器上）协同处理同一学期/题目时的任务认领
+每个answer_hash调用LLM前先在租约表中认领，认领成功的进程才会分析；
+进程崩溃时租约到期后由其他进程重新认领
+"""
+
+import configparser
+import os
+import socket
+
+from schemaMigration import ensure_table
+
+# 租约状态
+LEASE_CLAIMED = 'claimed'
+LEASE_PENDING = 'pending'
+LEASE_DONE = 'done'
+
+def get_worker_config():
+    """从config.ini读取多进程协同配置"""
+    config = configparser.ConfigParser()
+    config.read('config.ini', encoding='utf-8')
+
+    return {
+        'enabled': config.getboolean('Worker', 'enabled', fallback=False),
+        # 每个进程的唯一标识，默认 主机名:进程号
+        'worker_id': config.get('Worker', 'worker_id', fallback='').strip() or f"{socket.gethostname()}:{os.getpid()}",
+        # 租约时长（秒），应大于单条记录最长的处理时间（含LLM重试）
+        'lease_seconds': config.getint('Worker', 'lease_seconds', fallback=600)
+    }
+
+def create_lease_table(conn, term_id):
+    """创建租约表，每个 (question_id, answer_hash) 一行（表结构由schemaMigration管理）"""
+    table_name = f"analysisLease_{term_id}"
+    ensure_table(conn, 'lease', table_name)
+    return table_name
+
+def claim_answer(conn, lease, question_id, answer_hash):
+    """
+    认领一条记录，成功返回True
+    新记录直接插入认领行；已有记录只有在待处理或租约已过期时才能被原子地改为本进程认领
+    时间统一使用数据库的NOW()，不依赖各机器的时钟
+    """
+    table_name, worker_id, lease_seconds = lease['table'], lease['worker_id'], lease['lease_seconds']
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+        INSERT IGNORE INTO {table_name} (question_id, answer_hash, state, worker_id, lease_until)
+        VALUES (%s, %s, %s, %s, DATE_ADD(NOW(), INTERVAL %s SECOND))
+        """, (question_id, answer_hash, LEASE_CLAIMED, worker_id, lease_seconds))
+        claimed = cursor.rowcount == 1
+        if not claimed:
+            cursor.execute(f"""
+            UPDATE {table_name}
+            SET state = %s, worker_id = %s, lease_until = DATE_ADD(NOW(), INTERVAL %s SECOND), attempts = attempts + 1
+            WHERE question_id = %s AND answer_hash = %s
+              AND (state = %s OR (state = %s AND lease_until < NOW()))
+            """, (LEASE_CLAIMED, worker_id, lease_seconds, question_id, answer_hash, LEASE_PENDING, LEASE_CLAIMED))
+            claimed = cursor.rowcount == 1
+        conn.commit()
+        return claimed
+    finally:
+        cursor.close()
+
+def _finish_claim(conn, lease, question_id, answer_hash, state):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+        UPDATE {lease['table']} SET state = %s, lease_until = NULL
+        WHERE question_id = %s AND answer_hash = %s AND worker_id = %s AND state = %s
+        """, (state, question_id, answer_hash, lease['worker_id'], LEASE_CLAIMED))
+        conn.commit()
+    finally:
+        cursor.close()
+
+def complete_claim(conn, lease, question_id, answer_hash):
+    """结果写入后标记完成"""
+    _finish_claim(conn, lease, question_id, answer_hash, LEASE_DONE)
+
+def release_claim(conn, lease, question_id, answer_hash):
+    """处理失败时释放认领，其他进程或之后的重试可以重新认领"""
+    _finish_claim(conn, lease, question_id, answer_hash, LEASE_PENDING)
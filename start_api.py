@@ -2,21 +2,170 @@
 # -*- coding: utf-8 -*-
 """
 启动API服务脚本
+用法:
+  python start_api.py                                 # 开发模式（Flask内置服务器）
+  python start_api.py --prod                          # 生产模式（多进程/多线程WSGI服务器）
+  python start_api.py --prod --workers 4 --threads 8  # 指定worker进程数和每个进程的线程数
+启动前执行表结构迁移（API本身只读取表结构版本，不执行DDL），--no-migrate 跳过
 """
 
+import argparse
+import configparser
+import multiprocessing
 import os
 import sys
 
-def main():
-    """启动API服务"""
-    print("正在启动AI错误分析系统API服务...")
-    
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+API_PATH = os.path.join(PROJECT_ROOT, 'api')
+
+def load_server_config():
+    """从config.ini读取[Server]配置"""
+    config = configparser.ConfigParser()
+    config.read(os.path.join(PROJECT_ROOT, 'config.ini'), encoding='utf-8')
+
+    analysis_timeout = config.getint('API', 'analysis_timeout', fallback=600)
+    return {
+        'host': config.get('Server', 'host', fallback='0.0.0.0'),
+        'port': config.getint('Server', 'port', fallback=5000),
+        'workers': config.getint('Server', 'workers', fallback=min(multiprocessing.cpu_count() * 2 + 1, 8)),
+        'threads': config.getint('Server', 'threads', fallback=8),
+        # 聚类分析接口会同步等待分析子进程，worker超时必须大于analysis_timeout
+        'timeout': config.getint('Server', 'worker_timeout', fallback=analysis_timeout * 2 + 60),
+        'graceful_timeout': config.getint('Server', 'graceful_timeout', fallback=30),
+        'preload': config.getboolean('Server', 'preload', fallback=True),
+        'db_pool_size': config.getint('Server', 'db_pool_size', fallback=8),
+    }
+
+def run_migrations():
+    """启动服务前（gunicorn fork worker之前）迁移所有学期的表，见schemaMigration.migrate_all"""
+    sys.path.insert(0, os.path.join(PROJECT_ROOT, 'src', 'AIProcess'))
+    os.chdir(PROJECT_ROOT)
+    import mysql.connector
+    from dataProcess import get_database_config
+    from schemaMigration import migrate_all
+
+    try:
+        conn = mysql.connector.connect(**get_database_config())
+    except mysql.connector.Error as e:
+        print(f"警告: 无法连接数据库，跳过表结构迁移（{e}），版本落后的表查询时返回503")
+        return
+    try:
+        term_ids = migrate_all(conn)
+        print(f"表结构迁移完成: {len(term_ids)} 个学期")
+    finally:
+        conn.close()
+
+def run_dev_server():
+    """开发模式：Flask内置服务器，带调试和自动重载"""
     # 切换到api目录并启动服务
-    api_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api')
-    os.chdir(api_path)
-    
+    os.chdir(API_PATH)
+
     # 启动Flask应用
     os.system('python app.py')
 
+def run_gunicorn(server_config):
+    """使用gunicorn启动（Linux/macOS）：多进程 + 每进程多线程"""
+    from gunicorn.app.base import BaseApplication
+
+    class APIApplication(BaseApplication):
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from app import app
+            return app
+
+    options = {
+        'bind': f"{server_config['host']}:{server_config['port']}",
+        'workers': server_config['workers'],
+        'threads': server_config['threads'],
+        'worker_class': 'gthread',
+        'timeout': server_config['timeout'],
+        'graceful_timeout': server_config['graceful_timeout'],
+        # preload: 主进程加载一次应用后fork，各worker在首次查询时创建自己的数据库连接池
+        'preload_app': server_config['preload'],
+        'accesslog': '-',
+    }
+    APIApplication(options).run()
+
+def run_waitress(server_config):
+    """使用waitress启动（Windows或未安装gunicorn时）：单进程多线程"""
+    from waitress import serve
+    from app import app
+
+    serve(
+        app,
+        host=server_config['host'],
+        port=server_config['port'],
+        threads=server_config['threads'],
+        channel_timeout=server_config['timeout']
+    )
+
+def run_prod_server(server_config):
+    """生产模式：优先gunicorn，其次waitress"""
+    # 每个进程的连接池至少要容纳该进程的所有线程
+    if server_config['db_pool_size'] < server_config['threads']:
+        print(f"提示: db_pool_size({server_config['db_pool_size']}) 小于 threads({server_config['threads']})，"
+              f"高并发时请求会等待空闲连接")
+
+    sys.path.insert(0, API_PATH)
+    os.chdir(PROJECT_ROOT)
+
+    if os.name != 'nt':
+        try:
+            import gunicorn  # noqa: F401
+            print(f"生产模式(gunicorn): {server_config['workers']} 个worker进程 x {server_config['threads']} 线程, "
+                  f"监听 {server_config['host']}:{server_config['port']}")
+            run_gunicorn(server_config)
+            return
+        except ImportError:
+            print("未安装gunicorn，尝试使用waitress")
+
+    try:
+        import waitress  # noqa: F401
+    except ImportError:
+        print("生产模式需要安装 gunicorn（Linux/macOS）或 waitress（Windows）:")
+        print("  pip install gunicorn  或  pip install waitress")
+        sys.exit(1)
+
+    print(f"生产模式(waitress): 单进程 x {server_config['threads']} 线程, "
+          f"监听 {server_config['host']}:{server_config['port']}")
+    run_waitress(server_config)
+
+def main():
+    """启动API服务"""
+    parser = argparse.ArgumentParser(description='启动AI错误分析系统API服务')
+    parser.add_argument('--prod', action='store_true', help='生产模式，使用多进程/多线程WSGI服务器')
+    parser.add_argument('--host', help='监听地址，默认读取config.ini [Server] host')
+    parser.add_argument('--port', type=int, help='监听端口，默认读取config.ini [Server] port')
+    parser.add_argument('--workers', type=int, help='worker进程数（仅gunicorn）')
+    parser.add_argument('--threads', type=int, help='每个worker进程的线程数')
+    parser.add_argument('--no-preload', action='store_true', help='不在主进程预加载应用')
+    parser.add_argument('--no-migrate', action='store_true', help='启动前不执行表结构迁移')
+    args = parser.parse_args()
+
+    print("正在启动AI错误分析系统API服务...")
+    if not args.no_migrate:
+        run_migrations()
+
+    if not args.prod:
+        run_dev_server()
+        return
+
+    server_config = load_server_config()
+    for key in ('host', 'port', 'workers', 'threads'):
+        value = getattr(args, key)
+        if value is not None:
+            server_config[key] = value
+    if args.no_preload:
+        server_config['preload'] = False
+
+    run_prod_server(server_config)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,205 @@
+"""circuitBreaker：熔断器的状态转换和暂停等待"""
+
+import io
+import os
+import sys
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'AIProcess'))
+
+from circuitBreaker import STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN, CircuitBreaker
+
+class FakeClock:
+    """替换circuitBreaker中的time模块，sleep直接推进时间"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+def breaker_config(**overrides):
+    config = {'enabled': True, 'window': 4, 'min_requests': 4, 'failure_rate': 0.5,
+              'open_seconds': 30.0, 'probe_requests': 1, 'pause_seconds': 300.0}
+    config.update(overrides)
+    return config
+
+class BreakerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        for patcher in (mock.patch('circuitBreaker.time', self.clock),
+                        mock.patch('sys.stdout', new_callable=io.StringIO)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def open_breaker(self, breaker):
+        for _ in range(breaker.config['min_requests']):
+            breaker.record(True)
+        self.assertEqual(breaker.state, STATE_OPEN)
+
+class CircuitBreakerTest(BreakerTestCase):
+
+    def test_stays_closed_below_min_requests(self):
+        breaker = CircuitBreaker(breaker_config())
+        for _ in range(3):
+            breaker.record(True)
+        self.assertEqual(breaker.state, STATE_CLOSED)
+        self.assertTrue(breaker.allow())
+
+    def test_opens_at_failure_rate(self):
+        breaker = CircuitBreaker(breaker_config())
+        for failed in (False, True, False, True):
+            breaker.record(failed)
+        self.assertEqual(breaker.state, STATE_OPEN)
+        self.assertTrue(breaker.is_open())
+        self.assertFalse(breaker.allow())
+
+    def test_below_failure_rate_stays_closed(self):
+        breaker = CircuitBreaker(breaker_config())
+        for failed in (False, False, False, True, False):
+            breaker.record(failed)
+        self.assertEqual(breaker.state, STATE_CLOSED)
+
+    def test_inconclusive_results_are_not_counted(self):
+        breaker = CircuitBreaker(breaker_config())
+        for _ in range(10):
+            breaker.record(None)
+        breaker.record(True)
+        self.assertEqual(breaker.state, STATE_CLOSED)
+
+    def test_half_open_allows_probe_requests(self):
+        breaker = CircuitBreaker(breaker_config(probe_requests=2))
+        self.open_breaker(breaker)
+        self.clock.now += 29
+        self.assertFalse(breaker.allow())
+        self.clock.now += 1
+        self.assertFalse(breaker.is_open())
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.state, STATE_HALF_OPEN)
+
+    def test_probe_success_closes(self):
+        breaker = CircuitBreaker(breaker_config())
+        self.open_breaker(breaker)
+        self.clock.now += 30
+        self.assertTrue(breaker.allow())
+        breaker.record(False)
+        self.assertEqual(breaker.state, STATE_CLOSED)
+        # 恢复后重新统计失败率
+        for _ in range(3):
+            breaker.record(True)
+        self.assertEqual(breaker.state, STATE_CLOSED)
+
+    def test_probe_failure_reopens(self):
+        breaker = CircuitBreaker(breaker_config())
+        self.open_breaker(breaker)
+        self.clock.now += 30
+        self.assertTrue(breaker.allow())
+        breaker.record(True)
+        self.assertEqual(breaker.state, STATE_OPEN)
+        self.assertFalse(breaker.allow())
+        self.clock.now += 30
+        self.assertTrue(breaker.allow())
+
+    def test_inconclusive_probe_returns_its_slot(self):
+        breaker = CircuitBreaker(breaker_config())
+        self.open_breaker(breaker)
+        self.clock.now += 30
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record(None)
+        self.assertEqual(breaker.state, STATE_HALF_OPEN)
+        self.assertTrue(breaker.allow())
+
+    def test_unrecorded_probe_slot_is_reclaimed(self):
+        breaker = CircuitBreaker(breaker_config())
+        self.open_breaker(breaker)
+        self.clock.now += 30
+        self.assertTrue(breaker.allow())
+        self.clock.now += 29
+        self.assertFalse(breaker.allow())
+        self.clock.now += 1
+        self.assertTrue(breaker.allow())
+
+    def test_results_while_open_are_ignored(self):
+        breaker = CircuitBreaker(breaker_config())
+        self.open_breaker(breaker)
+        breaker.record(False)
+        self.assertEqual(breaker.state, STATE_OPEN)
+
+    def test_disabled(self):
+        breaker = CircuitBreaker(breaker_config(enabled=False))
+        for _ in range(10):
+            breaker.record(True)
+        self.assertEqual(breaker.state, STATE_CLOSED)
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.wait_ready())
+
+class WaitReadyTest(BreakerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.breaker = CircuitBreaker(breaker_config(pause_seconds=100.0))
+        self.open_breaker(self.breaker)
+
+    def test_closed_returns_immediately(self):
+        breaker = CircuitBreaker(breaker_config())
+        self.assertTrue(breaker.wait_ready())
+        self.assertEqual(self.clock.now, 1000.0)
+
+    def test_waits_until_half_open(self):
+        self.assertTrue(self.breaker.wait_ready())
+        self.assertEqual(self.clock.now, 1030.0)
+        self.assertEqual(self.breaker.state, STATE_HALF_OPEN)
+        # 等待不占用探测名额
+        self.assertTrue(self.breaker.allow())
+
+    def test_waits_while_probe_in_flight(self):
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.wait_ready(deadline=self.clock.now + 5))
+        self.breaker.record(False)
+        self.assertTrue(self.breaker.wait_ready())
+
+    def test_deadline(self):
+        self.assertFalse(self.breaker.wait_ready(deadline=1010.0))
+        self.assertEqual(self.clock.now, 1010.0)
+
+    def test_cancel(self):
+        cancel_event = threading.Event()
+        cancel_event.set()
+        self.assertFalse(self.breaker.wait_ready(cancel_event=cancel_event))
+
+    def test_pause_counts_from_first_open(self):
+        # 探测失败重新打开时不重新计算暂停时间
+        for _ in range(3):
+            self.assertTrue(self.breaker.wait_ready())
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record(True)
+        self.assertEqual(self.clock.now, 1090.0)
+        self.assertFalse(self.breaker.wait_ready())
+        self.assertEqual(self.clock.now, 1100.0)
+
+    def test_pause_restarts_after_recovery(self):
+        self.assertTrue(self.breaker.wait_ready())
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record(False)
+        self.clock.now += 500
+        self.open_breaker(self.breaker)
+        self.assertTrue(self.breaker.wait_ready())
+
+    def test_no_pause(self):
+        breaker = CircuitBreaker(breaker_config(pause_seconds=0))
+        self.open_breaker(breaker)
+        self.assertFalse(breaker.wait_ready())
+        self.assertEqual(self.clock.now, 1000.0)
+
+if __name__ == '__main__':
+    unittest.main()
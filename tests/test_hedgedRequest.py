@@ -0,0 +1,126 @@
+"""hedgedRequest：对冲等待时间、对冲预算和结果选择"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'AIProcess'))
+
+from hedgedRequest import Hedger
+
+class FakeResponse:
+
+    def __init__(self, status_code, name):
+        self.status_code = status_code
+        self.name = name
+
+class FakeSend:
+    """按调用顺序返回预设的结果：(耗时秒数, 状态码或异常)"""
+
+    def __init__(self, *behaviours):
+        self.behaviours = list(behaviours)
+        self.timeouts = []
+        self._lock = threading.Lock()
+
+    def __call__(self, timeout):
+        with self._lock:
+            call = len(self.timeouts)
+            self.timeouts.append(timeout)
+        seconds, result = self.behaviours[call]
+        time.sleep(seconds)
+        if isinstance(result, Exception):
+            raise result
+        return FakeResponse(result, f"call{call}")
+
+def hedge_config(**overrides):
+    config = {'enabled': True, 'percentile': 0.95, 'min_delay': 0.01, 'min_samples': 5, 'initial_delay': 0.05,
+              'max_ratio': 1.0, 'window': 100}
+    config.update(overrides)
+    return config
+
+class HedgeDelayTest(unittest.TestCase):
+
+    def test_initial_delay_until_enough_samples(self):
+        hedger = Hedger(hedge_config(initial_delay=7.0))
+        for seconds in (1.0, 2.0, 3.0, 4.0):
+            hedger.record_latency(seconds)
+        self.assertEqual(hedger.hedge_delay(), 7.0)
+
+    def test_percentile_of_recent_samples(self):
+        hedger = Hedger(hedge_config(window=20))
+        for seconds in [100.0] * 5 + [float(i) for i in range(1, 21)]:
+            hedger.record_latency(seconds)
+        self.assertEqual(hedger.hedge_delay(), 20.0)
+
+    def test_min_delay(self):
+        hedger = Hedger(hedge_config(min_delay=0.5))
+        for _ in range(10):
+            hedger.record_latency(0.1)
+        self.assertEqual(hedger.hedge_delay(), 0.5)
+
+class HedgerPostTest(unittest.TestCase):
+
+    def test_disabled(self):
+        send = FakeSend((0.1, 200))
+        response = Hedger(hedge_config(enabled=False)).post(send, 5.0)
+        self.assertEqual(response.name, 'call0')
+        self.assertEqual(send.timeouts, [5.0])
+
+    def test_fast_request_is_not_hedged(self):
+        hedger = Hedger(hedge_config())
+        send = FakeSend((0.0, 200))
+        self.assertEqual(hedger.post(send, 5.0).name, 'call0')
+        self.assertEqual(len(send.timeouts), 1)
+
+    def test_slow_request_is_hedged(self):
+        hedger = Hedger(hedge_config())
+        discarded = threading.Event()
+        send = FakeSend((0.5, 200), (0.0, 200))
+        response = hedger.post(send, 5.0, on_discard=lambda response: discarded.set())
+        self.assertEqual(response.name, 'call1')
+        # 对冲请求的超时扣除已经等待的时间
+        self.assertLess(send.timeouts[1], 5.0)
+        # 被丢弃的请求之后成功返回时仍然计费
+        self.assertTrue(discarded.wait(2.0))
+
+    def test_primary_wins_after_hedge_is_sent(self):
+        hedger = Hedger(hedge_config())
+        send = FakeSend((0.2, 200), (1.0, 200))
+        self.assertEqual(hedger.post(send, 5.0).name, 'call0')
+
+    def test_failed_hedge_does_not_replace_primary(self):
+        hedger = Hedger(hedge_config())
+        send = FakeSend((0.2, 200), (0.0, 500))
+        self.assertEqual(hedger.post(send, 5.0).name, 'call0')
+
+    def test_both_failed_returns_primary(self):
+        hedger = Hedger(hedge_config())
+        send = FakeSend((0.2, 500), (0.0, 503))
+        response = hedger.post(send, 5.0)
+        self.assertEqual((response.name, response.status_code), ('call0', 500))
+
+    def test_both_failed_raises_primary_exception(self):
+        hedger = Hedger(hedge_config())
+        send = FakeSend((0.2, TimeoutError('primary')), (0.0, 500))
+        with self.assertRaisesRegex(TimeoutError, 'primary'):
+            hedger.post(send, 5.0)
+
+    def test_hedge_budget(self):
+        hedger = Hedger(hedge_config(max_ratio=0.5))
+        send = FakeSend((0.2, 200), (0.2, 200), (0.0, 200), (0.2, 200))
+        # 对冲数 + 1 不超过 普通请求数 × 0.5：第1次不对冲，第2次对冲，第3次预算又用完
+        self.assertEqual(hedger.post(send, 5.0).name, 'call0')
+        self.assertEqual(hedger.post(send, 5.0).name, 'call2')
+        self.assertEqual(hedger.post(send, 5.0).name, 'call3')
+        self.assertEqual(len(send.timeouts), 4)
+
+    def test_delay_not_shorter_than_timeout(self):
+        hedger = Hedger(hedge_config(initial_delay=1.0))
+        send = FakeSend((0.1, 200))
+        self.assertEqual(hedger.post(send, 1.0).name, 'call0')
+        self.assertEqual(len(send.timeouts), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+"""llmRouter：端点选择、并发上限、暂停和等待中止"""
+
+import io
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'AIProcess'))
+
+from llmRouter import AcquireAborted, LLMRouter
+
+def endpoint(name, weight=1.0, max_concurrency=0):
+    return {'name': name, 'api_url': f"http://{name}", 'api_key': name, 'model': 'model', 'weight': weight,
+            'max_concurrency': max_concurrency}
+
+def router_config(**overrides):
+    config = {'strategy': 'least_outstanding', 'eject_failures': 2, 'eject_seconds': 30.0}
+    config.update(overrides)
+    return config
+
+class LLMRouterTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('sys.stdout', new_callable=io.StringIO)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_least_outstanding_by_weight(self):
+        router = LLMRouter([endpoint('a', weight=2.0), endpoint('b')], router_config())
+        names = [router.acquire()['name'] for _ in range(6)]
+        self.assertEqual(names.count('a'), 4)
+        self.assertEqual(names.count('b'), 2)
+
+    def test_latency_strategy(self):
+        router = LLMRouter([endpoint('slow'), endpoint('fast')], router_config(strategy='latency'))
+        slow, fast = router.acquire(), router.acquire()
+        self.assertEqual((slow['name'], fast['name']), ('slow', 'fast'))
+        router.release(slow, 2.0)
+        router.release(fast, 0.2)
+        self.assertEqual([router.acquire()['name'] for _ in range(3)], ['fast', 'fast', 'fast'])
+
+    def test_failing_endpoint_is_ejected(self):
+        router = LLMRouter([endpoint('a'), endpoint('b')], router_config())
+        for _ in range(2):
+            selected = router.acquire()
+            self.assertEqual(selected['name'], 'a')
+            router.release(selected, failed=True)
+        self.assertEqual({router.acquire()['name'] for _ in range(3)}, {'b'})
+
+    def test_all_ejected_still_selects(self):
+        router = LLMRouter([endpoint('a')], router_config(eject_failures=1))
+        router.release(router.acquire(), failed=True)
+        self.assertEqual(router.acquire()['name'], 'a')
+
+    def test_waits_for_free_slot(self):
+        router = LLMRouter([endpoint('a', max_concurrency=1)], router_config())
+        held = router.acquire()
+        threading.Timer(0.1, router.release, args=(held, 0.1)).start()
+        start = time.time()
+        self.assertEqual(router.acquire(deadline=time.time() + 5)['name'], 'a')
+        self.assertGreaterEqual(time.time() - start, 0.05)
+
+    def test_wait_stops_at_deadline(self):
+        router = LLMRouter([endpoint('a', max_concurrency=1)], router_config())
+        router.acquire()
+        start = time.time()
+        with self.assertRaises(AcquireAborted) as context:
+            router.acquire(deadline=time.time() + 0.1)
+        self.assertEqual(context.exception.status, 'deadline_exceeded')
+        self.assertLess(time.time() - start, 1.0)
+
+    def test_wait_stops_on_cancel(self):
+        router = LLMRouter([endpoint('a', max_concurrency=1)], router_config())
+        router.acquire()
+        cancel_event = threading.Event()
+        cancel_event.set()
+        with self.assertRaises(AcquireAborted) as context:
+            router.acquire(cancel_event=cancel_event)
+        self.assertEqual(context.exception.status, 'cancelled')
+
+    def test_free_slot_ignores_passed_deadline(self):
+        router = LLMRouter([endpoint('a', max_concurrency=1)], router_config())
+        self.assertEqual(router.acquire(deadline=time.time() - 1)['name'], 'a')
+
+if __name__ == '__main__':
+    unittest.main()
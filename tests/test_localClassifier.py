@@ -0,0 +1,144 @@
+"""localClassifier：TF-IDF近邻分类的训练、预测和模型加载"""
+
+import io
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'AIProcess'))
+
+import localClassifier
+from localClassifier import (MODEL_VERSION, LocalClassifier, evaluate, extract_features, load_classifier,
+                             model_path, save_model, train)
+
+INDEX_ERROR = 'IndexError: list index out of range'
+ZERO_DIVISION = 'ZeroDivisionError: division by zero'
+
+def classifier_config(**overrides):
+    config = {'enabled': True, 'model_dir': 'data/models', 'scope': 'question', 'k': 3, 'min_confidence': 0.8,
+              'min_similarity': 0.5, 'min_samples': 1, 'max_samples': 100}
+    config.update(overrides)
+    return config
+
+def row(answer_code, error_info, label, reason, question_id='1'):
+    return {'question_id': question_id, 'answer_code': answer_code, 'error_info': error_info,
+            'category': label[0], 'subcategory': label[1], 'thirdCategory': label[2], 'specific_reason': reason}
+
+INDEX_LABEL = ('运行错误', '越界访问', '列表下标越界')
+ZERO_LABEL = ('运行错误', '算术错误', '除数为零')
+
+TRAINING_ROWS = [
+    row('a = [1, 2]\nprint(a[2])', INDEX_ERROR, INDEX_LABEL, '下标2超出长度为2的列表'),
+    row('b = [1, 2, 3]\nfor i in range(4):\n    print(b[i])', INDEX_ERROR, INDEX_LABEL, '循环次数比列表长度多一次'),
+    row('c = [0]\nprint(c[1])', INDEX_ERROR, INDEX_LABEL, '下标1超出长度为1的列表'),
+    row('x = 1 / 0\nprint(x)', ZERO_DIVISION, ZERO_LABEL, '除数为常量0'),
+    row('n = 0\nprint(10 / n)', ZERO_DIVISION, ZERO_LABEL, '除数变量为0'),
+    row('y = 5 / 0', ZERO_DIVISION, ZERO_LABEL, '除数为常量0'),
+]
+
+class FeaturesTest(unittest.TestCase):
+
+    def test_tokens_bigrams_and_error_signature(self):
+        features = extract_features('x = 1', 'File "main.py", line 3\nNameError')
+        self.assertEqual(features['x'], 1)
+        self.assertEqual(features['x ='], 1)
+        self.assertTrue(any(term.startswith('E:') for term in features))
+        self.assertNotIn('Q:7', features)
+        self.assertEqual(extract_features('x = 1', None, question_id=7)['Q:7'], 1)
+
+    def test_formatting_and_comments_are_ignored(self):
+        self.assertEqual(extract_features('x=1  # 注释', ''), extract_features('x = 1', None))
+
+    def test_model_path(self):
+        self.assertEqual(os.path.basename(model_path('models', 12)), 'classifier_q12.json.gz')
+        self.assertEqual(os.path.basename(model_path('models')), 'classifier_global.json.gz')
+
+class PredictTest(unittest.TestCase):
+
+    def setUp(self):
+        self.model = train(TRAINING_ROWS)
+        self.classifier = LocalClassifier(self.model, classifier_config())
+
+    def test_model(self):
+        self.assertEqual(self.model['version'], MODEL_VERSION)
+        self.assertEqual(self.model['labels'], [list(INDEX_LABEL), list(ZERO_LABEL)])
+        self.assertEqual(len(self.model['vectors']), len(TRAINING_ROWS))
+
+    def test_predicts_label_of_similar_answers(self):
+        prediction, confidence, similarity = self.classifier.predict('z = 7 / 0\nprint(z)', ZERO_DIVISION)
+        self.assertEqual((prediction['category'], prediction['subcategory'], prediction['thirdCategory']),
+                         ZERO_LABEL)
+        self.assertEqual(confidence, 1.0)
+        self.assertTrue(0 < similarity <= 1.0)
+
+    def test_reason_from_nearest_neighbour_of_winning_label(self):
+        prediction, _, similarity = self.classifier.predict(TRAINING_ROWS[1]['answer_code'], INDEX_ERROR)
+        self.assertEqual(prediction['specific_reason'], '循环次数比列表长度多一次')
+        self.assertAlmostEqual(similarity, 1.0, places=3)
+
+    def test_votes_are_weighted_by_similarity(self):
+        # k=5时近邻中包含另一个分类的作答，得票比例低于1
+        classifier = LocalClassifier(self.model, classifier_config(k=5))
+        prediction, confidence, _ = classifier.predict('a = [1, 2]\nprint(a[2] / 0)', INDEX_ERROR)
+        self.assertEqual(prediction['thirdCategory'], INDEX_LABEL[2])
+        self.assertTrue(0.5 < confidence < 1.0)
+
+    def test_no_similar_answers(self):
+        self.assertEqual(self.classifier.predict('完全不同', 'SyntaxError'), (None, 0.0, 0.0))
+
+    def test_accept(self):
+        self.assertTrue(self.classifier.accept(0.8, 0.5))
+        self.assertFalse(self.classifier.accept(0.79, 0.9))
+        self.assertFalse(self.classifier.accept(1.0, 0.49))
+
+    def test_include_question(self):
+        rows = [dict(training_row, question_id=str(index % 2)) for index, training_row in enumerate(TRAINING_ROWS)]
+        model = train(rows, include_question=True)
+        self.assertTrue(model['include_question'])
+        self.assertIn('Q:0', model['idf'])
+
+    def test_evaluate(self):
+        holdout, coverage, accuracy = evaluate(TRAINING_ROWS * 3, classifier_config(min_confidence=0.5,
+                                                                                     min_similarity=0.1))
+        self.assertEqual(holdout, 3)
+        self.assertEqual(coverage, 1.0)
+        self.assertEqual(accuracy, 1.0)
+
+class LoadClassifierTest(unittest.TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.config = classifier_config(model_dir=os.path.join(temp_dir.name, 'models'))
+        patcher = mock.patch.dict(localClassifier._models, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_round_trip_and_cache(self):
+        self.assertIsNone(load_classifier('1', self.config))
+        save_model(train(TRAINING_ROWS), model_path(self.config['model_dir'], '1'))
+        classifier = load_classifier('1', self.config)
+        self.assertIsInstance(classifier, LocalClassifier)
+        self.assertIs(load_classifier('1', self.config), classifier)
+        self.assertIsNone(load_classifier('2', self.config))
+
+    def test_global_scope(self):
+        config = dict(self.config, scope='global')
+        save_model(train(TRAINING_ROWS, include_question=True), model_path(config['model_dir']))
+        self.assertIs(load_classifier('1', config), load_classifier('2', config))
+        self.assertIsNotNone(load_classifier('1', config))
+
+    def test_disabled(self):
+        save_model(train(TRAINING_ROWS), model_path(self.config['model_dir'], '1'))
+        self.assertIsNone(load_classifier('1', dict(self.config, enabled=False)))
+
+    def test_old_model_version(self):
+        model = dict(train(TRAINING_ROWS), version=MODEL_VERSION - 1)
+        save_model(model, model_path(self.config['model_dir'], '1'))
+        with mock.patch('sys.stdout', new_callable=io.StringIO):
+            self.assertIsNone(load_classifier('1', self.config))
+
+if __name__ == '__main__':
+    unittest.main()
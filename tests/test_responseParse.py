@@ -0,0 +1,108 @@
+"""responseParse：LLM响应的提取、修复和必需字段检查"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'AIProcess'))
+
+from responseParse import (CLASSIFY_FIELDS, build_response_format, extract_json_object, parse_json_content,
+                           repair_json, validate_response)
+
+FULL_RESPONSE = {
+    'category': '逻辑错误',
+    'subcategory': '循环错误',
+    'thirdCategory': '循环边界错误',
+    'specific_reason': '循环少执行一次',
+    'mark_code': 'for i in range(n - 1):'
+}
+
+class ParseJsonContentTest(unittest.TestCase):
+
+    def test_direct(self):
+        self.assertEqual(parse_json_content('{"category": "逻辑错误"}'), ({'category': '逻辑错误'}, 'direct'))
+
+    def test_code_fence(self):
+        content = '```json\n{"category": "逻辑错误"}\n```'
+        self.assertEqual(parse_json_content(content), ({'category': '逻辑错误'}, 'extracted'))
+
+    def test_surrounding_text(self):
+        content = '分析结果如下：\n{"category": "逻辑错误", "mark_code": "if (a) { b(); }"}\n以上。'
+        value, parsed_by = parse_json_content(content)
+        self.assertEqual(parsed_by, 'extracted')
+        self.assertEqual(value['mark_code'], 'if (a) { b(); }')
+
+    def test_code_fence_inside_field_is_not_the_response(self):
+        content = '说明 {"mark_code": "```python\\nprint(1)\\n```"}'
+        value, parsed_by = parse_json_content(content)
+        self.assertEqual(parsed_by, 'extracted')
+        self.assertEqual(value['mark_code'], '```python\nprint(1)\n```')
+
+    def test_trailing_comma_and_raw_newline(self):
+        content = '{"category": "逻辑错误", "mark_code": "a = 1\nb = 2",}'
+        value, parsed_by = parse_json_content(content)
+        self.assertEqual(parsed_by, 'repaired')
+        self.assertEqual(value, {'category': '逻辑错误', 'mark_code': 'a = 1\nb = 2'})
+
+    def test_python_literal(self):
+        value, parsed_by = parse_json_content("{'category': '逻辑错误', 'ok': True}")
+        self.assertEqual(parsed_by, 'repaired')
+        self.assertEqual(value, {'category': '逻辑错误', 'ok': True})
+
+    def test_repair_disabled(self):
+        with self.assertRaises(ValueError):
+            parse_json_content('{"category": "逻辑错误",}', repair=False)
+
+    def test_truncated_output_is_not_completed(self):
+        with self.assertRaisesRegex(ValueError, '截断'):
+            parse_json_content('{"category": "逻辑错误", "mark_code": "for i in')
+
+    def test_no_object(self):
+        for content in ('', None, '无法分析', '[1, 2]'):
+            with self.assertRaises(ValueError):
+                parse_json_content(content)
+
+class RepairJsonTest(unittest.TestCase):
+
+    def test_extract_skips_braces_in_strings(self):
+        self.assertEqual(extract_json_object('x {"a": "}"} y'), '{"a": "}"}')
+        self.assertIsNone(extract_json_object('no object'))
+
+    def test_nested_trailing_commas(self):
+        self.assertEqual(repair_json('{"a": [1, 2, ], "b": {"c": 1,},}'), '{"a": [1, 2], "b": {"c": 1}}')
+
+    def test_unclosed_bracket(self):
+        with self.assertRaises(ValueError):
+            repair_json('{"a": [1, 2')
+
+class ValidateResponseTest(unittest.TestCase):
+
+    def test_complete(self):
+        self.assertEqual(validate_response(dict(FULL_RESPONSE)), [])
+
+    def test_missing_and_blank_fields(self):
+        response = dict(FULL_RESPONSE, specific_reason='  ')
+        del response['mark_code']
+        self.assertEqual(validate_response(response), ['specific_reason', 'mark_code'])
+
+    def test_classify_fields_do_not_need_mark_code(self):
+        response = dict(FULL_RESPONSE)
+        del response['mark_code']
+        self.assertEqual(validate_response(response, CLASSIFY_FIELDS), [])
+
+    def test_non_string_values_are_converted(self):
+        response = dict(FULL_RESPONSE, specific_reason=['a', 'b'], mark_code=0)
+        self.assertEqual(validate_response(response), [])
+        self.assertEqual(response['specific_reason'], '["a", "b"]')
+        self.assertEqual(response['mark_code'], '0')
+
+class BuildResponseFormatTest(unittest.TestCase):
+
+    def test_formats(self):
+        self.assertIsNone(build_response_format('none'))
+        self.assertEqual(build_response_format('json_object'), {'type': 'json_object'})
+        schema = build_response_format('json_schema', CLASSIFY_FIELDS)['json_schema']['schema']
+        self.assertEqual(schema['required'], list(CLASSIFY_FIELDS))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+"""runJournal：运行日志的写入、回放和增量读取"""
+
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'AIProcess'))
+
+from runJournal import (STATE_DONE, STATE_FAILED, STATE_IN_FLIGHT, STATE_QUEUED, JournalTail, RunJournal,
+                        apply_event, journal_path, new_summary, summarize_tasks, summarize_usage)
+
+def usage(calls, prompt_tokens):
+    return {'calls': calls, 'prompt_tokens': prompt_tokens, 'completion_tokens': 0, 'prompt_chars': 0,
+            'taxonomy_chars': 0}
+
+class ApplyEventTest(unittest.TestCase):
+
+    def setUp(self):
+        self.summary = new_summary()
+
+    def apply(self, *events):
+        for event in events:
+            apply_event(self.summary, event)
+
+    def test_task_keeps_last_state_and_earlier_fields(self):
+        self.apply({'event': 'task', 'hash': 'a', 'state': STATE_QUEUED, 'index': 3},
+                   {'event': 'task', 'hash': 'a', 'state': STATE_IN_FLIGHT},
+                   {'event': 'task', 'hash': 'a', 'state': STATE_DONE, 'status': 'success', 'category': '逻辑错误'})
+        self.assertEqual(self.summary['tasks']['a'],
+                         {'state': STATE_DONE, 'index': 3, 'status': 'success', 'category': '逻辑错误'})
+
+    def test_usage_accumulates_across_events(self):
+        self.apply({'event': 'task', 'hash': 'a', 'state': STATE_FAILED, 'status': 'api_call_failed',
+                    'usage': usage(3, 100)},
+                   {'event': 'task', 'hash': 'a', 'state': STATE_DONE, 'status': 'success', 'usage': usage(1, 40)})
+        task = self.summary['tasks']['a']
+        self.assertEqual(task['state'], STATE_DONE)
+        self.assertEqual((task['usage']['calls'], task['usage']['prompt_tokens']), (4, 140))
+
+    def test_skipped(self):
+        self.apply({'event': 'task', 'hash': 'a', 'state': STATE_FAILED, 'status': 'api_call_failed'},
+                   {'event': 'skipped', 'hashes': ['a', 'b']})
+        self.assertEqual(self.summary['tasks'], {'a': {'state': STATE_DONE, 'status': 'skip'},
+                                                 'b': {'state': STATE_DONE, 'status': 'skip'}})
+
+    def test_category_updates(self):
+        self.apply({'event': 'category_update', 'kind': 'new_subcategories', 'item': {'name': 'x'}},
+                   {'event': 'category_update', 'kind': 'similar_rejections', 'item': {'name': 'y'}})
+        self.assertEqual(self.summary['new_subcategories'], [{'name': 'x'}])
+        self.assertEqual(self.summary['similar_rejections'], [{'name': 'y'}])
+
+    def test_segments(self):
+        self.apply({'event': 'segment_end', 'elapsed_time': 1.0, 'processed': 1, 'skipped': 0, 'error': 0},
+                   {'event': 'segment_start', 'mode': 'new', 'total': 5, 'ts': 100.0},
+                   {'event': 'segment_end', 'elapsed_time': 2.5, 'processed': 3, 'skipped': 1, 'error': 1},
+                   {'event': 'segment_start', 'mode': 'resume', 'total': 1, 'ts': 200.0})
+        self.assertEqual(self.summary['segments'], [
+            {'mode': 'new', 'total': 5, 'started_at': 100.0, 'elapsed_time': 2.5, 'processed': 3, 'skipped': 1,
+             'error': 1},
+            {'mode': 'resume', 'total': 1, 'started_at': 200.0}
+        ])
+
+    def test_unknown_event_is_ignored(self):
+        self.apply({'event': 'something_new', 'hash': 'a'})
+        self.assertEqual(self.summary, new_summary())
+
+class JournalTestCase(unittest.TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.journal_dir = os.path.join(temp_dir.name, 'journal')
+        self.path = journal_path(self.journal_dir, 2024, 15)
+
+    def write_run(self, resume=False):
+        journal = RunJournal(self.path).open(resume=resume)
+        self.addCleanup(journal.close)
+        journal.start_segment('resume' if resume else 'new', 3)
+        journal.log_skipped(['s'])
+        journal.log_task('a', STATE_DONE, index=0, status='success', category='逻辑错误', usage=usage(1, 50))
+        journal.log_task('b', STATE_FAILED, index=1, status='api_call_failed', usage=usage(0, 0))
+        journal.log_task('c', STATE_QUEUED, index=2, status='deadline_exceeded')
+        journal.end_segment(1.5, 1, 1, 1)
+        journal.close()
+        return journal
+
+class RunJournalTest(JournalTestCase):
+
+    def test_round_trip(self):
+        summary = self.write_run().load()
+        self.assertEqual(set(summary['tasks']), {'s', 'a', 'b', 'c'})
+        self.assertNotIn('usage', summary['tasks']['b'])
+        processed, skipped, failed_records, category_stats = summarize_tasks(summary['tasks'])
+        self.assertEqual((processed, skipped, category_stats), (1, 1, {'逻辑错误': 1}))
+        self.assertEqual(failed_records, [{'index': 1, 'answer_hash': 'b', 'status': 'api_call_failed',
+                                           'error': 'api_call_failed'}])
+        total, by_category = summarize_usage(summary['tasks'])
+        self.assertEqual(total['prompt_tokens'], 50)
+        self.assertEqual(by_category['逻辑错误']['calls'], 1)
+
+    def test_resume_appends_and_new_run_truncates(self):
+        self.write_run()
+        self.assertEqual(len(self.write_run(resume=True).load()['segments']), 2)
+        self.assertEqual(len(self.write_run().load()['segments']), 1)
+
+    def test_truncated_last_line_is_skipped(self):
+        journal = self.write_run()
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write('{"event": "task", "hash": "d", "sta')
+        self.assertNotIn('d', journal.load()['tasks'])
+
+    def test_missing_file(self):
+        self.assertEqual(RunJournal(self.path).load(), new_summary())
+
+    def test_journal_path_rejects_non_digit_ids(self):
+        self.assertEqual(os.path.basename(self.path), 'journal_2024_15.jsonl')
+        for term_id, question_id in (('..', '1'), ('1', '1.jsonl'), ('1', '')):
+            with self.assertRaises(ValueError):
+                journal_path(self.journal_dir, term_id, question_id)
+
+class JournalTailTest(JournalTestCase):
+
+    def test_poll_reads_only_new_complete_lines(self):
+        journal = RunJournal(self.path).open()
+        self.addCleanup(journal.close)
+        tail = JournalTail(self.path)
+        self.assertEqual(tail.poll(), [])
+        journal.start_segment('new', 2)
+        journal.log_task('a', STATE_IN_FLIGHT, index=0)
+        self.assertEqual([event['event'] for event in tail.poll()], ['segment_start', 'task'])
+        self.assertTrue(tail.running(stale_seconds=60))
+        self.assertEqual(tail.counts()['in_flight'], 1)
+
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write('{"event": "task", "hash": "a", ')
+        self.assertEqual(tail.poll(), [])
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write('"state": "done", "status": "success"}\n')
+        self.assertEqual(len(tail.poll()), 1)
+        self.assertEqual(tail.counts(), {'total': 1, 'processed': 1, 'skipped': 0, 'error': 0, 'in_flight': 0,
+                                         'completed': 1})
+
+        journal.end_segment(1.0, 1, 0, 0)
+        tail.poll()
+        self.assertFalse(tail.running(stale_seconds=60))
+
+    def test_stale_journal_is_not_running(self):
+        journal = RunJournal(self.path).open()
+        self.addCleanup(journal.close)
+        journal.start_segment('new', 1)
+        journal.close()
+        past = time.time() - 600
+        os.utime(self.path, (past, past))
+        tail = JournalTail(self.path)
+        tail.poll()
+        self.assertFalse(tail.running(stale_seconds=120))
+
+    def test_new_run_replays_from_start(self):
+        self.write_run()
+        tail = JournalTail(self.path)
+        tail.poll()
+        self.assertEqual(len(tail.summary['tasks']), 4)
+        journal = RunJournal(self.path).open()
+        self.addCleanup(journal.close)
+        journal.start_segment('new', 1)
+        # 新日志比旧日志长，只能通过第一行的变化发现重写
+        for index, answer_hash in enumerate('vwxyz'):
+            journal.log_task(answer_hash, STATE_DONE, index=index, status='success')
+        journal.close()
+        tail.poll()
+        self.assertEqual(set(tail.summary['tasks']), set('vwxyz'))
+        self.assertEqual(len(tail.summary['segments']), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+"""stratifiedSample：分层样本量分配、高频作答、抽样和分类比例估计"""
+
+import os
+import sys
+import unittest
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'AIProcess'))
+
+from stratifiedSample import (CERTAINTY_STRATUM, NO_ERROR_STRATUM, OTHER_STRATUM, allocate, assign_strata,
+                              draw_sample, estimate_shares, select_certainty)
+
+SAMPLING_CONFIG = {'sample_size': 20, 'min_per_stratum': 2, 'max_strata': 3}
+
+def sample_row(answer_hash, stratum, stratum_records, stratum_users, user_count):
+    return {'answer_hash': answer_hash, 'stratum': stratum, 'stratum_records': stratum_records,
+            'stratum_users': stratum_users, 'user_count': user_count}
+
+class AllocateTest(unittest.TestCase):
+
+    def test_proportional_to_users(self):
+        strata = {'a': (100, 600), 'b': (100, 300), 'c': (100, 100)}
+        self.assertEqual(allocate(strata, 20, 2), {'a': 12, 'b': 6, 'c': 2})
+
+    def test_min_per_stratum(self):
+        # 小层至少抽min_per_stratum条，总数可以超过样本量
+        self.assertEqual(allocate({'a': (100, 990), 'b': (100, 10)}, 10, 3), {'a': 9, 'b': 3})
+
+    def test_min_per_stratum_capped_by_records(self):
+        self.assertEqual(allocate({'a': (100, 990), 'b': (1, 10)}, 10, 3), {'a': 9, 'b': 1})
+
+    def test_capped_stratum_leftover_goes_to_open_strata(self):
+        self.assertEqual(allocate({'a': (2, 900), 'b': (50, 100)}, 10, 1), {'a': 2, 'b': 8})
+
+    def test_fewer_records_than_sample_size(self):
+        self.assertEqual(allocate({'a': (3, 10), 'b': (2, 10)}, 10, 2), {'a': 3, 'b': 2})
+
+    def test_rounding_remainder_is_assigned(self):
+        allocation = allocate({'a': (100, 1), 'b': (100, 1), 'c': (100, 1)}, 10, 0)
+        self.assertEqual(sum(allocation.values()), 10)
+        self.assertEqual(sorted(allocation.values()), [3, 3, 4])
+
+    def test_no_users(self):
+        self.assertEqual(allocate({'a': (5, 0), 'b': (5, 0)}, 4, 2), {'a': 2, 'b': 2})
+
+class SelectCertaintyTest(unittest.TestCase):
+
+    def test_dominant_answer(self):
+        units = [('a', 500)] + [(f"u{i}", 10) for i in range(10)]
+        self.assertEqual(select_certainty(units, 4), {'a'})
+
+    def test_even_distribution(self):
+        self.assertEqual(select_certainty([(f"u{i}", 100) for i in range(5)], 4), set())
+
+    def test_at_most_half_of_sample(self):
+        units = [('a', 1000), ('b', 1000), ('c', 1000), ('d', 1)]
+        self.assertEqual(select_certainty(units, 4), {'a', 'b'})
+
+class AssignStrataTest(unittest.TestCase):
+
+    def test_small_signatures_are_merged(self):
+        df = pd.DataFrame({
+            'error_signature': ['E1', 'E2', 'E3', None, 'E3', 'E4'],
+            'user_count': [50, 5, 30, 40, 30, 1]
+        })
+        # 学生数前 max_strata - 1 名（E3 60人、E1 50人）保留，其余（包括无报错的40人）合并
+        self.assertEqual(assign_strata(df, 3),
+                         ['E1', OTHER_STRATUM, 'E3', OTHER_STRATUM, 'E3', OTHER_STRATUM])
+        self.assertEqual(assign_strata(df, 5), ['E1', 'E2', 'E3', NO_ERROR_STRATUM, 'E3', 'E4'])
+
+    def test_signature_from_error_info(self):
+        df = pd.DataFrame({
+            'error_info': ['File "a.py", line 3\nNameError', None, 'File "b.py", line 9\nNameError'],
+            'user_count': [1, 1, 1]
+        })
+        strata = assign_strata(df, 10)
+        self.assertEqual(strata[0], strata[2])
+        self.assertEqual(strata[1], NO_ERROR_STRATUM)
+
+class DrawSampleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.DataFrame({
+            'answer_hash': [f"h{i:02d}" for i in range(40)],
+            'error_signature': ['E1'] * 20 + ['E2'] * 15 + [''] * 5,
+            'user_count': [400] + [10] * 39
+        })
+
+    def test_sample(self):
+        rows = draw_sample(self.df, 1, 2, SAMPLING_CONFIG)
+        hashes = [row['answer_hash'] for row in rows]
+        self.assertEqual(len(hashes), len(set(hashes)))
+        self.assertGreaterEqual(len(rows), SAMPLING_CONFIG['sample_size'])
+        by_stratum = {}
+        for row in rows:
+            by_stratum.setdefault(row['stratum'], []).append(row)
+        self.assertEqual([row['answer_hash'] for row in by_stratum[CERTAINTY_STRATUM]], ['h00'])
+        self.assertEqual(by_stratum[CERTAINTY_STRATUM][0]['stratum_users'], 400)
+        self.assertEqual(by_stratum['E1'][0]['stratum_records'], 19)
+        self.assertEqual(by_stratum[NO_ERROR_STRATUM][0]['stratum_users'], 50)
+        self.assertGreaterEqual(len(by_stratum[NO_ERROR_STRATUM]), SAMPLING_CONFIG['min_per_stratum'])
+
+    def test_same_question_gives_same_sample(self):
+        self.assertEqual(draw_sample(self.df, 1, 2, SAMPLING_CONFIG), draw_sample(self.df, 1, 2, SAMPLING_CONFIG))
+        self.assertNotEqual(draw_sample(self.df, 1, 2, SAMPLING_CONFIG), draw_sample(self.df, 1, 3, SAMPLING_CONFIG))
+
+    def test_sample_size_argument(self):
+        rows = draw_sample(self.df, 1, 2, SAMPLING_CONFIG, sample_size=40)
+        self.assertEqual(sorted(row['answer_hash'] for row in rows), sorted(self.df['answer_hash']))
+
+class EstimateSharesTest(unittest.TestCase):
+
+    def test_complete_stratum_has_no_sampling_error(self):
+        rows = [sample_row('a', 'E1', 2, 30, 10), sample_row('b', 'E1', 2, 30, 20)]
+        estimate = estimate_shares(rows, {'a': '逻辑错误', 'b': '语法错误'})
+        self.assertEqual(estimate['categories'], {
+            '逻辑错误': {'estimated_share': 0.3333, 'ci_low': 0.3333, 'ci_high': 0.3333},
+            '语法错误': {'estimated_share': 0.6667, 'ci_low': 0.6667, 'ci_high': 0.6667}
+        })
+        self.assertEqual((estimate['sample_size'], estimate['analyzed_samples'], estimate['strata']), (2, 2, 1))
+
+    def test_strata_weighted_by_users(self):
+        rows = [sample_row('a', 'E1', 1, 80, 80), sample_row('b', 'E2', 1, 20, 20)]
+        estimate = estimate_shares(rows, {'a': '逻辑错误', 'b': '语法错误'})
+        self.assertEqual(estimate['categories']['逻辑错误']['estimated_share'], 0.8)
+        self.assertEqual(estimate['categories']['语法错误']['estimated_share'], 0.2)
+
+    def test_confidence_interval(self):
+        rows = [sample_row(f"h{i}", 'E1', 100, 1000, 10) for i in range(10)]
+        categories = {f"h{i}": '逻辑错误' if i < 4 else '语法错误' for i in range(10)}
+        result = estimate_shares(rows, categories)['categories']['逻辑错误']
+        self.assertEqual(result['estimated_share'], 0.4)
+        self.assertLess(result['ci_low'], 0.4)
+        self.assertGreater(result['ci_high'], 0.4)
+        wider = estimate_shares(rows, categories, confidence=0.99)['categories']['逻辑错误']
+        self.assertLess(wider['ci_low'], result['ci_low'])
+        self.assertGreater(wider['ci_high'], result['ci_high'])
+
+    def test_single_sample_uses_maximum_variance(self):
+        rows = [sample_row('a', 'E1', 100, 1000, 10)]
+        result = estimate_shares(rows, {'a': '逻辑错误'})['categories']['逻辑错误']
+        # 方差按 0.25 × (1 - 1/100) 估计，上限截断到1
+        self.assertEqual(result['estimated_share'], 1.0)
+        self.assertAlmostEqual(result['ci_low'], 1 - 1.96 * (0.25 * 0.99) ** 0.5, places=3)
+        self.assertEqual(result['ci_high'], 1.0)
+
+    def test_unanalyzed_samples_and_strata(self):
+        rows = [sample_row('a', 'E1', 2, 60, 30), sample_row('b', 'E1', 2, 60, 30),
+                sample_row('c', 'E2', 1, 40, 40)]
+        estimate = estimate_shares(rows, {'a': '逻辑错误', 'other': '语法错误'})
+        self.assertEqual(estimate['categories']['逻辑错误']['estimated_share'], 1.0)
+        self.assertEqual(estimate['analyzed_samples'], 1)
+        self.assertEqual(estimate['population_users'], 100)
+        self.assertEqual(estimate['unestimated_user_share'], 0.4)
+
+    def test_empty_sample(self):
+        estimate = estimate_shares([], {})
+        self.assertEqual(estimate['categories'], {})
+        self.assertEqual(estimate['unestimated_user_share'], 0.0)
+
+if __name__ == '__main__':
+    unittest.main()
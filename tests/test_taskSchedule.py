@@ -0,0 +1,103 @@
+"""taskSchedule：任务优先级排序、取消文件和覆盖率"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'AIProcess'))
+
+from taskSchedule import (PRIORITY_FUNCTIONS, cancel_path, cancel_requested, clear_cancel, coverage, order_tasks,
+                          register_priority, request_cancel)
+
+def priority_short_code(row):
+    """测试用的自定义优先级：代码越短越先分析"""
+    return -len(row.get('answer_code', ''))
+
+def make_tasks(job, user_counts):
+    return [(job, (index, {'answer_hash': f"{job}-{index}", 'user_count': count}))
+            for index, count in enumerate(user_counts)]
+
+def hashes(job_tasks):
+    return [task[1]['answer_hash'] for _, task in job_tasks]
+
+class OrderTasksTest(unittest.TestCase):
+
+    def test_user_count_descending(self):
+        ordered = order_tasks(make_tasks('q1', [3, 10, 1, 7]))
+        self.assertEqual(hashes(ordered), ['q1-1', 'q1-3', 'q1-0', 'q1-2'])
+
+    def test_jobs_are_ordered_together(self):
+        ordered = order_tasks(make_tasks('q1', [5, 1]) + make_tasks('q2', [8, 2]))
+        self.assertEqual(hashes(ordered), ['q2-0', 'q1-0', 'q2-1', 'q1-1'])
+        self.assertEqual([job for job, _ in ordered], ['q2', 'q1', 'q2', 'q1'])
+
+    def test_ties_keep_original_order(self):
+        ordered = order_tasks(make_tasks('q1', [2, 5, 2, 5, 2]))
+        self.assertEqual(hashes(ordered), ['q1-1', 'q1-3', 'q1-0', 'q1-2', 'q1-4'])
+
+    def test_missing_or_string_user_count(self):
+        job_tasks = [('q1', (0, {'answer_hash': 'a'})), ('q1', (1, {'answer_hash': 'b', 'user_count': '12'})),
+                     ('q1', (2, {'answer_hash': 'c', 'user_count': None}))]
+        self.assertEqual(hashes(order_tasks(job_tasks)), ['b', 'a', 'c'])
+
+    def test_none_keeps_order(self):
+        job_tasks = make_tasks('q1', [1, 9, 4])
+        self.assertEqual(order_tasks(job_tasks, 'none'), job_tasks)
+
+    def test_registered_priority(self):
+        register_priority('test_short_code', priority_short_code)
+        self.addCleanup(PRIORITY_FUNCTIONS.pop, 'test_short_code')
+        job_tasks = [('q1', (0, {'answer_hash': 'long', 'answer_code': 'x = 1\ny = 2'})),
+                     ('q1', (1, {'answer_hash': 'short', 'answer_code': 'x'}))]
+        self.assertEqual(hashes(order_tasks(job_tasks, 'test_short_code')), ['short', 'long'])
+
+    def test_module_function_priority(self):
+        job_tasks = [('q1', (0, {'answer_hash': 'long', 'answer_code': 'abc'})),
+                     ('q1', (1, {'answer_hash': 'short', 'answer_code': 'a'}))]
+        ordered = order_tasks(job_tasks, f"{__name__}:priority_short_code")
+        self.assertEqual(hashes(ordered), ['short', 'long'])
+
+    def test_unknown_priority(self):
+        with self.assertRaises(ValueError):
+            order_tasks(make_tasks('q1', [1]), 'no_such_priority')
+
+class CancelFileTest(unittest.TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.cancel_dir = os.path.join(temp_dir.name, 'cancel')
+
+    def test_round_trip(self):
+        path = cancel_path(self.cancel_dir, 2024, '15')
+        self.assertEqual(os.path.basename(path), 'cancel_2024_15')
+        self.assertIsNone(cancel_requested(path))
+        request_cancel(path, 'client_disconnected')
+        self.assertEqual(cancel_requested(path), 'client_disconnected')
+        clear_cancel(path)
+        self.assertIsNone(cancel_requested(path))
+        clear_cancel(path)
+
+    def test_empty_file_means_cancelled(self):
+        path = cancel_path(self.cancel_dir, 1, 2)
+        os.makedirs(self.cancel_dir)
+        open(path, 'w').close()
+        self.assertEqual(cancel_requested(path), 'cancelled')
+
+    def test_no_cancel_file_configured(self):
+        self.assertIsNone(cancel_requested(None))
+
+    def test_rejects_non_digit_ids(self):
+        for term_id, question_id in (('../1', '2'), ('1', '2/..'), ('', '2'), ('1', '１２'), ('1', '-2')):
+            with self.assertRaises(ValueError):
+                cancel_path(self.cancel_dir, term_id, question_id)
+
+class CoverageTest(unittest.TestCase):
+
+    def test_coverage(self):
+        self.assertEqual(coverage({'covered_users': 30, 'total_users': 40}), 0.75)
+        self.assertEqual(coverage({'covered_users': 0, 'total_users': 0}), 1.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+"""tokenUsage：用量累加、费用估算和运行预算"""
+
+import io
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'AIProcess'))
+
+from tokenUsage import RunBudget, add_usage, build_usage_report_lines, new_usage, usage_cost
+
+API_CONFIG = {'model': 'main-model', 'timeout': 60}
+
+def usage_config(**overrides):
+    config = {'prompt_price_per_1k': 0.002, 'completion_price_per_1k': 0.006, 'currency': 'CNY',
+              'max_tokens_per_run': 0, 'max_cost_per_run': 0.0, 'on_exceed': 'stop', 'degrade_model': ''}
+    config.update(overrides)
+    return config
+
+def usage(prompt_tokens, completion_tokens, calls=1):
+    return dict(new_usage(), calls=calls, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+class UsageTest(unittest.TestCase):
+
+    def test_add_usage(self):
+        total = add_usage(new_usage(), usage(100, 20))
+        add_usage(total, {'calls': 2, 'prompt_tokens': None, 'taxonomy_chars': '30'})
+        self.assertEqual(total, {'calls': 3, 'prompt_tokens': 100, 'completion_tokens': 20, 'prompt_chars': 0,
+                                 'taxonomy_chars': 30})
+
+    def test_usage_cost(self):
+        self.assertAlmostEqual(usage_cost(usage(1000, 500), usage_config()), 0.005)
+
+class RunBudgetTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('sys.stdout', new_callable=io.StringIO)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_unlimited(self):
+        budget = RunBudget(usage_config())
+        budget.record(usage(10 ** 9, 10 ** 9))
+        self.assertFalse(budget.limited)
+        self.assertFalse(budget.exceeded)
+        self.assertIs(budget.api_config_for_call(API_CONFIG), API_CONFIG)
+
+    def test_token_limit_stops(self):
+        budget = RunBudget(usage_config(max_tokens_per_run=1000))
+        budget.record(usage(600, 300))
+        self.assertIs(budget.api_config_for_call(API_CONFIG), API_CONFIG)
+        budget.record(usage(80, 20))
+        self.assertTrue(budget.exceeded)
+        self.assertIsNone(budget.api_config_for_call(API_CONFIG))
+        self.assertEqual(budget.usage['calls'], 2)
+
+    def test_cost_limit(self):
+        budget = RunBudget(usage_config(max_cost_per_run=0.01))
+        budget.record(usage(1000, 1000))
+        self.assertFalse(budget.exceeded)
+        budget.record(usage(1000, 0))
+        self.assertTrue(budget.exceeded)
+
+    def test_degrade(self):
+        budget = RunBudget(usage_config(max_tokens_per_run=100, on_exceed='degrade', degrade_model='small-model'))
+        budget.record(usage(100, 0))
+        api_config = budget.api_config_for_call(API_CONFIG)
+        self.assertEqual(api_config, {'model': 'small-model', 'timeout': 60, 'force_model': True})
+        self.assertEqual(API_CONFIG['model'], 'main-model')
+
+    def test_degrade_without_model_stops(self):
+        budget = RunBudget(usage_config(max_tokens_per_run=100, on_exceed='degrade'))
+        budget.record(usage(100, 0))
+        self.assertFalse(budget.degrading)
+        self.assertIsNone(budget.api_config_for_call(API_CONFIG))
+
+class UsageReportTest(unittest.TestCase):
+
+    def test_report(self):
+        budget = RunBudget(usage_config(max_tokens_per_run=100))
+        total = dict(usage(3000, 600, calls=3), prompt_chars=10000, taxonomy_chars=2500)
+        with mock.patch('sys.stdout', new_callable=io.StringIO):
+            budget.record(total)
+        by_category = {'语法错误': usage(1000, 100), '逻辑错误': usage(2000, 500, calls=2)}
+        lines = build_usage_report_lines(total, usage_config(max_tokens_per_run=100), by_category, budget)
+        self.assertIn("合计tokens: 3600", lines)
+        self.assertIn("平均每次请求: 输入 1000 / 输出 200 tokens", lines)
+        self.assertIn("分类体系占提示词: 25.0% (约 750 输入tokens)", lines)
+        self.assertIn("估算费用: 0.0096 CNY", lines)
+        self.assertIn("运行预算: 100 tokens（已超出，超出后stop）", lines)
+        category_lines = [line for line in lines if line.startswith('  ')]
+        self.assertEqual(category_lines, ["  逻辑错误: 请求=2 输入=2000 输出=500", "  语法错误: 请求=1 输入=1000 输出=100"])
+
+    def test_report_without_calls(self):
+        lines = build_usage_report_lines(new_usage(), usage_config(prompt_price_per_1k=0, completion_price_per_1k=0))
+        self.assertIn("LLM请求: 0次", lines)
+        self.assertFalse(any(line.startswith(("平均", "估算费用", "运行预算")) for line in lines))
+
+if __name__ == '__main__':
+    unittest.main()